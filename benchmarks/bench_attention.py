@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Fused mx.fast.scaled_dot_product_attention vs the reference attention path.
+
+Checks numerical parity of the forward pass (training mask), prefill +
+cached decode, and ragged batched decode, then compares latency. Exits
+non-zero if any output differs by more than --atol.
+
+Usage:
+    python benchmarks/bench_attention.py [--model-dir model]
+"""
+
+import argparse
+import sys
+
+from common import load_bench_model, random_prompt, timeit
+
+import mlx.core as mx
+
+from model.model import left_pad
+
+
+def set_fast_sdpa(model, enabled):
+    for layer in model.layers:
+        layer.attention.use_fast_sdpa = enabled
+
+
+def decode_logits(model, prompt, n_tokens):
+    """Greedy prefill + decode, returning the stacked per-step logits."""
+    cache = model.make_cache(prompt.shape[0])
+    logits, cache = model._prefill(prompt, cache)
+    steps = [logits]
+    for _ in range(n_tokens - 1):
+        token = mx.argmax(logits, axis=-1)
+        logits, cache = model._decode_step(token[:, None], cache)
+        steps.append(logits)
+    return mx.stack(steps, axis=1)
+
+
+def batch_logits(model, prompts):
+    """Prefill logits for ragged, left-padded prompts."""
+    tokens, pads = left_pad(prompts, model.config.pad_token_id)
+    logits, _ = model._prefill(tokens, model.make_batch_cache(pads))
+    return logits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fused attention parity + latency")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--prompt-len", type=int, default=64)
+    parser.add_argument("--tokens", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    prompt = random_prompt(config, args.prompt_len, batch_size=2)
+    ragged = [random_prompt(config, n)[0].tolist() for n in (5, 17, 33)]
+
+    checks = {
+        "forward (training)": lambda: model(prompt),
+        "prefill + decode": lambda: decode_logits(model, prompt, args.tokens),
+        "ragged batch prefill": lambda: batch_logits(model, ragged),
+    }
+
+    failed = False
+    print(f"\n{'path':>22} | {'max |diff|':>10} | {'reference ms':>12} | {'fast ms':>8}")
+    print("-" * 62)
+    for name, fn in checks.items():
+        set_fast_sdpa(model, False)
+        ref = fn()
+        t_ref = timeit(lambda: mx.eval(fn()), repeats=args.repeats)
+        set_fast_sdpa(model, True)
+        out = fn()
+        t_fast = timeit(lambda: mx.eval(fn()), repeats=args.repeats)
+
+        diff = mx.abs(ref - out).max().item()
+        failed |= diff > args.atol
+        print(f"{name:>22} | {diff:>10.2e} | {t_ref * 1e3:>12.1f} | {t_fast * 1e3:>8.1f}")
+
+    if failed:
+        print("PARITY FAILED", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Throughput of the continuous-batching engine vs single-stream generate().
+
+N client threads each submit requests back-to-back to an in-process
+BatchEngine. Prompts have varying lengths so admission exercises ragged
+left-padded prefill. Early stopping is disabled so every request decodes
+exactly --tokens tokens.
+
+Before timing, checks that model.generate_batch on ragged prompts gives each
+row the same greedy tokens as generate() on its own, with profiling off and
+with spans recorded (exit 1 on a mismatch).
+
+Usage:
+    python benchmarks/bench_batching.py [--model-dir model] [--clients 1 8 32]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from common import PROJECT_ROOT, load_bench_model, random_prompt
+
+import mlx.core as mx
+
+from model import profiling
+from scripts.engine import BatchEngine
+
+
+def make_prompts(config, n):
+    return [random_prompt(config, 8 + (i * 7) % 24)[0].tolist() for i in range(n)]
+
+
+def single_stream(model, prompts, n_tokens):
+    never_end = model.config.vocab_size
+    start = time.perf_counter()
+    for prompt in prompts:
+        for token in model.generate(mx.array([prompt]), max_tokens=n_tokens,
+                                    temperature=0.0, end_token_id=never_end):
+            mx.eval(token)
+    return time.perf_counter() - start
+
+
+def check_generate_batch(model, prompts, n_tokens) -> bool:
+    """generate_batch rows == per-row generate(), with profiling off and on."""
+    never_end = model.config.vocab_size
+    reference = []
+    for prompt in prompts:
+        tokens = model.generate(mx.array([prompt]), max_tokens=n_tokens, temperature=0.0,
+                                end_token_id=never_end)
+        reference.append([t.item() for t in tokens])
+    ok = True
+    for label, context in (("off", None), ("on", profiling.record)):
+        if context is None:
+            rows = model.generate_batch(prompts, max_tokens=n_tokens, temperature=0.0, end_token_id=never_end)
+        else:
+            with context():
+                rows = model.generate_batch(prompts, max_tokens=n_tokens, temperature=0.0,
+                                            end_token_id=never_end)
+        same = rows == reference
+        ok &= same
+        print(f"generate_batch identical to generate() (profiling {label}): {same}")
+    return ok
+
+
+def batched(engine, prompts, n_tokens, n_clients):
+    per_client = [prompts[i::n_clients] for i in range(n_clients)]
+
+    def client(mine):
+        for prompt in mine:
+            engine.generate(prompt, max_tokens=n_tokens, temperature=0.0)
+
+    threads = [threading.Thread(target=client, args=(mine,)) for mine in per_client]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuous batching throughput benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests-per-client", type=int, default=2)
+    parser.add_argument("--tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    engine = BatchEngine(model, max_batch_size=max(args.clients))
+    # Never stop early so every request costs the same number of steps.
+    engine.stop_ids = set()
+    engine.start()
+
+    baseline_prompts = make_prompts(config, 4)
+    if not check_generate_batch(model, baseline_prompts, 8):
+        engine.stop()
+        print("OUTPUT MISMATCH", file=sys.stderr)
+        sys.exit(1)
+    single_stream(model, baseline_prompts[:1], 4)  # warmup
+    t = single_stream(model, baseline_prompts, args.tokens)
+    base_tps = len(baseline_prompts) * args.tokens / t
+    print(f"\nsingle-stream generate(): {base_tps:.1f} tok/s\n")
+
+    print(f"{'clients':>8} | {'req/s':>8} | {'tok/s':>8} | {'vs single':>9}")
+    print("-" * 44)
+    for n_clients in args.clients:
+        prompts = make_prompts(config, n_clients * args.requests_per_client)
+        t = batched(engine, prompts, args.tokens, n_clients)
+        tps = len(prompts) * args.tokens / t
+        print(f"{n_clients:>8d} | {len(prompts) / t:>8.2f} | {tps:>8.1f} | {tps / base_tps:>8.2f}x")
+
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Per-token decode latency: eager vs mx.compile'd decode step.
+
+Per-token latency is (t(N) - t(1)) / (N - 1), where t(n) is the wall-clock
+time of generate() producing n tokens, so prefill cost cancels out.
+
+Usage:
+    python benchmarks/bench_compile.py [--model-dir model] [--tokens 64]
+"""
+
+import argparse
+
+from common import load_bench_model, random_prompt, timeit
+
+import mlx.core as mx
+
+
+def run(model, prompt, n_tokens, temperature, top_p, compiled):
+    # An out-of-vocabulary end token disables early stopping.
+    never_end = model.config.vocab_size
+    for token in model.generate(prompt, max_tokens=n_tokens, temperature=temperature,
+                                top_p=top_p, end_token_id=never_end, compiled=compiled):
+        mx.eval(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled decode step benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--prompt-len", type=int, default=16)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    prompt = random_prompt(config, args.prompt_len)
+    n = args.tokens
+
+    print(f"\n{'sampler':>16} | {'eager ms/tok':>12} | {'compiled ms/tok':>15} | {'speedup':>7}")
+    print("-" * 60)
+    for name, temperature, top_p in [("greedy", 0.0, 1.0), ("top-p 0.9", 0.8, 0.9)]:
+        per_token = {}
+        for compiled in (False, True):
+            t_one = timeit(lambda: run(model, prompt, 1, temperature, top_p, compiled),
+                           repeats=args.repeats)
+            t_all = timeit(lambda: run(model, prompt, n, temperature, top_p, compiled),
+                           repeats=args.repeats)
+            per_token[compiled] = (t_all - t_one) / (n - 1)
+        print(
+            f"{name:>16} | {per_token[False] * 1e3:>12.2f} | {per_token[True] * 1e3:>15.2f} | "
+            f"{per_token[False] / per_token[True]:>6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Fused qkv_proj / w13 projections: logit parity and batch-1 decode latency.
+
+Checks that fuse_projections() leaves the forward-pass logits and greedy
+output unchanged (exits non-zero otherwise), then compares per-token decode
+latency of the separate and fused layouts.
+
+Usage:
+    python benchmarks/bench_fused.py [--model-dir model] [--tokens 64]
+"""
+
+import argparse
+import sys
+
+from common import load_bench_model, random_prompt, timeit
+
+import mlx.core as mx
+
+from model.model import fuse_projections
+
+
+def greedy(model, prompt, n_tokens):
+    # An out-of-vocabulary end token disables early stopping.
+    never_end = model.config.vocab_size
+    return [tok.item() for tok in model.generate(prompt, max_tokens=n_tokens, temperature=0.0,
+                                                  end_token_id=never_end, sync_every=8)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fused projection parity + latency")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--prompt-len", type=int, default=16)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--atol", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    prompt = random_prompt(config, args.prompt_len)
+
+    ref_logits = model(prompt)
+    ref_tokens = greedy(model, prompt, args.tokens)
+    t_one = timeit(lambda: greedy(model, prompt, 1), repeats=args.repeats)
+    t_sep = (timeit(lambda: greedy(model, prompt, args.tokens), repeats=args.repeats) - t_one)
+
+    fuse_projections(model)
+    fused_logits = model(prompt)
+    fused_tokens = greedy(model, prompt, args.tokens)
+    t_one = timeit(lambda: greedy(model, prompt, 1), repeats=args.repeats)
+    t_fused = (timeit(lambda: greedy(model, prompt, args.tokens), repeats=args.repeats) - t_one)
+
+    max_diff = mx.abs(ref_logits - fused_logits).max().item()
+    print(f"\nmax |logit diff|: {max_diff:.3g}")
+    print(f"greedy tokens identical: {ref_tokens == fused_tokens}")
+    per_tok = args.tokens - 1
+    print(f"separate: {t_sep / per_tok * 1e3:.2f} ms/token")
+    print(f"fused:    {t_fused / per_tok * 1e3:.2f} ms/token ({t_sep / t_fused:.2f}x)")
+
+    if max_diff > args.atol or ref_tokens != fused_tokens:
+        print("PARITY FAILED", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+HTTP keep-alive: request latency with and without connection reuse.
+
+Client-side load generator for a running server (scripts/server.py or
+scripts/async_server.py). Each of --clients threads sends its share of
+--requests one after another, either over one persistent HTTP/1.1
+connection (keep-alive) or over a new connection per request
+(`Connection: close`, paying the TCP handshake every call).
+
+Two workloads isolate the per-request transport cost:
+
+  health    GET /health
+  generate  POST /generate with the same greedy query every time, so after
+            the first request it is answered from the response cache
+
+Usage:
+    python scripts/server.py &
+    python benchmarks/bench_keepalive.py [--url http://127.0.0.1:39284] [--clients 1 8]
+"""
+
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def client(host, port, method, path, body, n, keep_alive, latencies, counts):
+    """Send `n` requests, appending per-request seconds to `latencies`."""
+    headers = {"Content-Type": "application/json"}
+    if not keep_alive:
+        headers["Connection"] = "close"
+    conn = None
+    for _ in range(n):
+        start = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            counts["connections"] += 1
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            counts["errors"] += 1
+            conn.close()
+            conn = None
+            continue
+        if response.status != 200:
+            counts["errors"] += 1
+        if response.will_close:
+            conn.close()
+            conn = None
+        latencies.append(time.perf_counter() - start)
+    if conn is not None:
+        conn.close()
+
+
+def run(host, port, method, path, body, requests, clients, keep_alive):
+    latencies, counts = [], {"connections": 0, "errors": 0}
+    per_client = max(1, requests // clients)
+    threads = [
+        threading.Thread(target=client, args=(host, port, method, path, body, per_client,
+                                              keep_alive, latencies, counts))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return sorted(latencies), elapsed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP keep-alive load generator")
+    parser.add_argument("--url", default="http://127.0.0.1:39284", help="Server base URL")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per run")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8],
+                        help="Concurrent client threads")
+    parser.add_argument("--query", default="open Safari", help="Query for the generate workload")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    workloads = {
+        "health": ("GET", "/health", None),
+        "generate": ("POST", "/generate", json.dumps({"query": args.query})),
+    }
+
+    # Also puts the generate query into the response cache
+    latencies, _, _ = run(host, port, *workloads["generate"], 1, 1, False)
+    if not latencies:
+        print(f"Cannot reach {args.url}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{'workload':>8} | {'clients':>7} | {'mode':>10} | {'mean ms':>7} | {'p50 ms':>6} | "
+          f"{'p90 ms':>6} | {'p99 ms':>6} | {'req/s':>7} | {'conns':>5} | errors")
+    print("-" * 96)
+    for name, (method, path, body) in workloads.items():
+        for clients in args.clients:
+            for mode, keep_alive in [("close", False), ("keep-alive", True)]:
+                latencies, elapsed, counts = run(host, port, method, path, body,
+                                                 args.requests, clients, keep_alive)
+                if not latencies:
+                    print(f"{name:>8} | {clients:>7} | {mode:>10} | all {counts['errors']} requests failed")
+                    continue
+                mean = sum(latencies) / len(latencies)
+                print(f"{name:>8} | {clients:>7} | {mode:>10} | {mean * 1e3:>7.2f} | "
+                      f"{percentile(latencies, 0.5) * 1e3:>6.2f} | "
+                      f"{percentile(latencies, 0.9) * 1e3:>6.2f} | "
+                      f"{percentile(latencies, 0.99) * 1e3:>6.2f} | "
+                      f"{len(latencies) / elapsed:>7.0f} | {counts['connections']:>5} | "
+                      f"{counts['errors']}")
+
+
+if __name__ == "__main__":
+    main()
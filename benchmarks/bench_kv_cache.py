@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Decode throughput: preallocated KVCache vs the legacy concatenate cache.
+
+The legacy path grows each layer's (keys, values) with mx.concatenate on every
+step, so the per-token cost grows with the output length. The KVCache path
+writes into buffers sized to max_seq_len.
+
+Usage:
+    python benchmarks/bench_kv_cache.py [--model-dir model] [--lengths 32 128 256]
+"""
+
+import argparse
+
+from common import load_bench_model, random_prompt, timeit
+
+import mlx.core as mx
+
+
+def decode_concat(model, prompt, n_tokens):
+    """Greedy decode with the legacy concatenate-based cache."""
+    logits, cache = model._prefill(prompt)
+    token = mx.argmax(logits, axis=-1)
+    mx.eval(token)
+    for _ in range(n_tokens - 1):
+        logits, cache = model._decode_step(token[:, None], cache)
+        token = mx.argmax(logits, axis=-1)
+        mx.eval(token)
+
+
+def decode_kv_cache(model, prompt, n_tokens):
+    """Greedy decode through generate() with the preallocated KVCache."""
+    # An out-of-vocabulary end token disables early stopping.
+    never_end = model.config.vocab_size
+    for token in model.generate(prompt, max_tokens=n_tokens, temperature=0.0,
+                                end_token_id=never_end):
+        mx.eval(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KV cache decode benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--prompt-len", type=int, default=16)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[32, 128, 256])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    prompt = random_prompt(config, args.prompt_len)
+
+    print(f"\n{'tokens':>8} | {'concat tok/s':>12} | {'kvcache tok/s':>13} | {'speedup':>7}")
+    print("-" * 50)
+    for n in args.lengths:
+        t_concat = timeit(lambda: decode_concat(model, prompt, n), repeats=args.repeats)
+        t_cache = timeit(lambda: decode_kv_cache(model, prompt, n), repeats=args.repeats)
+        print(
+            f"{n:>8d} | {n / t_concat:>12.1f} | {n / t_cache:>13.1f} | "
+            f"{t_concat / t_cache:>6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
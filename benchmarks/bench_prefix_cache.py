@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Prefix KV-cache reuse: prefill tokens saved and time to first token.
+
+Replays the seed inputs, each prefixed with a conversational lead-in
+("hey can you", "please", ...), through generate() with and without a
+PrefixCache. Reports the fraction of prompt tokens reused, mean time to the
+first token, and checks that the generated tokens are identical.
+
+Usage:
+    python benchmarks/bench_prefix_cache.py [--model-dir model] [--num-queries 100]
+"""
+
+import argparse
+import sys
+import time
+
+from common import encode_prompt, load_bench_model, load_seed_pairs, load_tokenizer
+
+import mlx.core as mx
+
+from model.prefix_cache import PrefixCache
+
+LEAD_INS = ["", "hey can you ", "please ", "could you please ", "hey rune, "]
+
+
+def first_tokens(model, prompts, n_tokens, prefix_cache=None):
+    """(mean seconds to first token, generated ids) over `prompts`."""
+    never_end = model.config.vocab_size
+    elapsed, outputs = 0.0, []
+    for prompt in prompts:
+        start = time.perf_counter()
+        gen = model.generate(mx.array([prompt]), max_tokens=n_tokens, temperature=0.0,
+                             end_token_id=never_end, prefix_cache=prefix_cache)
+        ids = [next(gen).item()]
+        elapsed += time.perf_counter() - start
+        ids += [t.item() for t in gen]
+        outputs.append(ids)
+    return elapsed / len(prompts), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefix KV-cache benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--max-tokens", type=int, default=8)
+    parser.add_argument("--cache-mb", type=float, nargs="+", default=[1, 64])
+    args = parser.parse_args()
+
+    model, _ = load_bench_model(args.model_dir)
+    tokenizer = load_tokenizer(args.model_dir)
+    pairs = load_seed_pairs()[:args.num_queries]
+    prompts = [encode_prompt(tokenizer, LEAD_INS[i % len(LEAD_INS)] + p["input"])
+               for i, p in enumerate(pairs)]
+
+    first_tokens(model, prompts[:2], 2)  # warmup
+    base_s, reference = first_tokens(model, prompts, args.max_tokens)
+    print(f"\n{len(prompts)} prompts, mean length "
+          f"{sum(map(len, prompts)) / len(prompts):.1f} tokens")
+    print(f"no prefix cache: {base_s * 1e3:.2f} ms to first token\n")
+
+    print(f"{'cache MB':>8} | {'reused':>6} | {'hits':>5} | {'evicted':>7} | "
+          f"{'TTFT ms':>7} | {'speedup':>7} | identical")
+    print("-" * 66)
+    mismatch = False
+    for mb in args.cache_mb:
+        prefix_cache = PrefixCache(max_bytes=int(mb * 1024 * 1024))
+        seconds, outputs = first_tokens(model, prompts, args.max_tokens, prefix_cache)
+        stats = prefix_cache.stats()
+        same = outputs == reference
+        mismatch |= not same
+        print(f"{mb:>8g} | {stats['reused_fraction']:>6.1%} | {stats['hits']:>5} | "
+              f"{stats['evictions']:>7} | {seconds * 1e3:>7.2f} | "
+              f"{base_s / seconds:>6.2f}x | {same}")
+
+    if mismatch:
+        print("OUTPUT MISMATCH", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
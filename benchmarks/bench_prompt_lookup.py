@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Prompt-lookup / n-gram speculative decoding: tokens per forward pass.
+
+Two measurements on the seed inputs:
+
+  oracle  replays each reference output as if the model had produced it and
+          counts how many drafted tokens match. This is the tokens per
+          forward pass a model that has learned the seed set would get, and it
+          does not depend on the weights.
+  model   runs greedy generate() with and without a PromptLookupProposer,
+          checks that outputs are identical, and reports tokens per pass and
+          latency. Without trained weights the model's output is noise and
+          almost nothing is accepted.
+
+The n-gram table is mined from data/*.jsonl, which includes the seed set, as
+it would be from the training data in deployment.
+
+Usage:
+    python benchmarks/bench_prompt_lookup.py [--model-dir model] [--draft-tokens 2 4 8]
+"""
+
+import argparse
+import sys
+import time
+
+from common import encode_prompt, load_bench_model, load_seed_pairs, load_tokenizer
+
+import mlx.core as mx
+
+from model.speculative import PromptLookupProposer, SpeculativeStats
+from scripts.inference import load_ngram_table
+
+
+def oracle_tokens_per_pass(proposer, tokenizer, config, pairs, k):
+    """Tokens emitted per verification pass if the model always matched the reference."""
+    steps = emitted = 0
+    for pair in pairs:
+        history = encode_prompt(tokenizer, pair["input"])
+        reference = tokenizer.encode(f" {pair['output']} ").ids + [config.end_token_id]
+        history.append(reference[0])
+        i = 1
+        while i < len(reference):
+            drafts = proposer.propose(history, k)
+            accepted = 0
+            while (accepted < len(drafts) and i + accepted < len(reference)
+                   and drafts[accepted] == reference[i + accepted]):
+                accepted += 1
+            n = min(accepted + 1, len(reference) - i)
+            history += reference[i:i + n]
+            i += n
+            steps += 1
+            emitted += n
+    return emitted / max(steps, 1)
+
+
+def run(model, prompt, max_tokens, proposer=None, k=4, stats=None):
+    ids = []
+    for tok in model.generate(mx.array([prompt]), max_tokens=max_tokens, temperature=0.0,
+                              sync_every=8, proposer=proposer, num_draft_tokens=k,
+                              spec_stats=stats):
+        t = tok.item()
+        if t == model.config.end_token_id:
+            break
+        ids.append(t)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt-lookup decoding benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--num-queries", type=int, default=20,
+                        help="Seed inputs generated with the model (the oracle uses all)")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    tokenizer = load_tokenizer(args.model_dir)
+    pairs = load_seed_pairs()
+
+    start = time.perf_counter()
+    table = load_ngram_table(tokenizer, config)
+    print(f"Mined {len(table)} n-grams in {(time.perf_counter() - start) * 1e3:.0f} ms")
+
+    print(f"\nOracle on {len(pairs)} seed pairs (tokens per forward pass)")
+    print(f"{'k':>3} | {'copy only':>9} | {'table+copy':>10}")
+    print("-" * 28)
+    for k in args.draft_tokens:
+        copy_only = oracle_tokens_per_pass(PromptLookupProposer(), tokenizer, config, pairs, k)
+        full = oracle_tokens_per_pass(PromptLookupProposer(table), tokenizer, config, pairs, k)
+        print(f"{k:>3} | {copy_only:>9.2f} | {full:>10.2f}")
+
+    prompts = [encode_prompt(tokenizer, p["input"]) for p in pairs[:args.num_queries]]
+    run(model, prompts[0], 4)  # warmup
+    start = time.perf_counter()
+    reference = [run(model, p, args.max_tokens) for p in prompts]
+    base_ms = (time.perf_counter() - start) / len(prompts) * 1e3
+    print(f"\nModel on {len(prompts)} seed inputs; greedy baseline: {base_ms:.1f} ms/query\n")
+
+    print(f"{'k':>3} | {'tokens/pass':>11} | {'accept %':>8} | {'ms/query':>8} | "
+          f"{'speedup':>7} | identical")
+    print("-" * 62)
+    mismatch = False
+    for k in args.draft_tokens:
+        stats = SpeculativeStats()
+        proposer = PromptLookupProposer(table)
+        start = time.perf_counter()
+        outputs = [run(model, p, args.max_tokens, proposer, k, stats) for p in prompts]
+        ms = (time.perf_counter() - start) / len(prompts) * 1e3
+        same = outputs == reference
+        mismatch |= not same
+        print(f"{k:>3} | {stats.tokens_per_step:>11.2f} | {stats.acceptance_rate:>8.1%} | "
+              f"{ms:>8.1f} | {base_ms / ms:>6.2f}x | {same}")
+
+    if mismatch:
+        print("OUTPUT MISMATCH", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Response cache: key normalization and lookup cost.
+
+Fills a ResponseCache with the seed pairs, then checks that
+
+  - polite variants of each seed input ("please ...", "can you ...?",
+    "..., thanks!") hit and return that input's script, and
+  - queries that differ only in a trailing argument word ("say hi" / "say
+    thanks" / "say", "type ok" / "type") or in the case or punctuation of
+    text the script quotes ('type "ABC"' / 'type "abc"') never share an entry
+
+and reports the hit rate and get/put latency. Exits 1 if a check fails.
+
+Usage:
+    python benchmarks/bench_response_cache.py
+"""
+
+import json
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from scripts.response_cache import ResponseCache, normalize_query
+
+SEED_PAIRS = os.path.join(PROJECT_ROOT, "data", "seed_pairs.jsonl")
+
+VARIANTS = ("please {}", "can you {}?", "{}, thanks!", "Hey, {}, please.", "  {}  ")
+
+# (cached query, cached script, queries that must miss)
+COLLISIONS = [
+    ("say hi", 'say "hi"', ["say thanks", "say", "say okay", "say hey"]),
+    ("say thank you", 'say "thank you"', ["say", "say thanks", "say please"]),
+    ("type ok", 'tell application "System Events" to keystroke "ok"',
+     ["type", "type okay", "type hi"]),
+    ("search for hey", 'open location "https://www.google.com/search?q=hey"',
+     ["search for", "search for hi"]),
+    ('type "ABC"', 'tell application "System Events" to keystroke "ABC"',
+     ['type "abc"', "type abc", "Type aBC"]),
+    ('say "Hello"', 'say "Hello"', ['say "hello"', "say HELLO", "please say hello"]),
+    ("note buy milk, eggs", 'make new note with properties {body:"buy milk, eggs"}',
+     ["note buy milk eggs"]),
+]
+
+
+def main():
+    with open(SEED_PAIRS) as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    # Inputs that normalize alike map to one entry; keep the last script for each key
+    scripts = {normalize_query(p["input"]): p["output"] for p in pairs}
+
+    cache = ResponseCache(max_entries=len(pairs) * 2)
+    start = time.perf_counter()
+    for p in pairs:
+        cache.put(p["input"], p["output"])
+    put_us = (time.perf_counter() - start) / len(pairs) * 1e6
+
+    failures = []
+    hits = lookups = 0
+    start = time.perf_counter()
+    for p in pairs:
+        for variant in VARIANTS:
+            query = variant.format(p["input"])
+            script = cache.get(query)
+            lookups += 1
+            if script is None:
+                continue
+            hits += 1
+            if script != scripts[normalize_query(p["input"])]:
+                failures.append(f"{query!r} returned another input's script")
+    get_us = (time.perf_counter() - start) / lookups * 1e6
+
+    for cached, script, others in COLLISIONS:
+        cache = ResponseCache()
+        cache.put(cached, script)
+        if cache.get(cached) != script:
+            failures.append(f"{cached!r} missed its own entry")
+        for query in others:
+            if cache.get(query) is not None:
+                failures.append(f"{query!r} hit the entry for {cached!r}")
+
+    print(f"{len(pairs)} seed pairs, {len(scripts)} keys")
+    print(f"polite variants: {hits}/{lookups} hits ({hits / lookups:.1%})")
+    print(f"get {get_us:.1f} us, put {put_us:.1f} us")
+    print(f"collision checks: {sum(len(c[2]) for c in COLLISIONS)} queries, "
+          f"{len(failures)} failures")
+    if failures:
+        for failure in failures:
+            print(f"  {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Early PASS_TO_CLOUD routing: decision quality and latency.
+
+Uses data/seed_pairs_v2.jsonl, whose outputs include PASS_TO_CLOUD. For each
+threshold, every input goes through generate(router=...) and the benchmark
+reports:
+
+  routed     share of queries answered right after prefill
+  precision  routed queries whose reference output is PASS_TO_CLOUD
+  recall     PASS_TO_CLOUD references that were routed
+  cloud ms   mean latency of PASS_TO_CLOUD-reference queries
+  other ms   mean latency of the remaining queries (fallback to decoding)
+
+The "off" row decodes everything. Threshold 0 routes every query and shows
+the latency floor of the early exit. Untrained models never reach a useful
+threshold, so only the "off" and 0 rows are meaningful without weights.
+
+Usage:
+    python benchmarks/bench_routing.py [--model-dir model] [--thresholds 0.5 0.9]
+"""
+
+import argparse
+import os
+import time
+
+from common import DATA_DIR, encode_prompt, load_bench_model, load_seed_pairs, load_tokenizer
+
+import mlx.core as mx
+
+from model.routing import CLOUD_OUTPUT, CloudRouter
+
+
+def run(model, prompt, max_tokens, router=None):
+    ids = []
+    for tok in model.generate(mx.array([prompt]), max_tokens=max_tokens, temperature=0.0,
+                              sync_every=8, router=router):
+        t = tok.item()
+        if t == model.config.end_token_id:
+            break
+        ids.append(t)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Early routing benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--num-queries", type=int, default=120)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.0, 0.5, 0.9, 0.99])
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    tokenizer = load_tokenizer(args.model_dir)
+    pairs = load_seed_pairs(os.path.join(DATA_DIR, "seed_pairs_v2.jsonl"))
+    # Keep all PASS_TO_CLOUD pairs, fill up with the rest
+    cloud = [p for p in pairs if p["output"].strip() == CLOUD_OUTPUT]
+    other = [p for p in pairs if p["output"].strip() != CLOUD_OUTPUT]
+    n_cloud = min(len(cloud), args.num_queries // 2)
+    pairs = cloud[:n_cloud] + other[:args.num_queries - n_cloud]
+    prompts = [encode_prompt(tokenizer, p["input"]) for p in pairs]
+    is_cloud = [p["output"].strip() == CLOUD_OUTPUT for p in pairs]
+
+    source = "route head" if config.route_head else "first-token probability"
+    print(f"{len(pairs)} queries ({sum(is_cloud)} PASS_TO_CLOUD), router: {source}\n")
+    run(model, prompts[0], 4)  # warmup
+
+    print(f"{'threshold':>9} | {'routed':>6} | {'precision':>9} | {'recall':>6} | "
+          f"{'cloud ms':>8} | {'other ms':>8}")
+    print("-" * 62)
+    for threshold in [None] + args.thresholds:
+        router = CloudRouter.from_tokenizer(tokenizer, threshold) if threshold is not None else None
+        times, routed = [], []
+        for prompt in prompts:
+            start = time.perf_counter()
+            run(model, prompt, args.max_tokens, router)
+            times.append(time.perf_counter() - start)
+            if router is not None:
+                routed.append(router.stats.routed > sum(routed))
+        routed = routed or [False] * len(prompts)
+
+        hits = sum(r and c for r, c in zip(routed, is_cloud))
+        precision = hits / sum(routed) if any(routed) else 0.0
+        recall = hits / max(sum(is_cloud), 1)
+        cloud_ms = sum(t for t, c in zip(times, is_cloud) if c) / max(sum(is_cloud), 1) * 1e3
+        other_ms = (sum(t for t, c in zip(times, is_cloud) if not c)
+                    / max(len(times) - sum(is_cloud), 1) * 1e3)
+        name = "off" if threshold is None else f"{threshold:g}"
+        print(f"{name:>9} | {sum(routed) / len(routed):>6.1%} | {precision:>9.1%} | "
+              f"{recall:>6.1%} | {cloud_ms:>8.1f} | {other_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Speculative decoding with a draft model: acceptance and end-to-end latency.
+
+Runs greedy generation on the seed inputs with and without a
+DraftModelProposer, checks that outputs are identical, and reports tokens
+accepted per verification step and mean latency per query.
+
+Without trained weights both models are random and the draft is almost never
+accepted; pass --self-draft to use the main model as its own draft, which
+shows the upper bound (every proposal accepted).
+
+Usage:
+    python benchmarks/bench_speculative.py [--model-dir model] [--draft-model-dir model/draft]
+"""
+
+import argparse
+import sys
+import time
+
+from common import encode_prompt, load_bench_model, load_seed_pairs, load_tokenizer
+
+import mlx.core as mx
+
+from model.model import ModelConfig
+from model.speculative import DraftModelProposer, SpeculativeStats
+
+DRAFT_CONFIG = dict(n_layers=2, d_model=128, n_heads=2, d_ff=512)
+
+
+def run(model, prompt, max_tokens, proposer=None, k=4, stats=None):
+    ids = []
+    for tok in model.generate(mx.array([prompt]), max_tokens=max_tokens, temperature=0.0,
+                              sync_every=8, proposer=proposer, num_draft_tokens=k,
+                              spec_stats=stats):
+        t = tok.item()
+        if t == model.config.end_token_id:
+            break
+        ids.append(t)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative decoding benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--draft-model-dir", default="model/draft")
+    parser.add_argument("--self-draft", action="store_true",
+                        help="Use the main model as the draft (upper bound)")
+    parser.add_argument("--num-queries", type=int, default=20)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4, 6])
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    if args.self_draft:
+        draft = model
+    else:
+        draft_config = ModelConfig(**{**config.__dict__, **DRAFT_CONFIG, "quantization": None})
+        draft, _ = load_bench_model(args.draft_model_dir, seed=1, config=draft_config)
+    tokenizer = load_tokenizer(args.model_dir)
+    prompts = [encode_prompt(tokenizer, p["input"]) for p in load_seed_pairs()[:args.num_queries]]
+
+    run(model, prompts[0], 4)  # warmup
+    start = time.perf_counter()
+    reference = [run(model, p, args.max_tokens) for p in prompts]
+    base_ms = (time.perf_counter() - start) / len(prompts) * 1e3
+    print(f"\ngreedy baseline: {base_ms:.1f} ms/query\n")
+
+    print(f"{'k':>3} | {'accepted/step':>13} | {'tokens/pass':>11} | {'accept %':>8} | "
+          f"{'ms/query':>8} | {'speedup':>7} | identical")
+    print("-" * 78)
+    mismatch = False
+    for k in args.draft_tokens:
+        stats = SpeculativeStats()
+        start = time.perf_counter()
+        outputs = [run(model, p, args.max_tokens, DraftModelProposer(draft), k, stats)
+                   for p in prompts]
+        ms = (time.perf_counter() - start) / len(prompts) * 1e3
+        same = outputs == reference
+        mismatch |= not same
+        print(f"{k:>3} | {stats.accepted / max(stats.steps, 1):>13.2f} | "
+              f"{stats.tokens_per_step:>11.2f} | {stats.acceptance_rate:>8.1%} | "
+              f"{ms:>8.1f} | {base_ms / ms:>6.2f}x | {same}")
+
+    if mismatch:
+        print("OUTPUT MISMATCH", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Server startup: time to ready and time to first token.
+
+Starts scripts/async_server.py --runs times and measures, from process
+start:
+
+  ready_s         until GET /health answers (imports, model + tokenizer
+                  load, the options' tables, warmup)
+  first_token_s   until the first streamed token of a first /generate
+  first_reply_s   until that response is complete
+
+and the first request's own latency (request_ttft_ms, request_total_ms).
+Run it before and after scripts/snapshot.py, or with different warmup
+options, to compare cold starts.
+
+Usage:
+    python benchmarks/bench_startup.py [--model-dir model] [--runs 3] [-- extra server options]
+    python benchmarks/bench_startup.py -- --constrained --warmup-lengths
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(port, process, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/health")
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError("server not ready")
+
+
+def first_request(port, query):
+    """(seconds to the first streamed token, seconds to the final event)."""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    conn.request("POST", "/generate?stream=1", body=json.dumps({"query": query}),
+                 headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    first_token = None
+    for line in response:
+        if not line.startswith(b"data: "):
+            continue
+        event = json.loads(line[len(b"data: "):])
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        if event.get("done"):
+            break
+    conn.close()
+    return first_token, time.perf_counter() - start
+
+
+def measure(args) -> dict:
+    command = [sys.executable, os.path.join(PROJECT_ROOT, "scripts", "async_server.py"),
+               "--model-dir", args.model_dir, "--port", str(args.port), "--cache-size", "0"] + args.server_args
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        wait_ready(args.port, process)
+        ready = time.perf_counter() - start
+        ttft, total = first_request(args.port, args.query)
+        time.sleep(0.2)  # let the server finish closing the connection before stopping it
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait()
+    return {"ready_s": ready, "first_token_s": ready + ttft, "first_reply_s": ready + total,
+            "request_ttft_ms": ttft * 1e3, "request_total_ms": total * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server startup benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--runs", type=int, default=3, help="Server starts (median reported)")
+    parser.add_argument("--query", default="open Safari and go to apple.com")
+    parser.add_argument("--port", type=int, default=39291)
+    parser.add_argument("server_args", nargs="*", help="Extra scripts/async_server.py options (after --)")
+    args = parser.parse_args()
+
+    snapshot = [name for name in ("weights.safetensors", "grammar_states.json")
+                if os.path.exists(os.path.join(args.model_dir, name))]
+    print(f"{args.model_dir} (snapshot: {', '.join(snapshot) or 'none'}), "
+          f"server options: {' '.join(args.server_args) or 'defaults'}\n")
+    print(f"{'run':>4} | {'ready s':>8} | {'1st token s':>11} | {'1st reply s':>11} | "
+          f"{'req TTFT ms':>11} | {'req total ms':>12}")
+    print("-" * 73)
+    samples = []
+    for i in range(args.runs):
+        sample = measure(args)
+        samples.append(sample)
+        print(f"{i + 1:>4} | {sample['ready_s']:>8.2f} | {sample['first_token_s']:>11.2f} | "
+              f"{sample['first_reply_s']:>11.2f} | {sample['request_ttft_ms']:>11.1f} | "
+              f"{sample['request_total_ms']:>12.1f}")
+    median = {key: sorted(s[key] for s in samples)[len(samples) // 2] for key in samples[0]}
+    print("-" * 73)
+    print(f"{'p50':>4} | {median['ready_s']:>8.2f} | {median['first_token_s']:>11.2f} | "
+          f"{median['first_reply_s']:>11.2f} | {median['request_ttft_ms']:>11.1f} | "
+          f"{median['request_total_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
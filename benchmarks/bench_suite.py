@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Reproducible inference benchmark suite with JSON output and regression compare.
+
+`run` measures, with a fixed seed and medians over --repeats:
+
+  cold_start       fresh interpreter: imports, model + tokenizer load, first
+                   generated token (median of --cold-starts subprocesses)
+  prefill_ms       prompt forward pass per prompt length
+  decode           per-token decode latency after a 16-token prompt
+  end_to_end       scripts/inference.generate() over the seed inputs (greedy):
+                   latency percentiles and per-stage means (StageTimings)
+  throughput       BatchEngine requests/s and tokens/s per batch size
+  memory           MLX peak memory and process peak RSS
+
+Works on CPU-only Linux; without trained weights in --model-dir the model is
+randomly initialized (see common.py), so outputs run to --max-tokens.
+
+`compare` reads two result files and flags every metric that got worse by
+more than --threshold (latency and memory up, throughput down), ignoring
+latency changes under --min-ms; it exits with status 1 if any did.
+
+Usage:
+    python benchmarks/bench_suite.py run [--model-dir model] [--output results.json]
+    python benchmarks/bench_suite.py compare base.json new.json [--threshold 0.1]
+"""
+
+import time
+
+STARTED = time.perf_counter()  # before the heavy imports, for the cold-start child
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+
+from common import (
+    PROJECT_ROOT, encode_prompt, load_bench_model, load_seed_pairs, load_tokenizer, random_prompt, timeit,
+)
+
+import mlx.core as mx
+
+from model.model import StageTimings
+from scripts.engine import BatchEngine
+from scripts.inference import generate, weights_path
+
+# Metric names containing one of these are better when higher
+HIGHER_IS_BETTER = ("per_sec",)
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def latency_summary(seconds: list) -> dict:
+    values = sorted(seconds)
+    return {
+        "mean_ms": sum(values) / len(values) * 1e3,
+        "p50_ms": percentile(values, 0.5) * 1e3,
+        "p90_ms": percentile(values, 0.9) * 1e3,
+        "p99_ms": percentile(values, 0.99) * 1e3,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def cold_start_child(model_dir: str):
+    """Runs in a fresh interpreter: print the startup breakdown as JSON."""
+    imported = time.perf_counter()
+    model, config = load_bench_model(model_dir)
+    tokenizer = load_tokenizer(model_dir)
+    loaded = time.perf_counter()
+    prompt = mx.array([encode_prompt(tokenizer, "open Safari")])
+    for token in model.generate(prompt, max_tokens=1, temperature=0.0):
+        mx.eval(token)
+    print(json.dumps({
+        "imports_s": imported - STARTED,
+        "load_s": loaded - imported,
+        "first_token_s": time.perf_counter() - loaded,
+    }))
+
+
+def measure_cold_start(model_dir: str, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "cold-start-child",
+                              "--model-dir", model_dir], capture_output=True, text=True, check=True)
+        sample = json.loads(out.stdout.strip().splitlines()[-1])
+        sample["total_s"] = time.perf_counter() - start
+        samples.append(sample)
+    return {key: sorted(s[key] for s in samples)[len(samples) // 2] for key in samples[0]}
+
+
+def measure_prefill(model, config, lengths: list, repeats: int) -> dict:
+    results = {}
+    for length in lengths:
+        if length >= config.max_seq_len:
+            continue
+        prompt = random_prompt(config, length)
+
+        def prefill():
+            h, _ = model._forward_cached(prompt, model.make_cache(1))
+            mx.eval(model.lm_head(h[:, -1]))
+
+        results[str(length)] = timeit(prefill, repeats=repeats) * 1e3
+    return results
+
+
+def measure_decode(model, config, n_tokens: int, repeats: int) -> dict:
+    prompt = random_prompt(config, 16)
+    never_end = config.vocab_size  # an out-of-vocabulary end token disables early stopping
+    samples = []
+    for i in range(repeats + 1):
+        timings = StageTimings()
+        start = time.perf_counter()
+        count = 0
+        for token in model.generate(prompt, max_tokens=n_tokens, temperature=0.0,
+                                    end_token_id=never_end, timings=timings):
+            mx.eval(token)
+            count += 1
+        if i:  # the first run is warmup
+            samples.append((time.perf_counter() - start - timings.prefill) / max(1, count - 1))
+    per_token = sorted(samples)[len(samples) // 2]
+    return {"ms_per_token": per_token * 1e3, "tokens_per_sec": 1 / per_token}
+
+
+def measure_end_to_end(model, tokenizer, config, queries: list, max_tokens: int) -> dict:
+    generate(model, tokenizer, config, queries[0], max_tokens=max_tokens, temperature=0.0)  # warmup
+    latencies, total = [], StageTimings()
+    for query in queries:
+        timings = StageTimings()
+        start = time.perf_counter()
+        generate(model, tokenizer, config, query, max_tokens=max_tokens, temperature=0.0, timings=timings)
+        latencies.append(time.perf_counter() - start)
+        total.add(timings)
+    stages = {f"{stage}_ms": getattr(total, stage) / len(queries) * 1e3 for stage in StageTimings.STAGES
+              if stage != "queue"}
+    return {"queries": len(queries), **latency_summary(latencies), "stages": stages,
+            "output_tokens_mean": total.output_tokens / len(queries),
+            "decode_tokens_per_sec": total.decode_tokens_per_sec}
+
+
+def measure_throughput(model, config, batch_sizes: list, n_tokens: int, requests_per_slot: int) -> dict:
+    results = {}
+    for batch_size in batch_sizes:
+        engine = BatchEngine(model, max_batch_size=batch_size)
+        engine.stop_ids = set()  # every request decodes exactly n_tokens
+        engine.start()
+        try:
+            prompts = [random_prompt(config, 8 + (i * 7) % 24)[0].tolist()
+                       for i in range(batch_size * requests_per_slot)]
+            engine.generate(prompts[0], max_tokens=2)  # warmup
+
+            def client(mine):
+                for prompt in mine:
+                    engine.generate(prompt, max_tokens=n_tokens, temperature=0.0)
+
+            threads = [threading.Thread(target=client, args=(prompts[i::batch_size],))
+                       for i in range(batch_size)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            engine.stop()
+        results[str(batch_size)] = {
+            "requests_per_sec": len(prompts) / elapsed,
+            "tokens_per_sec": len(prompts) * n_tokens / elapsed,
+        }
+    return results
+
+
+def measure_memory() -> dict:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 1024 if sys.platform != "darwin" else rss / (1024 * 1024)
+    return {"mlx_peak_mb": mx.get_peak_memory() / (1024 * 1024), "peak_rss_mb": rss_mb}
+
+
+def metadata(args, config) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    weights = weights_path(args.model_dir)
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "mlx": mx.__version__,
+        "device": str(mx.default_device()),
+        "weights": weights if os.path.exists(weights) else "random",
+        "model": {"n_layers": config.n_layers, "d_model": config.d_model, "vocab_size": config.vocab_size},
+        "seed": args.seed,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Compare
+# ---------------------------------------------------------------------------
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """{"a": {"b": 1}} -> {"a.b": 1}, numeric leaves only."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def milliseconds(name: str, value: float) -> float:
+    """`value` in ms for a latency metric (by its _ms/_s suffix), else None."""
+    if name.endswith("_ms") or name.startswith("prefill_ms."):
+        return value
+    if name.endswith("_s"):
+        return value * 1e3
+    return None
+
+
+def compare(base_path: str, new_path: str, threshold: float, min_ms: float = 0.0) -> int:
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    for key in ("commit", "platform", "weights"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"note: {key} differs ({base['meta'].get(key)} -> {new['meta'].get(key)})")
+    old_metrics, new_metrics = flatten(base["results"]), flatten(new["results"])
+
+    regressions = 0
+    print(f"{'metric':<44} | {'base':>10} | {'new':>10} | {'change':>8} |")
+    print("-" * 84)
+    for name in sorted(old_metrics.keys() & new_metrics.keys()):
+        old, value = old_metrics[name], new_metrics[name]
+        if name.endswith(("queries", "output_tokens_mean")):
+            continue  # workload description, not a measurement
+        change = (value - old) / old if old else 0.0
+        higher_is_better = any(marker in name for marker in HIGHER_IS_BETTER)
+        worse = -change if higher_is_better else change
+        delta_ms = milliseconds(name, abs(value - old))
+        if delta_ms is not None and delta_ms < min_ms:
+            worse = 0.0  # below timer noise
+        flag = "REGRESSION" if worse > threshold else ("improved" if worse < -threshold else "")
+        regressions += flag == "REGRESSION"
+        print(f"{name:<44} | {old:>10.3f} | {value:>10.3f} | {change:>+7.1%} | {flag}")
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def run(args):
+    mx.random.seed(args.seed)
+    model, config = load_bench_model(args.model_dir, seed=args.seed)
+    tokenizer = load_tokenizer(args.model_dir)
+    queries = [p["input"] for p in load_seed_pairs()][:args.queries]
+
+    results = {}
+    print("cold start...", flush=True)
+    results["cold_start"] = measure_cold_start(args.model_dir, args.cold_starts)
+    print("prefill...", flush=True)
+    results["prefill_ms"] = measure_prefill(model, config, args.prompt_lengths, args.repeats)
+    print("decode...", flush=True)
+    results["decode"] = measure_decode(model, config, args.decode_tokens, args.repeats)
+    print(f"end to end ({len(queries)} seed queries)...", flush=True)
+    results["end_to_end"] = measure_end_to_end(model, tokenizer, config, queries, args.max_tokens)
+    print("batched throughput...", flush=True)
+    results["throughput"] = measure_throughput(model, config, args.batch_sizes, args.decode_tokens,
+                                               args.requests_per_slot)
+    results["memory"] = measure_memory()
+
+    report = {"meta": metadata(args, config), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"\nResults written to {args.output}")
+    print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rune-lm benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the suite and write JSON results")
+    run_parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    run_parser.add_argument("--output", default=None, help="Write results JSON here")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeats", type=int, default=5, help="Timed runs per measurement (median)")
+    run_parser.add_argument("--cold-starts", type=int, default=3, help="Cold-start subprocesses (median)")
+    run_parser.add_argument("--prompt-lengths", type=int, nargs="+", default=[8, 16, 32, 64, 128])
+    run_parser.add_argument("--decode-tokens", type=int, default=32)
+    run_parser.add_argument("--queries", type=int, default=100, help="Seed queries for end to end")
+    run_parser.add_argument("--max-tokens", type=int, default=64, help="Output cap for end to end")
+    run_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument("--requests-per-slot", type=int, default=2)
+
+    compare_parser = sub.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="Relative change counted as a regression")
+    compare_parser.add_argument("--min-ms", type=float, default=0.5,
+                                help="Latency changes smaller than this are noise")
+
+    child_parser = sub.add_parser("cold-start-child")
+    child_parser.add_argument("--model-dir", default="model")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        sys.exit(compare(args.base, args.new, args.threshold, args.min_ms))
+    else:
+        cold_start_child(args.model_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+End-to-end generate() latency with per-token vs chunked end-of-sequence checks.
+
+sync_every=1 checks for <|end|> after every token, forcing a device->host
+sync (and the caller's tok.item() adds another). sync_every=k dispatches k
+steps with mx.async_eval between checks.
+
+Usage:
+    python benchmarks/bench_sync.py [--model-dir model] [--tokens 32 64]
+"""
+
+import argparse
+
+from common import load_bench_model, random_prompt, timeit
+
+import mlx.core as mx
+
+
+def run(model, prompt, n_tokens, sync_every):
+    # An out-of-vocabulary end token disables early stopping.
+    never_end = model.config.vocab_size
+    out = []
+    for tok in model.generate(prompt, max_tokens=n_tokens, temperature=0.0,
+                              end_token_id=never_end, sync_every=sync_every):
+        out.append(tok.item())
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host sync benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--prompt-len", type=int, default=16)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--sync-every", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    prompt = random_prompt(config, args.prompt_len)
+
+    header = " | ".join(f"k={k:<3d} ms".rjust(10) for k in args.sync_every)
+    print(f"\n{'tokens':>8} | {header}")
+    print("-" * (11 + 13 * len(args.sync_every)))
+    for n in args.tokens:
+        cells = []
+        for k in args.sync_every:
+            t = timeit(lambda: run(model, prompt, n, k), repeats=args.repeats)
+            cells.append(f"{t * 1e3:>10.1f}")
+        print(f"{n:>8d} | " + " | ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Template-slot decoding: forward passes per query and accuracy parity.
+
+Two measurements on the seed inputs:
+
+  oracle  replays each reference output as if the model had produced it and
+          counts the forward passes template decoding needs (prefill
+          included) against one per token, and how many outputs come out
+          exactly (a forced tail can differ from a rare output that leaves
+          its template after the last branch). Independent of the weights.
+  model   runs greedy generate() with and without the TemplateTable and
+          reports exact-match accuracy against the references, the share of
+          identical outputs, passes per query and latency. Without trained
+          weights the model rarely stays inside a template.
+
+The table is mined from data/*.jsonl, which includes the seed set, as it
+would be from the training data in deployment.
+
+Usage:
+    python benchmarks/bench_templates.py [--model-dir model] [--min-count 2 5]
+"""
+
+import argparse
+import time
+
+from common import encode_prompt, load_bench_model, load_seed_pairs, load_tokenizer
+
+import mlx.core as mx
+
+from model.templates import TemplateStats
+from scripts.inference import load_templates
+
+
+def oracle(table, tokenizer, config, pairs):
+    """(forward passes, tokens, outputs reproduced) if the model always picked the reference token."""
+    passes = tokens = reproduced = 0
+    for pair in pairs:
+        reference = tokenizer.encode(f" {pair['output']} ").ids + [config.end_token_id]
+        state, out, i = table.initial_state, [], 0
+        while i < len(reference):
+            passes += 1
+            out.append(reference[i])
+            state = table.advance(state, reference[i]) if state is not None else None
+            i += 1
+            if state is None:
+                continue
+            forced, _ = table.forced(state)
+            if forced and forced[-1] == config.end_token_id:
+                out += forced
+                break
+            for t in forced:
+                if i == len(reference) or reference[i] != t:
+                    break
+                out.append(t)
+                state = table.advance(state, t)
+                i += 1
+        tokens += len(reference)
+        reproduced += out == reference
+    return passes, tokens, reproduced
+
+
+def run(model, prompt, max_tokens, templates=None, stats=None):
+    ids = []
+    for tok in model.generate(mx.array([prompt]), max_tokens=max_tokens, temperature=0.0,
+                              sync_every=8, templates=templates, template_stats=stats):
+        t = tok.item()
+        if t == model.config.end_token_id:
+            break
+        ids.append(t)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Template-slot decoding benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--num-queries", type=int, default=50,
+                        help="Seed inputs generated with the model (the oracle uses all)")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--min-count", type=int, nargs="+", default=[2, 5])
+    args = parser.parse_args()
+
+    model, config = load_bench_model(args.model_dir)
+    tokenizer = load_tokenizer(args.model_dir)
+    pairs = load_seed_pairs()
+
+    tables = {}
+    for min_count in args.min_count:
+        start = time.perf_counter()
+        tables[min_count] = load_templates(tokenizer, config, min_count=min_count)
+        print(f"min_count {min_count}: mined {len(tables[min_count])} templates in "
+              f"{(time.perf_counter() - start) * 1e3:.0f} ms")
+
+    print(f"\nOracle on {len(pairs)} seed pairs")
+    print(f"{'min count':>9} | {'passes/query':>12} | {'tokens/query':>12} | {'exact':>6}")
+    print("-" * 50)
+    for min_count, table in tables.items():
+        passes, tokens, reproduced = oracle(table, tokenizer, config, pairs)
+        print(f"{min_count:>9} | {passes / len(pairs):>12.1f} | {tokens / len(pairs):>12.1f} | "
+              f"{reproduced / len(pairs):>6.1%}")
+
+    pairs = pairs[:args.num_queries]
+    prompts = [encode_prompt(tokenizer, p["input"]) for p in pairs]
+    targets = [tokenizer.encode(f" {p['output']} ").ids for p in pairs]
+    run(model, prompts[0], 4)  # warmup
+
+    start = time.perf_counter()
+    reference = [run(model, p, args.max_tokens) for p in prompts]
+    base_ms = (time.perf_counter() - start) / len(prompts) * 1e3
+    base_passes = sum(min(len(r) + 1, args.max_tokens) for r in reference) / len(prompts)
+    base_exact = sum(r == t for r, t in zip(reference, targets)) / len(prompts)
+    print(f"\nModel on {len(prompts)} seed inputs; greedy baseline: {base_exact:.1%} exact, "
+          f"{base_passes:.1f} passes/query, {base_ms:.1f} ms/query\n")
+
+    print(f"{'min count':>9} | {'exact':>6} | {'identical':>9} | {'in table':>8} | "
+          f"{'passes/query':>12} | {'ms/query':>8} | {'speedup':>7}")
+    print("-" * 78)
+    for min_count, table in tables.items():
+        stats = TemplateStats()
+        start = time.perf_counter()
+        outputs = [run(model, p, args.max_tokens, table, stats) for p in prompts]
+        ms = (time.perf_counter() - start) / len(prompts) * 1e3
+        exact = sum(o == t for o, t in zip(outputs, targets)) / len(prompts)
+        identical = sum(o == r for o, r in zip(outputs, reference)) / len(prompts)
+        passes = 1 + stats.model_steps / len(prompts)
+        print(f"{min_count:>9} | {exact:>6.1%} | {identical:>9.1%} | {stats.completed_rate:>8.1%} | "
+              f"{passes:>12.1f} | {ms:>8.1f} | {base_ms / ms:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Local transports: request latency of JSON/TCP, JSON/UDS and binary/UDS.
+
+Client-side load generator for a running server (scripts/server.py or
+scripts/async_server.py) started with both Unix domain sockets. Every
+transport keeps one persistent connection per client and sends the same
+greedy query, so after the first request it is answered from the response
+cache and the numbers are transport cost alone:
+
+  json/tcp     POST /generate over loopback TCP, HTTP/1.1 keep-alive
+  json/uds     the same request over --unix-socket
+  binary/uds   a binary_protocol.py frame over --binary-socket, script back
+  ids/uds      the same, answered with output token ids
+
+Usage:
+    python scripts/server.py --unix-socket /tmp/rune.sock --binary-socket /tmp/rune.bin &
+    python benchmarks/bench_transport.py --unix-socket /tmp/rune.sock --binary-socket /tmp/rune.bin
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.binary_protocol import BinaryClient
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def json_sender(connect, query):
+    conn = connect()
+    body = json.dumps({"query": query})
+    headers = {"Content-Type": "application/json"}
+
+    def send():
+        conn.request("POST", "/generate", body=body, headers=headers)
+        response = conn.getresponse()
+        json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+    return send, conn.close
+
+
+def binary_sender(path, query, token_ids):
+    client = BinaryClient(path)
+    return (lambda: client.generate(query, token_ids=token_ids)), client.close
+
+
+def client(make_sender, n, latencies, counts):
+    """Send `n` requests on one connection, appending per-request seconds to `latencies`."""
+    try:
+        send, close = make_sender()
+    except OSError:
+        counts["errors"] += n
+        return
+    for _ in range(n):
+        start = time.perf_counter()
+        try:
+            send()
+        except (OSError, RuntimeError, http.client.HTTPException):
+            counts["errors"] += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    close()
+
+
+def run(make_sender, requests, clients):
+    latencies, counts = [], {"errors": 0}
+    per_client = max(1, requests // clients)
+    threads = [threading.Thread(target=client, args=(make_sender, per_client, latencies, counts))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), time.perf_counter() - start, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local transport benchmark")
+    parser.add_argument("--url", default="http://127.0.0.1:39284", help="Server base URL")
+    parser.add_argument("--unix-socket", default=None, help="Server's --unix-socket path")
+    parser.add_argument("--binary-socket", default=None, help="Server's --binary-socket path")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per run")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8],
+                        help="Concurrent client threads")
+    parser.add_argument("--query", default="open Safari")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    transports = {"json/tcp": lambda: json_sender(lambda: http.client.HTTPConnection(host, port, timeout=60),
+                                                  args.query)}
+    if args.unix_socket:
+        transports["json/uds"] = lambda: json_sender(lambda: UnixHTTPConnection(args.unix_socket), args.query)
+    if args.binary_socket:
+        transports["binary/uds"] = lambda: binary_sender(args.binary_socket, args.query, False)
+        transports["ids/uds"] = lambda: binary_sender(args.binary_socket, args.query, True)
+
+    # Also puts the query into the response cache
+    for name, make_sender in transports.items():
+        latencies, _, _ = run(make_sender, 1, 1)
+        if not latencies:
+            print(f"Cannot reach the server over {name}", file=sys.stderr)
+            sys.exit(1)
+
+    print(f"{'transport':>10} | {'clients':>7} | {'mean ms':>7} | {'p50 ms':>6} | "
+          f"{'p90 ms':>6} | {'p99 ms':>6} | {'req/s':>7} | errors")
+    print("-" * 78)
+    for clients in args.clients:
+        for name, make_sender in transports.items():
+            latencies, elapsed, counts = run(make_sender, args.requests, clients)
+            if not latencies:
+                print(f"{name:>10} | {clients:>7} | all {counts['errors']} requests failed")
+                continue
+            mean = sum(latencies) / len(latencies)
+            print(f"{name:>10} | {clients:>7} | {mean * 1e3:>7.3f} | "
+                  f"{percentile(latencies, 0.5) * 1e3:>6.3f} | "
+                  f"{percentile(latencies, 0.9) * 1e3:>6.3f} | "
+                  f"{percentile(latencies, 0.99) * 1e3:>6.3f} | "
+                  f"{len(latencies) / elapsed:>7.0f} | {counts['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Worker pool: throughput and memory against the number of model processes.
+
+For each --workers N this starts scripts/worker_pool.py (response cache off,
+so every request runs the model), sends --requests seed queries from
+--clients concurrent keep-alive connections, and reports requests/s,
+latency percentiles and the workers' total RSS. Throughput only scales
+while N stays below the number of free cores.
+
+Usage:
+    python benchmarks/bench_workers.py [--model-dir model] [--workers 1 2 4] [-- extra server options]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_PAIRS = os.path.join(PROJECT_ROOT, "data", "seed_pairs.jsonl")
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def wait_ready(port, process, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("server not ready")
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("GET", path)
+    return json.loads(conn.getresponse().read())
+
+
+def client(port, queries, latencies, counts):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    for query in queries:
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/generate", body=json.dumps({"query": query}),
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            counts["errors"] += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+            continue
+        if response.status != 200:
+            counts["errors"] += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(port, queries, clients):
+    latencies, counts = [], {"errors": 0}
+    threads = [threading.Thread(target=client, args=(port, queries[i::clients], latencies, counts))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), time.perf_counter() - start, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker pool throughput benchmark")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent client connections")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+    parser.add_argument("--port", type=int, default=39290)
+    parser.add_argument("server_args", nargs="*", help="Extra scripts/server.py options (after --)")
+    args = parser.parse_args()
+
+    with open(SEED_PAIRS) as f:
+        inputs = [json.loads(line)["input"] for line in f if line.strip()]
+    queries = [inputs[i % len(inputs)] for i in range(args.requests)]
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients, {args.requests} uncached requests per run\n")
+    print(f"{'workers':>7} | {'req/s':>7} | {'speedup':>7} | {'p50 ms':>7} | {'p90 ms':>7} | "
+          f"{'p99 ms':>7} | {'RSS MB':>7} | errors")
+    print("-" * 76)
+    base = None
+    for n in args.workers:
+        command = [sys.executable, os.path.join(PROJECT_ROOT, "scripts", "worker_pool.py"),
+                   "--model-dir", args.model_dir, "--port", str(args.port), "--workers", str(n),
+                   "--cache-size", "0"] + args.server_args
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port, process)
+            run(args.port, queries[:args.clients], args.clients)  # warmup
+            latencies, elapsed, counts = run(args.port, queries, args.clients)
+            rss = sum(w["rss_mb"] or 0 for w in get_json(args.port, "/workers")["workers"])
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait()
+        if not latencies:
+            print(f"{n:>7} | all {counts['errors']} requests failed")
+            continue
+        throughput = len(latencies) / elapsed
+        base = base or throughput
+        print(f"{n:>7} | {throughput:>7.1f} | {throughput / base:>6.2f}x | "
+              f"{percentile(latencies, 0.5) * 1e3:>7.1f} | {percentile(latencies, 0.9) * 1e3:>7.1f} | "
+              f"{percentile(latencies, 0.99) * 1e3:>7.1f} | {rss:>7.0f} | {counts['errors']}")
+
+
+if __name__ == "__main__":
+    main()
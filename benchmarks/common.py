@@ -0,0 +1,89 @@
+"""
+Shared helpers for the Rune-lm benchmarks.
+
+Benchmarks run on CPU-only machines as well as Apple Silicon. If the model
+directory has no trained weights the model is randomly initialized, which is
+fine for latency/throughput numbers (but not for accuracy).
+"""
+
+import json
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import mlx.core as mx
+
+from model.model import ModelConfig, create_model
+from scripts.inference import weights_path as model_weights_path
+
+
+DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+DEFAULT_TOKENIZER = os.path.join(PROJECT_ROOT, "model", "tokenizer.json")
+
+
+def load_bench_model(model_dir: str = None, seed: int = 0, config: ModelConfig = None):
+    """
+    Load config + weights from `model_dir` if present, else a random model
+    (built from `config` if given).
+    """
+    mx.random.seed(seed)
+    config = config or ModelConfig()
+    if model_dir:
+        config_path = os.path.join(model_dir, "config.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r") as f:
+                config = ModelConfig(**json.load(f))
+
+    model = create_model(config)
+    weights_path = model_weights_path(model_dir) if model_dir else None
+    if weights_path and os.path.exists(weights_path):
+        model.load_weights(weights_path)
+        mx.eval(model.parameters())
+        print(f"Loaded weights from {weights_path}")
+    else:
+        print("No weights found; using a randomly initialized model")
+    return model, config
+
+
+def load_tokenizer(model_dir: str = None):
+    """The model directory's tokenizer, falling back to the repo's model/tokenizer.json."""
+    from tokenizers import Tokenizer
+    path = os.path.join(model_dir, "tokenizer.json") if model_dir else DEFAULT_TOKENIZER
+    if not os.path.exists(path):
+        path = DEFAULT_TOKENIZER
+    return Tokenizer.from_file(path)
+
+
+def load_seed_pairs(path: str = None) -> list:
+    """The hand-written (input, output) pairs in data/seed_pairs.jsonl."""
+    path = path or os.path.join(DATA_DIR, "seed_pairs.jsonl")
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def encode_prompt(tokenizer, text: str) -> list:
+    return tokenizer.encode(f"<|input|> {text} <|output|>").ids
+
+
+def random_prompt(config: ModelConfig, length: int, batch_size: int = 1) -> mx.array:
+    """A random prompt of `length` tokens framed like a real <|input|> ... <|output|> prompt."""
+    body = mx.random.randint(4, config.vocab_size, (batch_size, length - 2))
+    start = mx.full((batch_size, 1), config.input_token_id, dtype=mx.int32)
+    end = mx.full((batch_size, 1), config.output_token_id, dtype=mx.int32)
+    return mx.concatenate([start, body.astype(mx.int32), end], axis=1)
+
+
+def timeit(fn, repeats: int = 5, warmup: int = 1) -> float:
+    """Median wall-clock seconds of `fn()` over `repeats` runs."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Load-testing client for a running Rune-lm server (scripts/server.py,
+scripts/async_server.py or scripts/worker_pool.py).
+
+Replays queries from data/seed_pairs.jsonl or a captured log (--queries:
+jsonl records with "query" or "input", plus optional "temperature" and
+"timeout_ms"; or one query per line) in one of two modes:
+
+  closed   --clients N keep-alive connections, each sending its next request
+           as soon as the previous response arrives (throughput at a given
+           concurrency)
+  open     requests arrive at --rps on a Poisson schedule regardless of how
+           fast the server answers (latency at a given offered load); latency
+           is measured from the scheduled arrival, so a server falling behind
+           shows up as queueing rather than as a lower send rate
+
+Reports latency percentiles (p50/p90/p99/p99.9), throughput, status counts,
+error rate and the PASS_TO_CLOUD share; --json writes the report as JSON.
+
+Greedy requests for repeated queries are answered from the server's response
+cache; use --temperature 0.7 (or start the server with --cache-size 0) to
+load the model itself.
+
+Usage:
+    python scripts/server.py &
+    python benchmarks/load_test.py closed --clients 8 --duration 30
+    python benchmarks/load_test.py open --rps 50 --duration 30 [--queries captured.jsonl]
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from bench_transport import UnixHTTPConnection
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def load_queries(path: str) -> list:
+    """Request bodies from a jsonl log/pairs file, or one query per line."""
+    bodies = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = line
+            if isinstance(record, str):
+                bodies.append({"query": record})
+                continue
+            query = record.get("query") or record.get("input")
+            if query:
+                body = {"query": query}
+                for key in ("temperature", "timeout_ms"):
+                    if key in record:
+                        body[key] = record[key]
+                bodies.append(body)
+    return bodies
+
+
+class Results:
+    """Thread-safe outcome counters and latencies."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = collections.Counter()
+        self.cloud = 0
+        self.degraded = 0
+
+    def record(self, status, latency: float, body: dict = None):
+        with self.lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(latency)
+                if body is not None:
+                    self.cloud += bool(body.get("is_cloud"))
+                    self.degraded += bool(body.get("degraded"))
+
+    def report(self, elapsed: float, mode: str, offered_rps: float = None) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            total = sum(self.statuses.values())
+            ok = self.statuses.get(200, 0)
+            report = {
+                "mode": mode,
+                "duration_s": elapsed,
+                "requests": total,
+                "ok": ok,
+                "throughput_rps": ok / elapsed if elapsed else 0.0,
+                "error_rate": (total - ok) / total if total else 0.0,
+                "statuses": {str(k): v for k, v in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))},
+                "is_cloud_share": self.cloud / ok if ok else 0.0,
+                "degraded": self.degraded,
+            }
+        if offered_rps is not None:
+            report["offered_rps"] = offered_rps
+        if latencies:
+            report["latency_ms"] = {
+                "mean": sum(latencies) / len(latencies) * 1e3,
+                "p50": percentile(latencies, 0.5) * 1e3,
+                "p90": percentile(latencies, 0.9) * 1e3,
+                "p99": percentile(latencies, 0.99) * 1e3,
+                "p99.9": percentile(latencies, 0.999) * 1e3,
+                "max": latencies[-1] * 1e3,
+            }
+        return report
+
+
+class Client:
+    """One keep-alive connection; reconnects after errors."""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.conn = None
+
+    def send(self, body: dict):
+        """(status, response JSON or None); status is "error" if the connection failed."""
+        try:
+            if self.conn is None:
+                self.conn = self.connect()
+            self.conn.request("POST", "/generate", body=json.dumps(body),
+                              headers={"Content-Type": "application/json"})
+            response = self.conn.getresponse()
+            data = response.read()
+            if response.getheader("Connection", "").lower() == "close":
+                self.close()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return "error", None
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def closed_loop(connect, bodies, clients: int, duration: float, max_requests: int, results: Results) -> float:
+    stop = time.perf_counter() + duration
+    sent = iter(range(max_requests)) if max_requests else None
+    lock = threading.Lock()
+
+    def run(offset):
+        client, i = Client(connect), offset
+        while time.perf_counter() < stop:
+            if sent is not None:
+                with lock:
+                    if next(sent, None) is None:
+                        break
+            body = bodies[i % len(bodies)]
+            i += clients
+            start = time.perf_counter()
+            status, data = client.send(body)
+            results.record(status, time.perf_counter() - start, data)
+        client.close()
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def open_loop(connect, bodies, rps: float, duration: float, max_requests: int, max_inflight: int,
+              results: Results, seed: int) -> float:
+    rng = random.Random(seed)
+    arrivals = queue.Queue()
+
+    def run():
+        client = Client(connect)
+        while True:
+            item = arrivals.get()
+            if item is None:
+                break
+            scheduled, body = item
+            status, data = client.send(body)
+            results.record(status, time.perf_counter() - scheduled, data)
+        client.close()
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(max_inflight)]
+    for t in threads:
+        t.start()
+    start = time.perf_counter()
+    next_arrival, n = start, 0
+    while next_arrival < start + duration and (not max_requests or n < max_requests):
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrivals.put((next_arrival, bodies[n % len(bodies)]))
+        n += 1
+        next_arrival += rng.expovariate(rps)
+    for _ in threads:
+        arrivals.put(None)
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def print_report(report: dict):
+    offered = f", offered {report['offered_rps']:.1f} req/s" if "offered_rps" in report else ""
+    print(f"\n{report['mode']}-loop: {report['requests']} requests in {report['duration_s']:.1f}s{offered}")
+    print(f"  throughput   {report['throughput_rps']:.1f} req/s (200 only)")
+    latency = report.get("latency_ms")
+    if latency:
+        print("  latency ms   " + " | ".join(f"{k} {v:.1f}" for k, v in latency.items()))
+    print("  statuses     " + ", ".join(f"{k}: {v}" for k, v in report["statuses"].items()))
+    print(f"  error rate   {report['error_rate']:.2%}")
+    print(f"  is_cloud     {report['is_cloud_share']:.1%} of successful responses"
+          + (f" ({report['degraded']} degraded)" if report["degraded"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-testing client for the Rune-lm HTTP server")
+    parser.add_argument("mode", choices=["closed", "open"], help="closed: N clients; open: target RPS")
+    parser.add_argument("--url", default="http://127.0.0.1:39284", help="Server base URL")
+    parser.add_argument("--unix-socket", default=None, help="Connect to the server's --unix-socket instead")
+    parser.add_argument("--queries", default=os.path.join(DATA_DIR, "seed_pairs.jsonl"),
+                        help="jsonl pairs/log, or a text file with one query per line")
+    parser.add_argument("--clients", type=int, default=8, help="Closed loop: concurrent connections")
+    parser.add_argument("--rps", type=float, default=20.0, help="Open loop: mean arrival rate")
+    parser.add_argument("--max-inflight", type=int, default=256,
+                        help="Open loop: connections available for outstanding requests")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send for")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0: no limit)")
+    parser.add_argument("--warmup", type=int, default=10, help="Unrecorded requests sent first")
+    parser.add_argument("--temperature", type=float, default=None,
+                        help="Override every request's temperature")
+    parser.add_argument("--timeout-ms", type=float, default=None, help="Deadline sent with every request")
+    parser.add_argument("--shuffle", action="store_true", help="Shuffle the queries (with --seed)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    bodies = load_queries(args.queries)
+    if not bodies:
+        parser.error(f"no queries in {args.queries}")
+    for body in bodies:
+        if args.temperature is not None:
+            body["temperature"] = args.temperature
+        if args.timeout_ms is not None:
+            body["timeout_ms"] = args.timeout_ms
+    if args.shuffle:
+        random.Random(args.seed).shuffle(bodies)
+
+    if args.unix_socket:
+        def connect():
+            return UnixHTTPConnection(args.unix_socket, timeout=300)
+        target = f"unix:{args.unix_socket}"
+    else:
+        url = urlsplit(args.url)
+
+        def connect():
+            return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=300)
+        target = args.url
+
+    warmup = Client(connect)
+    for body in bodies[:args.warmup]:
+        if warmup.send(body)[0] == "error":
+            print(f"Cannot reach the server at {target}", file=sys.stderr)
+            sys.exit(1)
+    warmup.close()
+
+    print(f"{len(bodies)} queries from {args.queries} against {target}")
+    results = Results()
+    if args.mode == "closed":
+        elapsed = closed_loop(connect, bodies, args.clients, args.duration, args.requests, results)
+        report = results.report(elapsed, "closed")
+        report["clients"] = args.clients
+    else:
+        elapsed = open_loop(connect, bodies, args.rps, args.duration, args.requests, args.max_inflight,
+                            results, args.seed)
+        report = results.report(elapsed, "open", offered_rps=args.rps)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
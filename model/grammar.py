@@ -0,0 +1,400 @@
+"""
+Grammar-constrained decoding for AppleScript / PASS_TO_CLOUD outputs.
+
+AppleScriptGrammar is a character-level automaton for the subset of
+AppleScript the model is trained to emit:
+
+  - the whole output is either the literal PASS_TO_CLOUD or a script,
+  - every script line starts with a known statement keyword,
+  - string literals close on the same line, ( ) and { } are balanced,
+  - `tell`, `repeat`, `try` and multi-line `if ... then` open blocks that
+    must be closed by the matching `end tell` / `end repeat` / ... line
+    (one-line `tell ... to ...` and `if ... then ...` do not).
+
+Stack depths are bounded, so the automaton has finitely many states.
+TokenGrammar lifts it to token level: for each automaton state it computes,
+once, the additive mask over the vocabulary and the successor state of every
+allowed token by walking a trie of the vocabulary's byte strings. After the
+first visit a state costs a dict lookup per generated token. The compiled
+states can be saved and loaded by a later process (save()/load(), written by
+scripts/snapshot.py), so a server does not recompile them at startup; the
+snapshot is data only (a json file of states plus a binary file of int
+tables), so loading it runs no code from the file.
+
+Outputs are framed as in training (" {output} " followed by <|end|>), so
+leading/trailing whitespace is allowed and <|end|> is only allowed where the
+script is complete.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import mlx.core as mx
+
+STATEMENT_KEYWORDS = (
+    "activate", "beep", "check", "click", "close", "copy", "count", "delay",
+    "delete", "display", "do", "duplicate", "else", "empty", "end", "error",
+    "exit", "get", "if", "keystroke", "launch", "log", "make", "move", "open",
+    "pause", "play", "quit", "reveal", "repeat", "return", "run", "save", "say",
+    "select", "send", "set", "tell", "try",
+)
+BLOCK_KEYWORDS = ("tell", "repeat", "if", "try")
+CLOUD_LITERAL = "PASS_TO_CLOUD"
+MAX_DEPTH = 8
+SNAPSHOT_VERSION = 2
+
+_CLOSING = {")": "(", "}": "{"}
+# Tracks the current word just far enough to spot "to" and "then"
+_WORD_STATES = {"": "t", "t": {"o": "to", "h": "th"}, "th": {"e": "the"}, "the": {"n": "then"}}
+
+
+# State: (phase, arg, blocks, brackets, line_kind, word, saw_to, last_then)
+#   phase  "S" leading whitespace      "C" inside PASS_TO_CLOUD (arg = chars matched)
+#          "X" after PASS_TO_CLOUD     "I" start of a line (indentation)
+#          "K" line keyword (arg = prefix read so far)
+#          "E" after `end` (arg = rest of the block name still expected)
+#          "L" rest of a statement line  "Q" inside a string  "B" after a backslash in a string
+#          "O" after `end <block>`, only whitespace until the newline
+State = Tuple
+
+
+class AppleScriptGrammar:
+    """Character-level automaton; step() returns None for characters that are not allowed."""
+
+    def __init__(self, keywords=STATEMENT_KEYWORDS, block_keywords=BLOCK_KEYWORDS):
+        self.keywords = frozenset(keywords) | {"end"}
+        self.block_keywords = frozenset(block_keywords)
+
+        # Keyword prefixes allowed at top level, inside a block, and inside an
+        # `if` block (`end` needs an open block, `else` an open `if`)
+        def prefixes(words):
+            return frozenset(w[:i] for w in words for i in range(1, len(w) + 1))
+        base = self.keywords - {"end", "else"}
+        self._prefixes = {
+            "top": prefixes(base),
+            "block": prefixes(base | {"end"}),
+            "if": prefixes(base | {"end", "else"}),
+        }
+
+    def _line_prefixes(self, blocks) -> frozenset:
+        if not blocks:
+            return self._prefixes["top"]
+        return self._prefixes["if" if blocks[-1] == "if" else "block"]
+
+    @property
+    def initial_state(self) -> State:
+        return ("S", None, (), (), None, "", False, False)
+
+    def accepts(self, text: str) -> bool:
+        """True if `text` (an output without the framing whitespace) is a complete, valid output."""
+        state = self.initial_state
+        for ch in f" {text} ":
+            state = self.step(state, ch)
+            if state is None:
+                return False
+        return self.is_final(state)
+
+    def is_final(self, state: State) -> bool:
+        phase, _, blocks, brackets = state[:4]
+        if phase == "L" and self._opens_block(state):
+            return False
+        return not blocks and not brackets and phase in "XILO"
+
+    def step(self, state: State, ch: str) -> Optional[State]:
+        phase, arg, blocks, brackets, kind, word, saw_to, last_then = state
+
+        if phase == "S":
+            if ch == " ":
+                return state
+            if ch == CLOUD_LITERAL[0]:
+                return ("C", 1, (), (), None, "", False, False)
+            return self._line_start(blocks, ch)
+
+        if phase == "C":
+            if ch != CLOUD_LITERAL[arg]:
+                return None
+            if arg + 1 == len(CLOUD_LITERAL):
+                return ("X", None, (), (), None, "", False, False)
+            return ("C", arg + 1, (), (), None, "", False, False)
+
+        if phase == "X":
+            return state if ch == " " else None
+
+        if phase == "I":
+            if ch in " \t\n":
+                return state
+            return self._line_start(blocks, ch)
+
+        if phase == "K":
+            if ch.isalpha():
+                prefix = arg + ch
+                if prefix not in self._line_prefixes(blocks):
+                    return None
+                return ("K", prefix, blocks, (), None, "", False, False)
+            if arg not in self.keywords:
+                return None
+            if arg == "end":
+                if ch != " ":
+                    return None
+                return ("E", blocks[-1], blocks, (), None, "", False, False)
+            kind = arg if arg in self.block_keywords else None
+            line = ("L", None, blocks, (), kind, "", False, False)
+            return self.step(line, ch)
+
+        if phase == "E":
+            if ch != arg[0]:
+                return None
+            if len(arg) > 1:
+                return ("E", arg[1:], blocks, (), None, "", False, False)
+            return ("O", None, blocks[:-1], (), None, "", False, False)
+
+        if phase == "O":
+            if ch in " \t":
+                return state
+            return ("I", None, blocks, (), None, "", False, False) if ch == "\n" else None
+
+        if phase == "Q":
+            if ch == "\n":
+                return None
+            if ch == "\\":
+                return ("B",) + state[1:]
+            if ch == '"':
+                return ("L",) + state[1:]
+            return state
+
+        if phase == "B":
+            return None if ch == "\n" else ("Q",) + state[1:]
+
+        # phase == "L"
+        if ch == "\n":
+            if brackets:
+                return None
+            if self._opens_block(state):
+                if len(blocks) >= MAX_DEPTH:
+                    return None
+                blocks = blocks + (kind,)
+            return ("I", None, blocks, (), None, "", False, False)
+
+        if ch.isalpha():
+            nxt = _WORD_STATES.get(word)
+            if isinstance(nxt, dict):
+                nxt = nxt.get(ch)
+            elif nxt is not None:
+                nxt = nxt if ch == nxt else None
+            return ("L", None, blocks, brackets, kind, nxt or "*", saw_to, last_then)
+
+        # Any other character ends the current word
+        if word:
+            if word == "to" and not brackets:
+                saw_to = True
+            last_then = word == "then"
+        word = ""
+        if ch == '"':
+            return ("Q", None, blocks, brackets, kind, word, saw_to, last_then)
+        if ch in "({":
+            if len(brackets) >= MAX_DEPTH:
+                return None
+            brackets = brackets + (ch,)
+        elif ch in _CLOSING:
+            if not brackets or brackets[-1] != _CLOSING[ch]:
+                return None
+            brackets = brackets[:-1]
+        elif ch not in " \t":
+            word = "*"
+        return ("L", None, blocks, brackets, kind, word, saw_to, last_then)
+
+    @staticmethod
+    def _opens_block(state: State) -> bool:
+        """Whether the statement line in `state` opens a block if it ends here."""
+        kind, word, saw_to, last_then = state[4:]
+        ends_then = word == "then" or (word == "" and last_then)
+        return kind in ("repeat", "try") or (kind == "tell" and not saw_to) or (kind == "if" and ends_then)
+
+    def _line_start(self, blocks, ch: str) -> Optional[State]:
+        if ch in self._line_prefixes(blocks):
+            return ("K", ch, blocks, (), None, "", False, False)
+        return None
+
+
+def _byte_decoder() -> Dict[str, int]:
+    """Inverse of the byte-level BPE alphabet (printable stand-ins for all 256 bytes)."""
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) \
+        + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return {chr(c): b for b, c in zip(bs, cs)}
+
+
+def tables_path(path: str) -> str:
+    """The binary int tables written next to a TokenGrammar.save() snapshot."""
+    return os.path.splitext(path)[0] + ".bin"
+
+
+def _state(value) -> State:
+    """A state read back from json (tuples come back as lists)."""
+    return tuple(_state(v) for v in value) if isinstance(value, list) else value
+
+
+class TokenGrammar:
+    """
+    Token-level view of an AppleScriptGrammar for a byte-level BPE tokenizer.
+
+    mask(state) is an additive (vocab_size,) array (0 allowed, -1e9 not);
+    advance(state, token) returns the next state, or None once <|end|> is
+    emitted. Both are computed on a state's first visit and cached.
+    """
+
+    def __init__(self, grammar: AppleScriptGrammar, tokenizer, end_token_id: int, vocab_size: int):
+        self.grammar = grammar
+        self.end_token_id = end_token_id
+        self.vocab_size = vocab_size
+        self._cache: Dict[State, Tuple[mx.array, Dict[int, State]]] = {}
+        self._stored: Dict[State, int] = {}  # loaded, not yet materialized states -> snapshot index
+        self._snapshot = None
+
+        # Trie over token byte strings (each byte as one latin-1 char);
+        # special tokens are left out, so they are never allowed
+        decoder = _byte_decoder()
+        special = {t.content for t in tokenizer.get_added_tokens_decoder().values()}
+        self._trie: dict = {}
+        for piece, token_id in tokenizer.get_vocab().items():
+            if piece in special or token_id >= vocab_size:
+                continue
+            node = self._trie
+            for ch in piece:
+                node = node.setdefault(bytes([decoder[ch]]).decode("latin-1"), {})
+            node.setdefault(None, []).append(token_id)
+
+        end_only = [-1e9] * vocab_size
+        end_only[end_token_id] = 0.0
+        self.end_mask = mx.array(end_only)
+
+        # Identifies the vocabulary and automaton a snapshot was compiled for
+        self.key = hashlib.sha256(repr((
+            sorted(tokenizer.get_vocab().items()), end_token_id, vocab_size, MAX_DEPTH,
+            sorted(grammar.keywords), sorted(grammar.block_keywords),
+        )).encode()).hexdigest()
+
+    @property
+    def initial_state(self) -> State:
+        return self.grammar.initial_state
+
+    @property
+    def num_states(self) -> int:
+        return len(self._cache) + len(self._stored)
+
+    def mask(self, state: Optional[State]) -> mx.array:
+        """Additive logit mask for `state`; only <|end|> once a row has finished (None)."""
+        return self.end_mask if state is None else self._compile(state)[0]
+
+    def advance(self, state: Optional[State], token: int) -> Optional[State]:
+        if state is None or token == self.end_token_id:
+            return None
+        return self._compile(state)[1][token]
+
+    def warm(self, token_sequences: List[List[int]]):
+        """Precompute the states visited by (valid) output token sequences, e.g. the training outputs."""
+        for ids in token_sequences:
+            state = self.initial_state
+            for token in ids:
+                nxt = self._compile(state)[1].get(token)
+                if nxt is None:
+                    break
+                state = nxt
+
+    def save(self, path: str):
+        """
+        Write the compiled states' successor tables: the states and a header
+        to `path` (json), the int tables to tables_path(path) (see load()).
+        """
+        compiled = list(self._cache) + list(self._stored)
+        successor_maps = [self._compile(state)[1] for state in compiled]
+        index = {state: i for i, state in enumerate(compiled)}
+        states = list(compiled)  # then successors that were never compiled
+        offsets, tokens, nexts = array("q", [0]), array("i"), array("i")
+        for successors in successor_maps:
+            for token_id, nxt in successors.items():
+                if nxt not in index:
+                    index[nxt] = len(states)
+                    states.append(nxt)
+                tokens.append(token_id)
+                nexts.append(index[nxt])
+            offsets.append(len(tokens))
+        with open(tables_path(path), "wb") as f:
+            for table in (offsets, tokens, nexts):
+                table.tofile(f)
+        with open(path, "w") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "key": self.key, "byteorder": sys.byteorder,
+                       "compiled": len(compiled), "entries": len(tokens), "states": states},
+                      f, separators=(",", ":"))
+
+    def load(self, path: str) -> bool:
+        """
+        Restore states written by save(); False (and nothing loaded) if the
+        files were compiled for another vocabulary or automaton. Loaded states
+        are materialized on their first visit.
+        """
+        with open(path) as f:
+            header = json.load(f)
+        if header.get("version") != SNAPSHOT_VERSION or header.get("key") != self.key:
+            return False
+        states = [_state(s) for s in header["states"]]
+        compiled, entries = header["compiled"], header["entries"]
+        offsets, tokens, nexts = array("q"), array("i"), array("i")
+        with open(tables_path(path), "rb") as f:
+            for table, n in ((offsets, compiled + 1), (tokens, entries), (nexts, entries)):
+                table.fromfile(f, n)  # EOFError if the file is short
+                if header["byteorder"] != sys.byteorder:
+                    table.byteswap()
+        self._snapshot = {"states": states, "offsets": offsets, "tokens": tokens, "next": nexts}
+        self._stored = {state: i for i, state in enumerate(states[:compiled]) if state not in self._cache}
+        return True
+
+    def _entry(self, state: State, successors: Dict[int, State]) -> Tuple[mx.array, Dict[int, State]]:
+        bias = mx.full((self.vocab_size,), -1e9)
+        if successors:
+            bias[mx.array(list(successors))] = 0.0
+        if self.grammar.is_final(state) or not successors:
+            bias[self.end_token_id] = 0.0
+        mx.eval(bias)  # a constant, usable from any thread
+        entry = (bias, successors)
+        self._cache[state] = entry
+        return entry
+
+    def _compile(self, state: State) -> Tuple[mx.array, Dict[int, State]]:
+        entry = self._cache.get(state)
+        if entry is not None:
+            return entry
+
+        i = self._stored.pop(state, None)
+        if i is not None:
+            snapshot = self._snapshot
+            start, end = snapshot["offsets"][i], snapshot["offsets"][i + 1]
+            states = snapshot["states"]
+            return self._entry(state, dict(zip(snapshot["tokens"][start:end],
+                                               map(states.__getitem__, snapshot["next"][start:end]))))
+
+        step = self.grammar.step
+        successors: Dict[int, State] = {}
+        stack = [(self._trie, state)]
+        while stack:
+            node, s = stack.pop()
+            for ch, child in node.items():
+                if ch is None:
+                    continue
+                nxt = step(s, ch)
+                if nxt is None:
+                    continue
+                for token_id in child.get(None, ()):
+                    successors[token_id] = nxt
+                stack.append((child, nxt))
+        return self._entry(state, successors)
@@ -9,12 +9,15 @@ Format: <|input|> natural language command <|output|> applescript code <|end|>
 """
 
 import math
+import time
 from dataclasses import dataclass, field
-from typing import Optional, Tuple, List
+from typing import Callable, Optional, Tuple, List, Union
 
 import mlx.core as mx
 import mlx.nn as nn
 
+from model import profiling
+
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -44,12 +47,258 @@ class ModelConfig:
     input_token_id: int = 1
     output_token_id: int = 2
     end_token_id: int = 3
+    # Set by scripts/quantize.py, e.g. {"group_size": 64, "bits": 4, "embeddings": false}
+    quantization: Optional[dict] = None
+    # Adds route_head, a PASS_TO_CLOUD classifier on the <|output|> hidden state
+    route_head: bool = False
 
     @property
     def head_dim(self) -> int:
         return self.d_model // self.n_heads
 
 
+# ---------------------------------------------------------------------------
+# KV Cache
+# ---------------------------------------------------------------------------
+
+class KVCache:
+    """
+    Preallocated per-layer key/value cache for autoregressive decoding.
+
+    Buffers of shape (B, n_heads, max_seq_len, head_dim) are allocated once per
+    request and written into by slice, so each decode step only writes the new
+    token's keys/values instead of copying the whole history.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        n_heads: int,
+        head_dim: int,
+        max_seq_len: int,
+        dtype: mx.Dtype = mx.float32,
+    ):
+        shape = (batch_size, n_heads, max_seq_len, head_dim)
+        self.keys = mx.zeros(shape, dtype=dtype)
+        self.values = mx.zeros(shape, dtype=dtype)
+        self.max_seq_len = max_seq_len
+        self.offset = 0
+
+    @classmethod
+    def from_buffers(
+        cls,
+        keys: mx.array,
+        values: mx.array,
+        offset: Union[int, mx.array],
+    ) -> "KVCache":
+        """Wrap existing full-size buffers, e.g. inside a compiled decode step."""
+        cache = cls.__new__(cls)
+        cache.keys = keys
+        cache.values = values
+        cache.max_seq_len = keys.shape[2]
+        cache.offset = offset
+        return cache
+
+    def update_and_fetch(
+        self,
+        keys: mx.array,
+        values: mx.array,
+    ) -> Tuple[mx.array, mx.array]:
+        """
+        Write new keys/values at the current offset and return the filled prefix.
+
+        If `offset` is an mx.array (fixed-shape mode used by the compiled decode
+        step) the write position is dynamic and the full buffers are returned;
+        the caller must mask out positions past the offset.
+        """
+        L = keys.shape[2]
+        if isinstance(self.offset, mx.array):
+            start = self.offset.reshape(1)
+            self.keys = mx.slice_update(self.keys, keys, start, axes=(2,))
+            self.values = mx.slice_update(self.values, values, start, axes=(2,))
+            self.offset = self.offset + L
+            return self.keys, self.values
+
+        end = self.offset + L
+        if end > self.max_seq_len:
+            raise ValueError(
+                f"KV cache overflow: {end} positions exceeds max_seq_len={self.max_seq_len}"
+            )
+        self.keys[:, :, self.offset:end, :] = keys
+        self.values[:, :, self.offset:end, :] = values
+        self.offset = end
+        return self.keys[:, :, :end, :], self.values[:, :, :end, :]
+
+    def trim(self, n: int):
+        """Forget the last n positions (e.g. rejected speculative tokens)."""
+        self.offset = max(0, self.offset - n)
+
+
+class BatchKVCache:
+    """
+    Preallocated KV cache for a batch of sequences at different positions.
+
+    Row i holds valid keys/values in columns [starts[i], offsets[i]). Each row
+    writes new tokens at its own offset and gets RoPE positions counted from
+    its own start, so left-padded prompts and rows that joined the batch at
+    different times can be decoded together. Rows can be dropped (`filter`)
+    or appended (`extend`) between steps.
+
+    starts/offsets are kept as Python lists so that building masks and RoPE
+    offsets never needs a device->host sync.
+    """
+
+    def __init__(
+        self,
+        keys: mx.array,
+        values: mx.array,
+        starts: List[int],
+        offsets: List[int],
+    ):
+        self.keys = keys
+        self.values = values
+        self.starts = list(starts)
+        self.offsets = list(offsets)
+        self.max_seq_len = keys.shape[2]
+
+    @classmethod
+    def empty(
+        cls,
+        starts: List[int],
+        n_heads: int,
+        head_dim: int,
+        max_seq_len: int,
+        dtype: mx.Dtype = mx.float32,
+    ) -> "BatchKVCache":
+        """Allocate buffers for len(starts) rows; row i's first valid column is starts[i]."""
+        shape = (len(starts), n_heads, max_seq_len, head_dim)
+        return cls(
+            mx.zeros(shape, dtype=dtype),
+            mx.zeros(shape, dtype=dtype),
+            starts,
+            [0] * len(starts),
+        )
+
+    def rope_offsets(self) -> mx.array:
+        """Per-row position of the next token, shape (B,)."""
+        return mx.array([o - s for o, s in zip(self.offsets, self.starts)])
+
+    def make_mask(self, L: int, dtype: mx.Dtype) -> mx.array:
+        """
+        Additive mask of shape (B, 1, L, max(offsets) + L) for the next L tokens.
+
+        Query j of row i sits at column offsets[i] + j and may attend to
+        columns starts[i] .. offsets[i] + j.
+        """
+        end = max(self.offsets) + L
+        cols = mx.arange(end)[None, None, :]
+        rows = mx.array(self.offsets)[:, None, None] + mx.arange(L)[None, :, None]
+        starts = mx.array(self.starts)[:, None, None]
+        allowed = (cols >= starts) & (cols <= rows)
+        mask = mx.where(allowed, mx.array(0.0), mx.array(-1e9)).astype(dtype)
+        return mask[:, None]
+
+    def update_and_fetch(
+        self,
+        keys: mx.array,
+        values: mx.array,
+    ) -> Tuple[mx.array, mx.array]:
+        """Write L new positions per row at that row's offset; return columns [0, max end)."""
+        B, H, L, D = keys.shape
+        end = max(self.offsets) + L
+        if end > self.max_seq_len:
+            raise ValueError(
+                f"KV cache overflow: {end} positions exceeds max_seq_len={self.max_seq_len}"
+            )
+        idx = mx.array(self.offsets)[:, None, None, None] + mx.arange(L)[None, None, :, None]
+        idx = mx.broadcast_to(idx, (B, H, L, D))
+        self.keys = mx.put_along_axis(self.keys, idx, keys, axis=2)
+        self.values = mx.put_along_axis(self.values, idx, values, axis=2)
+        self.offsets = [o + L for o in self.offsets]
+        return self.keys[:, :, :end, :], self.values[:, :, :end, :]
+
+    def filter(self, rows: List[int]) -> "BatchKVCache":
+        """Keep only the given rows (in the given order)."""
+        idx = mx.array(rows)
+        return BatchKVCache(
+            self.keys[idx],
+            self.values[idx],
+            [self.starts[i] for i in rows],
+            [self.offsets[i] for i in rows],
+        )
+
+    def extend(self, other: "BatchKVCache") -> "BatchKVCache":
+        """Append the rows of another cache after this one's."""
+        return BatchKVCache(
+            mx.concatenate([self.keys, other.keys], axis=0),
+            mx.concatenate([self.values, other.values], axis=0),
+            self.starts + other.starts,
+            self.offsets + other.offsets,
+        )
+
+
+# Either a preallocated (Batch)KVCache or a legacy (keys, values) tuple that is
+# grown with mx.concatenate on every step.
+Cache = Union[KVCache, BatchKVCache, Tuple[mx.array, mx.array]]
+
+# An additive mask array, "causal" (lower-right aligned, never materialized by
+# the fused kernel) or None for no masking.
+Mask = Optional[Union[str, mx.array]]
+
+
+def _causal_mask(L: int, offset: int, dtype: mx.Dtype) -> mx.array:
+    """Additive causal mask of shape (L, offset + L) for queries starting at `offset`."""
+    rows = mx.arange(offset, offset + L)[:, None]
+    cols = mx.arange(offset + L)[None, :]
+    mask = mx.where(cols > rows, mx.array(-1e9), mx.array(0.0))
+    return mask.astype(dtype)
+
+
+def _attention_mask(
+    cache: Optional[List["Cache"]],
+    L: int,
+    dtype: mx.Dtype,
+) -> Mask:
+    """
+    Mask for L new tokens given the (pre-update) per-layer caches.
+
+    Only batched caches need an explicit mask (padding and per-row positions);
+    otherwise queries are the last L positions and "causal" suffices.
+    """
+    if cache is not None and isinstance(cache[0], BatchKVCache):
+        return cache[0].make_mask(L, dtype)
+    return "causal" if L > 1 else None
+
+
+def reference_attention(
+    queries: mx.array,
+    keys: mx.array,
+    values: mx.array,
+    scale: float,
+    mask: Mask = None,
+) -> mx.array:
+    """
+    Unfused scaled dot-product attention, kept as a numerical reference for
+    mx.fast.scaled_dot_product_attention. Shapes are (B, n_heads, L, head_dim).
+    """
+    if isinstance(mask, str):
+        L, S = queries.shape[2], keys.shape[2]
+        mask = _causal_mask(L, S - L, queries.dtype)
+    scores = (queries * scale) @ keys.transpose(0, 1, 3, 2)
+    if mask is not None:
+        scores = scores + mask
+    scores = mx.softmax(scores.astype(mx.float32), axis=-1).astype(queries.dtype)
+    return scores @ values
+
+
+def left_pad(prompts: List[List[int]], pad_token_id: int) -> Tuple[mx.array, List[int]]:
+    """Left-pad ragged prompts to a (B, max_len) array; returns (tokens, pad lengths)."""
+    max_len = max(len(p) for p in prompts)
+    pads = [max_len - len(p) for p in prompts]
+    tokens = [[pad_token_id] * n + list(p) for p, n in zip(prompts, pads)]
+    return mx.array(tokens, dtype=mx.int32), pads
+
+
 # ---------------------------------------------------------------------------
 # Attention
 # ---------------------------------------------------------------------------
@@ -62,6 +311,8 @@ class CausalSelfAttention(nn.Module):
         self.n_heads = config.n_heads
         self.head_dim = config.head_dim
         self.scale = self.head_dim ** -0.5
+        # False routes through reference_attention (for parity checks)
+        self.use_fast_sdpa = True
 
         self.q_proj = nn.Linear(config.d_model, config.d_model, bias=False)
         self.k_proj = nn.Linear(config.d_model, config.d_model, bias=False)
@@ -77,14 +328,17 @@ class CausalSelfAttention(nn.Module):
     def __call__(
         self,
         x: mx.array,
-        mask: Optional[mx.array] = None,
-        cache: Optional[Tuple[mx.array, mx.array]] = None,
-    ) -> Tuple[mx.array, Tuple[mx.array, mx.array]]:
+        mask: Mask = None,
+        cache: Optional[Cache] = None,
+    ) -> Tuple[mx.array, Cache]:
         B, L, _ = x.shape
 
-        queries = self.q_proj(x)
-        keys = self.k_proj(x)
-        values = self.v_proj(x)
+        if "qkv_proj" in self:
+            queries, keys, values = mx.split(self.qkv_proj(x), 3, axis=-1)
+        else:
+            queries = self.q_proj(x)
+            keys = self.k_proj(x)
+            values = self.v_proj(x)
 
         # (B, L, n_heads, head_dim) -> (B, n_heads, L, head_dim)
         queries = queries.reshape(B, L, self.n_heads, self.head_dim).transpose(0, 2, 1, 3)
@@ -92,25 +346,39 @@ class CausalSelfAttention(nn.Module):
         values = values.reshape(B, L, self.n_heads, self.head_dim).transpose(0, 2, 1, 3)
 
         # Apply RoPE with cache offset
-        if cache is not None:
+        if isinstance(cache, BatchKVCache):
+            offsets = cache.rope_offsets()
+            queries = self.rope(queries, offset=offsets)
+            keys = self.rope(keys, offset=offsets)
+            keys, values = cache.update_and_fetch(keys, values)
+        elif isinstance(cache, KVCache):
+            offset = cache.offset
+            queries = self.rope(queries, offset=offset)
+            keys = self.rope(keys, offset=offset)
+            keys, values = cache.update_and_fetch(keys, values)
+        elif cache is not None:
             key_cache, value_cache = cache
             offset = key_cache.shape[2]
             queries = self.rope(queries, offset=offset)
             keys = self.rope(keys, offset=offset)
             keys = mx.concatenate([key_cache, keys], axis=2)
             values = mx.concatenate([value_cache, values], axis=2)
+            cache = (keys, values)
         else:
             queries = self.rope(queries)
             keys = self.rope(keys)
+            cache = (keys, values)
 
-        # Scaled dot-product attention
-        scores = (queries * self.scale) @ keys.transpose(0, 1, 3, 2)
-        if mask is not None:
-            scores = scores + mask
-        scores = mx.softmax(scores.astype(mx.float32), axis=-1).astype(queries.dtype)
-        output = (scores @ values).transpose(0, 2, 1, 3).reshape(B, L, -1)
+        # Scaled dot-product attention (fused kernel, softmax in float32)
+        if self.use_fast_sdpa:
+            output = mx.fast.scaled_dot_product_attention(
+                queries, keys, values, scale=self.scale, mask=mask
+            )
+        else:
+            output = reference_attention(queries, keys, values, self.scale, mask)
+        output = output.transpose(0, 2, 1, 3).reshape(B, L, -1)
 
-        return self.o_proj(output), (keys, values)
+        return self.o_proj(output), cache
 
 
 # ---------------------------------------------------------------------------
@@ -127,6 +395,9 @@ class SwiGLUFFN(nn.Module):
         self.w3 = nn.Linear(config.d_model, config.d_ff, bias=False)
 
     def __call__(self, x: mx.array) -> mx.array:
+        if "w13" in self:
+            gate, up = mx.split(self.w13(x), 2, axis=-1)
+            return self.w2(nn.silu(gate) * up)
         return self.w2(nn.silu(self.w1(x)) * self.w3(x))
 
 
@@ -147,9 +418,9 @@ class TransformerBlock(nn.Module):
     def __call__(
         self,
         x: mx.array,
-        mask: Optional[mx.array] = None,
-        cache: Optional[Tuple[mx.array, mx.array]] = None,
-    ) -> Tuple[mx.array, Tuple[mx.array, mx.array]]:
+        mask: Mask = None,
+        cache: Optional[Cache] = None,
+    ) -> Tuple[mx.array, Cache]:
         # Pre-norm attention with residual
         h = self.norm1(x)
         attn_out, cache = self.attention(h, mask=mask, cache=cache)
@@ -162,6 +433,48 @@ class TransformerBlock(nn.Module):
         return x, cache
 
 
+# ---------------------------------------------------------------------------
+# Generation timings
+# ---------------------------------------------------------------------------
+
+@dataclass
+class StageTimings:
+    """
+    Seconds spent in each stage of one generation. generate(timings=...)
+    fills in prefill (the prompt's forward pass, after any prefix cache
+    lookup); the callers along the generate path (scripts/inference.py,
+    scripts/server.py, scripts/engine.py) fill in the other stages.
+    """
+    tokenize: float = 0.0
+    queue: float = 0.0       # waiting for the batch engine or the model
+    prefill: float = 0.0
+    decode: float = 0.0      # from the prefill to the last token read
+    detokenize: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+    STAGES = ("tokenize", "queue", "prefill", "decode", "detokenize")
+
+    @property
+    def total(self) -> float:
+        return sum(getattr(self, stage) for stage in self.STAGES)
+
+    @property
+    def decode_tokens_per_sec(self) -> float:
+        return self.output_tokens / self.decode if self.decode > 0 else 0.0
+
+    def add(self, other: "StageTimings"):
+        """Accumulate `other` into this one, e.g. over an evaluation set."""
+        for name in self.STAGES + ("prompt_tokens", "output_tokens"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def summary(self) -> str:
+        stages = [f"{stage} {getattr(self, stage) * 1e3:.1f} ms" for stage in self.STAGES
+                  if stage != "queue" or self.queue]
+        return (" | ".join(stages) + f" | {self.output_tokens} tokens, "
+                f"{self.decode_tokens_per_sec:.0f} tok/s")
+
+
 # ---------------------------------------------------------------------------
 # Full Model
 # ---------------------------------------------------------------------------
@@ -185,70 +498,153 @@ class AppleScriptTransformer(nn.Module):
         self.layers = [TransformerBlock(config) for _ in range(config.n_layers)]
         self.norm = nn.RMSNorm(config.d_model, eps=config.norm_eps)
         self.lm_head = nn.Linear(config.d_model, config.vocab_size, bias=False)
+        if config.route_head:
+            self.route_head = nn.Linear(config.d_model, 1)
+        self._compiled_decoder = None
+
+    @property
+    def dtype(self) -> mx.Dtype:
+        """Activation dtype (the embedding weight may be quantized, so use the final norm)."""
+        return self.norm.weight.dtype
+
+    @property
+    def compiled_decoder(self) -> "CompiledDecoder":
+        """Lazily-created holder for the compiled decode steps of this model."""
+        if self._compiled_decoder is None:
+            self._compiled_decoder = CompiledDecoder(self)
+        return self._compiled_decoder
 
     def __call__(
         self,
         x: mx.array,
-        mask: Optional[mx.array] = None,
-    ) -> mx.array:
+        mask: Mask = None,
+        return_hidden: bool = False,
+    ) -> Union[mx.array, Tuple[mx.array, mx.array]]:
         """
         Forward pass for training.
 
         Args:
             x: Token ids, shape (B, L).
-            mask: Optional pre-computed causal mask. If None, one is created.
+            mask: Optional pre-computed additive mask. If None, causal masking
+                  is applied inside the attention kernel without building an
+                  (L, L) mask tensor.
+            return_hidden: Also return the final normed hidden states
+                           (B, L, d_model), e.g. for route_logits.
 
         Returns:
-            Logits of shape (B, L, vocab_size).
+            Logits of shape (B, L, vocab_size), or (logits, hidden).
         """
         B, L = x.shape
 
         if mask is None:
-            mask = nn.MultiHeadAttention.create_additive_causal_mask(L)
-            mask = mask.astype(self.tok_embeddings.weight.dtype)
+            mask = "causal"
 
         h = self.tok_embeddings(x)
         for layer in self.layers:
             h, _ = layer(h, mask=mask)
         h = self.norm(h)
 
+        if return_hidden:
+            return self.lm_head(h), h
         return self.lm_head(h)
 
+    def route_logits(self, h: mx.array) -> mx.array:
+        """PASS_TO_CLOUD logit from route_head for normed hidden states (..., d_model)."""
+        return self.route_head(h)[..., 0]
+
     # -------------------------------------------------------------------
     # Inference utilities
     # -------------------------------------------------------------------
 
+    def make_cache(self, batch_size: int = 1) -> List[KVCache]:
+        """Allocate one preallocated KVCache per layer, sized to max_seq_len."""
+        return [
+            KVCache(
+                batch_size,
+                self.config.n_heads,
+                self.config.head_dim,
+                self.config.max_seq_len,
+                dtype=self.dtype,
+            )
+            for _ in self.layers
+        ]
+
+    def make_batch_cache(self, starts: List[int]) -> List[BatchKVCache]:
+        """Allocate one BatchKVCache per layer for rows whose first valid column is starts[i]."""
+        return [
+            BatchKVCache.empty(
+                starts,
+                self.config.n_heads,
+                self.config.head_dim,
+                self.config.max_seq_len,
+                dtype=self.dtype,
+            )
+            for _ in self.layers
+        ]
+
     def _prefill(
         self,
         tokens: mx.array,
-    ) -> Tuple[mx.array, List[Tuple[mx.array, mx.array]]]:
-        """Process the prompt and return logits + KV caches."""
+        cache: Optional[List[Cache]] = None,
+    ) -> Tuple[mx.array, List[Cache]]:
+        """
+        Process the prompt and return logits + KV caches.
+
+        If `cache` is a list of KVCache/BatchKVCache objects the prompt is
+        written into them (after any positions they already hold). Otherwise
+        legacy (keys, values) tuples are returned.
+        """
+        h, new_cache = self._forward_cached(tokens, cache)
+        logits = self.lm_head(h[:, -1])
+        return logits, new_cache
+
+    def _forward_cached(
+        self,
+        tokens: mx.array,
+        cache: Optional[List[Cache]],
+    ) -> Tuple[mx.array, List[Cache]]:
+        """Run the trunk over `tokens` after the cached positions; returns normed hidden states."""
         B, L = tokens.shape
-        mask = nn.MultiHeadAttention.create_additive_causal_mask(L)
-        mask = mask.astype(self.tok_embeddings.weight.dtype)
+        mask = _attention_mask(cache, L, self.dtype)
 
         h = self.tok_embeddings(tokens)
-        cache = []
-        for layer in self.layers:
-            h, c = layer(h, mask=mask)
-            cache.append(c)
-        h = self.norm(h)
-        logits = self.lm_head(h[:, -1])
-        return logits, cache
+        new_cache = []
+        for i, layer in enumerate(self.layers):
+            with profiling.span("layer", index=i, tokens=L) as span:
+                h, c = layer(h, mask=mask, cache=None if cache is None else cache[i])
+                span.eval(h)
+            new_cache.append(c)
+        return self.norm(h), new_cache
+
+    def _score(
+        self,
+        tokens: mx.array,
+        cache: List[Cache],
+    ) -> Tuple[mx.array, List[Cache]]:
+        """Like _prefill but returns logits for every position, shape (B, L, vocab)."""
+        h, cache = self._forward_cached(tokens, cache)
+        return self.lm_head(h), cache
 
     def _decode_step(
         self,
         token: mx.array,
-        cache: List[Tuple[mx.array, mx.array]],
-    ) -> Tuple[mx.array, List[Tuple[mx.array, mx.array]]]:
+        cache: List[Cache],
+        mask: Mask = None,
+    ) -> Tuple[mx.array, List[Cache]]:
         """Decode a single token using the KV cache."""
+        if mask is None and isinstance(cache[0], BatchKVCache):
+            mask = _attention_mask(cache, 1, self.dtype)
         h = self.tok_embeddings(token)
         new_cache = []
         for i, layer in enumerate(self.layers):
-            h, c = layer(h, mask=None, cache=cache[i])
+            with profiling.span("layer", index=i, tokens=1) as span:
+                h, c = layer(h, mask=mask, cache=cache[i])
+                span.eval(h)
             new_cache.append(c)
-        h = self.norm(h)
-        logits = self.lm_head(h[:, -1])
+        with profiling.span("lm_head") as span:
+            h = self.norm(h)
+            logits = self.lm_head(h[:, -1])
+            span.eval(logits)
         return logits, new_cache
 
     @staticmethod
@@ -268,6 +664,13 @@ class AppleScriptTransformer(nn.Module):
         Returns:
             Sampled token ids of shape (B,) or scalar.
         """
+        with profiling.span("sample", temperature=temperature) as span:
+            token = AppleScriptTransformer._sample_token(logits, temperature, top_p)
+            span.eval(token)
+        return token
+
+    @staticmethod
+    def _sample_token(logits: mx.array, temperature: float, top_p: float) -> mx.array:
         if temperature == 0.0:
             return mx.argmax(logits, axis=-1)
 
@@ -300,17 +703,62 @@ class AppleScriptTransformer(nn.Module):
         temperature: float = 0.8,
         top_p: float = 0.95,
         end_token_id: Optional[int] = None,
+        compiled: bool = False,
+        sync_every: int = 1,
+        proposer: Optional["Proposer"] = None,
+        num_draft_tokens: int = 4,
+        spec_stats: Optional["SpeculativeStats"] = None,
+        prefix_cache: Optional["PrefixCache"] = None,
+        grammar: Optional["TokenGrammar"] = None,
+        router: Optional["CloudRouter"] = None,
+        templates: Optional["TemplateTable"] = None,
+        template_stats: Optional["TemplateStats"] = None,
+        timings: Optional[StageTimings] = None,
     ):
         """
         Generate tokens autoregressively.
 
         Args:
             prompt_tokens: Input token ids, shape (1, L) or (B, L).
-            max_tokens: Maximum number of new tokens to generate.
+            max_tokens: Maximum number of new tokens to generate. Clamped so
+                        that prompt + output fits in config.max_seq_len.
             temperature: Sampling temperature (0 = greedy).
             top_p: Nucleus sampling threshold.
             end_token_id: Stop generation when this token is produced.
                           Defaults to config.end_token_id.
+            compiled: Run each decode step (and the sampler) through a
+                      fixed-shape mx.compile'd function. See CompiledDecoder.
+            sync_every: Check for the end token every this many steps,
+                        dispatching the steps in between asynchronously.
+                        1 checks (and syncs) after every token.
+            proposer: Enables speculative decoding (greedy, batch size 1). The
+                      proposer (see model/speculative.py) suggests up to
+                      num_draft_tokens tokens which are verified in a single
+                      forward pass; output is identical to greedy decoding.
+            num_draft_tokens: Tokens proposed per speculative step.
+            spec_stats: Optional SpeculativeStats filled in during decoding.
+            prefix_cache: Optional PrefixCache (model/prefix_cache.py, batch
+                          size 1). The longest cached prefix of the prompt is
+                          reused and only the rest is prefilled; the prompt's
+                          keys/values are then added to it.
+            grammar: Optional TokenGrammar (model/grammar.py). Tokens that
+                     would make the output invalid are masked out before
+                     sampling, and the output ends with the grammar's end
+                     token once it is complete. Steps sync every token, so
+                     compiled and sync_every are ignored.
+            router: Optional CloudRouter (model/routing.py, batch size 1).
+                    If it is confident after prefill that the output is
+                    PASS_TO_CLOUD, those tokens are yielded without decoding;
+                    otherwise decoding proceeds as usual.
+            templates: Optional TemplateTable (model/templates.py, batch size
+                       1). Tokens the matching output templates agree on are
+                       forced instead of decoded one by one; decoding falls
+                       back to the normal loop once the output leaves the
+                       table. compiled is ignored.
+            template_stats: Optional TemplateStats filled in during decoding.
+            timings: Optional StageTimings; its prefill and prompt_tokens are
+                     filled in. The prefill is then evaluated before the
+                     first decode step is dispatched.
 
         Yields:
             mx.array: Each generated token id, shape (B,).
@@ -322,20 +770,348 @@ class AppleScriptTransformer(nn.Module):
         if prompt_tokens.ndim == 1:
             prompt_tokens = prompt_tokens[None, :]
 
-        # Prefill: process entire prompt
-        logits, cache = self._prefill(prompt_tokens)
+        B, L = prompt_tokens.shape
+        max_tokens = min(max_tokens, self.config.max_seq_len - L)
+        if max_tokens <= 0:
+            return
+
+        if proposer is not None and (B != 1 or temperature != 0.0):
+            raise ValueError("speculative decoding requires batch size 1 and temperature 0")
+        if proposer is not None and grammar is not None:
+            raise ValueError("speculative decoding cannot be combined with a grammar")
+        if templates is not None and (B != 1 or proposer is not None or grammar is not None):
+            raise ValueError("template decoding requires batch size 1, without a proposer or grammar")
+        start = time.perf_counter()
+
+        # Prefill: process the prompt (minus any cached prefix) into a preallocated cache
+        with profiling.span("prefill", batch=B, tokens=L):
+            if prefix_cache is not None and B == 1:
+                prompt_ids = prompt_tokens[0].tolist()
+                cache, n_cached = prefix_cache.fetch(self, prompt_ids)
+                h, cache = self._forward_cached(prompt_tokens[:, n_cached:], cache)
+                prefix_cache.store(prompt_ids, cache)
+            else:
+                cache = self.make_cache(B)
+                h, cache = self._forward_cached(prompt_tokens, cache)
+            with profiling.span("lm_head") as head:
+                h = h[:, -1]
+                logits = self.lm_head(h)
+                head.eval(logits)
+        if timings is not None:
+            mx.eval(logits)
+            timings.prefill = time.perf_counter() - start
+            timings.prompt_tokens = L
+
+        if router is not None and B == 1 and router.routes(self, h, logits):
+            for t in (router.cloud_token_ids + [end_token_id])[:max_tokens]:
+                yield mx.array([t])
+            return
+
+        if grammar is not None:
+            yield from self._constrained_loop(
+                logits, cache, grammar, max_tokens, temperature, top_p,
+            )
+            return
+
+        if templates is not None:
+            yield from self._template_loop(
+                logits, cache, templates, max_tokens, end_token_id,
+                temperature, top_p, sync_every, template_stats,
+            )
+            return
+
         token = self._sample(logits, temperature=temperature, top_p=top_p)
-        yield token
 
-        # Autoregressive decoding
-        for _ in range(max_tokens - 1):
-            # Check for end token (batch dim)
-            if (token == end_token_id).all().item():
+        if proposer is not None:
+            yield from self._speculative_loop(
+                prompt_tokens[0].tolist(), token, cache, proposer,
+                max_tokens, end_token_id, num_draft_tokens, spec_stats,
+            )
+            return
+
+        if compiled:
+            step = self.compiled_decoder.stepper(cache, temperature, top_p)
+        else:
+            step = self._eager_stepper(cache, temperature, top_p)
+        yield from self._decode_loop(token, step, max_tokens, end_token_id, sync_every)
+
+    def _eager_stepper(
+        self,
+        cache: List[Cache],
+        temperature: float,
+        top_p: float,
+    ) -> Callable[[mx.array], mx.array]:
+        """Return a function mapping the last token (B,) to the next sampled token (B,)."""
+        n = 0  # steps taken; KVCache and BatchKVCache track positions differently
+
+        def step(token: mx.array) -> mx.array:
+            nonlocal cache, n
+            with profiling.span("decode_step", step=n) as span:
+                logits, cache = self._decode_step(token[:, None], cache)
+                token = self._sample(logits, temperature=temperature, top_p=top_p)
+                span.eval(token)
+            n += 1
+            return token
+        return step
+
+    @staticmethod
+    def _decode_loop(
+        token: mx.array,
+        step: Callable[[mx.array], mx.array],
+        max_tokens: int,
+        end_token_id: int,
+        sync_every: int = 1,
+    ):
+        """
+        Drive `step` autoregressively from the first sampled token.
+
+        Rows that have produced end_token_id are marked finished; their later
+        samples are replaced by end_token_id, and the loop stops once every
+        row has finished.
+
+        With sync_every=k > 1 the loop dispatches k steps with mx.async_eval
+        before checking for the end token, so there is one device->host sync
+        per k tokens instead of one per token. Tokens are yielded already
+        evaluated, and any steps past the point where every row finished are
+        discarded.
+        """
+        finished = token == end_token_id
+        if sync_every <= 1:
+            yield token
+            for _ in range(max_tokens - 1):
+                if finished.all().item():
+                    return
+                token = mx.where(finished, end_token_id, step(token))
+                finished = finished | (token == end_token_id)
+                yield token
+            return
+
+        chunk = [token]
+        mx.async_eval(token, finished)
+        for i in range(1, max_tokens + 1):
+            if len(chunk) == sync_every or i == max_tokens:
+                done = finished.all().item()
+                for tok in chunk:
+                    yield tok
+                    # Already evaluated, so this is a read rather than a sync
+                    if done and (tok == end_token_id).all().item():
+                        return
+                if done:
+                    return
+                chunk = []
+            if i == max_tokens:
                 return
+            token = mx.where(finished, end_token_id, step(token))
+            finished = finished | (token == end_token_id)
+            mx.async_eval(token, finished)
+            chunk.append(token)
 
+    def _constrained_loop(
+        self,
+        logits: mx.array,
+        cache: List[Cache],
+        grammar: "TokenGrammar",
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+    ):
+        """
+        Decode with each row's logits masked by its TokenGrammar state. The
+        sampled tokens are needed on the host to advance the states, so every
+        step syncs. Once a row emits the grammar's end token its mask only
+        allows that token, so finished rows keep repeating it.
+        """
+        states = [grammar.initial_state] * logits.shape[0]
+        for i in range(max_tokens):
+            masks = mx.stack([grammar.mask(state) for state in states])
+            token = self._sample(logits + masks, temperature=temperature, top_p=top_p)
+            ids = token.tolist()
+            states = [grammar.advance(state, t) for state, t in zip(states, ids)]
+            yield token
+            if all(state is None for state in states) or i == max_tokens - 1:
+                return
             logits, cache = self._decode_step(token[:, None], cache)
-            token = self._sample(logits, temperature=temperature, top_p=top_p)
+
+    def _template_loop(
+        self,
+        logits: mx.array,
+        cache: List[KVCache],
+        templates: "TemplateTable",
+        max_tokens: int,
+        end_token_id: int,
+        temperature: float,
+        top_p: float,
+        sync_every: int,
+        stats: Optional["TemplateStats"] = None,
+    ):
+        """
+        Decode while the output matches a template in `templates`. After each
+        token the model picked, the run of tokens every matching template
+        agrees on is forced:
+
+          - a run that ends the output (up to <|end|>) is emitted without
+            running the model,
+          - any other run is scored together with the last token in one
+            forward pass and kept only as far as it matches the model's own
+            samples, so with greedy decoding it never changes the output.
+
+        Once the model picks a token no template allows, the rest is decoded
+        by the normal loop.
+        """
+        if stats is None:
+            from model.templates import TemplateStats
+            stats = TemplateStats()
+        stats.queries += 1
+        state = templates.initial_state
+        generated = 0
+        token = self._sample(logits, temperature=temperature, top_p=top_p)
+        while True:
+            t = token.item()
+            nxt = templates.advance(state, t)
+            if nxt is None:
+                stats.fallbacks += 1
+                inner = self._eager_stepper(cache, temperature, top_p)
+
+                def step(tok: mx.array) -> mx.array:
+                    stats.model_steps += 1
+                    return inner(tok)
+                yield from self._decode_loop(token, step, max_tokens - generated, end_token_id, sync_every)
+                return
+
+            # Counters are updated before yielding: callers stop reading at <|end|>
+            state = nxt
+            generated += 1
+            stats.completed += t == end_token_id
             yield token
+            if t == end_token_id or generated >= max_tokens:
+                return
+
+            forced, _ = templates.forced(state)
+            forced = forced[:max_tokens - generated]
+            if forced and forced[-1] == templates.end_token_id:
+                stats.forced += len(forced)
+                stats.completed += 1
+                for f in forced:
+                    yield mx.array([f])
+                return
+
+            logits, cache = self._score(mx.array([[t] + forced]), cache)
+            stats.model_steps += 1
+            preds = self._sample(logits[0], temperature=temperature, top_p=top_p).tolist()
+            accepted = 0
+            while accepted < len(forced) and forced[accepted] == preds[accepted]:
+                accepted += 1
+            for c in cache:
+                c.trim(len(forced) - accepted)
+            stats.forced += accepted
+            for f in forced[:accepted]:
+                state = templates.advance(state, f)
+                generated += 1
+                yield mx.array([f])
+            if generated >= max_tokens:
+                return
+            token = mx.array([preds[accepted]])
+
+    def _speculative_loop(
+        self,
+        prompt_ids: List[int],
+        token: mx.array,
+        cache: List[KVCache],
+        proposer: "Proposer",
+        max_tokens: int,
+        end_token_id: int,
+        num_draft_tokens: int,
+        stats: Optional["SpeculativeStats"] = None,
+    ):
+        """
+        Greedy speculative decoding: each step asks `proposer` for up to
+        num_draft_tokens tokens, scores [last token] + drafts in one forward
+        pass, keeps the longest prefix matching the model's own argmax plus
+        the model's next token, and trims rejected positions from the cache.
+        """
+        history = prompt_ids + [token.item()]
+        proposer.reset(prompt_ids)
+        generated = 1
+        yield token
+        if history[-1] == end_token_id:
+            return
+
+        max_len = self.config.max_seq_len
+        while generated < max_tokens:
+            # Room for the last token plus k drafts, without overshooting max_tokens
+            k = min(num_draft_tokens, max_len - cache[0].offset - 1, max_tokens - generated - 1)
+            drafts = proposer.propose(history, k) if k > 0 else []
+
+            logits, cache = self._score(mx.array([history[-1:] + drafts]), cache)
+            preds = mx.argmax(logits[0], axis=-1).tolist()
+
+            accepted = 0
+            while accepted < len(drafts) and drafts[accepted] == preds[accepted]:
+                accepted += 1
+            for c in cache:
+                c.trim(len(drafts) - accepted)
+            if stats is not None:
+                stats.record(len(drafts), accepted)
+
+            for t in drafts[:accepted] + [preds[accepted]]:
+                history.append(t)
+                generated += 1
+                yield mx.array([t])
+                if t == end_token_id or generated >= max_tokens:
+                    return
+
+    def generate_batch(
+        self,
+        prompts: List[List[int]],
+        max_tokens: int = 256,
+        temperature: float = 0.8,
+        top_p: float = 0.95,
+        end_token_id: Optional[int] = None,
+        sync_every: int = 8,
+    ) -> List[List[int]]:
+        """
+        Generate for a batch of prompts of different lengths.
+
+        Prompts are left-padded with pad_token_id into one (B, max_len) array.
+        A BatchKVCache masks the padding and gives each row RoPE positions
+        counted from its own first real token, so every row produces the same
+        output it would produce on its own.
+
+        Args:
+            prompts: Token ids per prompt (ragged).
+            max_tokens: Maximum number of new tokens per row.
+            temperature: Sampling temperature (0 = greedy).
+            top_p: Nucleus sampling threshold.
+            end_token_id: Per-row stop token. Defaults to config.end_token_id.
+            sync_every: Steps dispatched between end-token checks (see generate).
+
+        Returns:
+            Generated token ids per row, excluding the end token.
+        """
+        if end_token_id is None:
+            end_token_id = self.config.end_token_id
+        if not prompts:
+            return []
+
+        tokens, pads = left_pad(prompts, self.config.pad_token_id)
+        max_tokens = min(max_tokens, self.config.max_seq_len - tokens.shape[1])
+        if max_tokens <= 0:
+            return [[] for _ in prompts]
+
+        cache = self.make_batch_cache(pads)
+        logits, cache = self._prefill(tokens, cache)
+        token = self._sample(logits, temperature=temperature, top_p=top_p)
+        step = self._eager_stepper(cache, temperature, top_p)
+
+        steps = list(self._decode_loop(token, step, max_tokens, end_token_id, sync_every))
+        rows = mx.stack(steps, axis=-1).tolist()
+
+        outputs = []
+        for row in rows:
+            if end_token_id in row:
+                row = row[:row.index(end_token_id)]
+            outputs.append(row)
+        return outputs
 
     def generate_text(
         self,
@@ -369,6 +1145,67 @@ class AppleScriptTransformer(nn.Module):
         return mx.stack(tokens, axis=-1)
 
 
+# ---------------------------------------------------------------------------
+# Compiled decoding
+# ---------------------------------------------------------------------------
+
+class CompiledDecoder:
+    """
+    Single-token decode step + sampler wrapped in mx.compile.
+
+    The step always sees the full (B, n_heads, max_seq_len, head_dim) KV
+    buffers and takes the write position as an mx.array, so input shapes never
+    change between steps and the graph is traced once per
+    (batch size, temperature, top_p) instead of on every token.
+    """
+
+    def __init__(self, model: AppleScriptTransformer):
+        self.model = model
+        self._steps = {}
+
+    def step_fn(self, temperature: float, top_p: float):
+        """Return the compiled step for a sampling configuration."""
+        key = (temperature, top_p)
+        if key not in self._steps:
+            model = self.model
+            positions = mx.arange(model.config.max_seq_len)
+            dtype = model.dtype
+
+            def step(token, offset, keys, values):
+                # Runs once, while tracing: spans cannot evaluate inside mx.compile
+                with profiling.suspended():
+                    cache = [KVCache.from_buffers(k, v, offset) for k, v in zip(keys, values)]
+                    mask = mx.where(positions <= offset, 0.0, -1e9).astype(dtype)
+                    logits, cache = model._decode_step(token[:, None], cache, mask=mask)
+                    token = model._sample(logits, temperature=temperature, top_p=top_p)
+                return token, [c.keys for c in cache], [c.values for c in cache]
+
+            state = [model.state, mx.random.state]
+            self._steps[key] = mx.compile(step, inputs=state, outputs=[mx.random.state])
+        return self._steps[key]
+
+    def stepper(
+        self,
+        cache: List[KVCache],
+        temperature: float,
+        top_p: float,
+    ) -> Callable[[mx.array], mx.array]:
+        """Like AppleScriptTransformer._eager_stepper, but running the compiled step."""
+        step_fn = self.step_fn(temperature, top_p)
+        offset = mx.array(cache[0].offset, dtype=mx.int32)
+        keys = [c.keys for c in cache]
+        values = [c.values for c in cache]
+
+        def step(token: mx.array) -> mx.array:
+            nonlocal offset, keys, values
+            with profiling.span("decode_step", compiled=True) as span:
+                token, keys, values = step_fn(token, offset, keys, values)
+                span.eval(token)
+            offset = offset + 1
+            return token
+        return step
+
+
 # ---------------------------------------------------------------------------
 # Loss function
 # ---------------------------------------------------------------------------
@@ -412,18 +1249,99 @@ def compute_loss(
 # ---------------------------------------------------------------------------
 
 def count_parameters(model: nn.Module) -> int:
-    """Count total trainable parameters."""
-    nparams = sum(
-        x.size for k, x in nn.utils.tree_flatten(model.parameters())
+    """Count total trainable parameters (quantized weights are counted unpacked)."""
+    nparams = 0
+    leaves = nn.utils.tree_flatten(
+        model.leaf_modules(), is_leaf=lambda m: isinstance(m, nn.Module)
     )
+    for _, module in leaves:
+        if isinstance(module, (nn.QuantizedLinear, nn.QuantizedEmbedding)):
+            nparams += module.weight.size * 32 // module.bits
+        else:
+            nparams += sum(x.size for _, x in nn.utils.tree_flatten(module.parameters()))
     return nparams
 
 
+def _fuse_linears(linears: List[nn.Module]) -> nn.Module:
+    """Stack bias-free (Quantized)Linear layers along the output dim into one layer."""
+    first = linears[0]
+    if isinstance(first, nn.QuantizedLinear):
+        in_dims = first.weight.shape[1] * 32 // first.bits
+        out_dims = sum(l.weight.shape[0] for l in linears)
+        fused = nn.QuantizedLinear(
+            in_dims, out_dims, bias=False, group_size=first.group_size, bits=first.bits
+        )
+        fused.scales = mx.concatenate([l.scales for l in linears], axis=0)
+        fused.biases = mx.concatenate([l.biases for l in linears], axis=0)
+    else:
+        in_dims = first.weight.shape[1]
+        out_dims = sum(l.weight.shape[0] for l in linears)
+        fused = nn.Linear(in_dims, out_dims, bias=False)
+    fused.weight = mx.concatenate([l.weight for l in linears], axis=0)
+    return fused
+
+
+def fuse_projections(model: AppleScriptTransformer) -> AppleScriptTransformer:
+    """
+    Fuse q/k/v_proj into one qkv_proj and w1/w3 into one w13, in place.
+
+    Works on loaded (optionally quantized) checkpoints, so no retraining is
+    needed; logits are unchanged up to float rounding. The fused model's
+    weight names differ, so save checkpoints before fusing.
+    """
+    for layer in model.layers:
+        attn, ffn = layer.attention, layer.ffn
+        if "qkv_proj" not in attn:
+            attn.qkv_proj = _fuse_linears([attn.q_proj, attn.k_proj, attn.v_proj])
+            for name in ("q_proj", "k_proj", "v_proj"):
+                attn.pop(name)
+        if "w13" not in ffn:
+            ffn.w13 = _fuse_linears([ffn.w1, ffn.w3])
+            ffn.pop("w1")
+            ffn.pop("w3")
+    model._compiled_decoder = None
+    mx.eval(model.parameters())
+    return model
+
+
+def quantize_model(
+    model: AppleScriptTransformer,
+    group_size: int = 64,
+    bits: int = 8,
+    embeddings: bool = False,
+) -> dict:
+    """
+    Group-wise quantize the model in place.
+
+    All nn.Linear layers (q/k/v/o_proj, w1/w2/w3, lm_head) become
+    nn.QuantizedLinear; the token embedding is quantized only if `embeddings`.
+
+    Returns:
+        The dict to store as ModelConfig.quantization.
+    """
+    def predicate(path: str, module: nn.Module) -> bool:
+        if path == "route_head":
+            return False
+        if isinstance(module, nn.Embedding):
+            return embeddings
+        return isinstance(module, nn.Linear)
+
+    nn.quantize(model, group_size=group_size, bits=bits, class_predicate=predicate)
+    return {"group_size": group_size, "bits": bits, "embeddings": embeddings}
+
+
 def create_model(config: Optional[ModelConfig] = None) -> AppleScriptTransformer:
-    """Create a model with the given (or default) configuration."""
+    """
+    Create a model with the given (or default) configuration.
+
+    If config.quantization is set the layers are swapped for their quantized
+    versions, so a quantized checkpoint can be loaded with load_weights.
+    """
     if config is None:
         config = ModelConfig()
     model = AppleScriptTransformer(config)
+    if config.quantization:
+        quantize_model(model, **config.quantization)
     mx.eval(model.parameters())
     return model
 
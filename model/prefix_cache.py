@@ -0,0 +1,254 @@
+"""
+Prefix KV-cache reuse across requests.
+
+Every prompt starts with `<|input|>` and conversational traffic shares lead-ins
+("hey can you", "please"), so consecutive requests recompute the same
+keys/values for their first few tokens. PrefixCache keeps those per-layer KV
+tensors in a radix tree keyed by token ids; a new prompt copies its longest
+cached prefix into a fresh cache and only the remaining suffix goes through
+_prefill.
+
+Keys and values at a position depend only on the tokens up to it (causal
+attention, RoPE by absolute position), so reused prefixes give the same
+logits as a full prefill.
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import mlx.core as mx
+
+from model.model import AppleScriptTransformer, BatchKVCache, Cache, KVCache
+
+
+class _Node:
+    """Radix tree node; `kv` holds the edge's tokens, shape (n_layers, 2, H, len(tokens), D)."""
+
+    __slots__ = ("tokens", "kv", "children", "parent", "last_used")
+
+    def __init__(self, tokens: Tuple[int, ...], kv: Optional[mx.array], parent: Optional["_Node"]):
+        self.tokens = tokens
+        self.kv = kv
+        self.children: Dict[int, "_Node"] = {}
+        self.parent = parent
+        self.last_used = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.kv.nbytes if self.kv is not None else 0
+
+
+class PrefixCache:
+    """
+    Radix tree of prompt-prefix KV tensors, bounded to `max_bytes`.
+
+    When over budget the least recently used leaves are evicted first, so
+    shared lead-ins (which every lookup touches) outlive the unique tails of
+    individual prompts. Safe to share between the batching engine thread and
+    direct generate() calls.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.root = _Node((), None, None)
+        self.nbytes = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0             # lookups that reused at least one token
+        self.prompt_tokens = 0    # prompt tokens seen by lookups
+        self.reused_tokens = 0    # prompt tokens not recomputed
+        self.evictions = 0
+
+    # -------------------------------------------------------------------
+    # Building prefilled caches
+    # -------------------------------------------------------------------
+
+    def fetch(self, model: AppleScriptTransformer, prompt_ids: List[int]) -> Tuple[List[KVCache], int]:
+        """
+        A fresh single-row cache holding the longest cached prefix of
+        `prompt_ids`; returns (cache, n) where prompt_ids[n:] still needs _prefill.
+        """
+        n, kv = self._match(prompt_ids)
+        cache = model.make_cache(1)
+        for layer, c in enumerate(cache):
+            if n:
+                c.keys[:, :, :n, :] = kv[layer, 0][None]
+                c.values[:, :, :n, :] = kv[layer, 1][None]
+            c.offset = n
+        self._record([len(prompt_ids)], [n])
+        return cache, n
+
+    def fetch_batch(
+        self,
+        model: AppleScriptTransformer,
+        prompts: List[List[int]],
+        pad_token_id: int,
+    ) -> Tuple[mx.array, List[BatchKVCache]]:
+        """
+        Batched counterpart of fetch(): returns (tokens, cache) ready for
+        model._prefill(tokens, cache).
+
+        Rows are right-aligned as with left_pad, and the batch only computes
+        the last S columns, where S is the longest uncached suffix. Row i
+        takes its first len_i - S tokens from the tree (these are cached,
+        since S >= len_i - n_i); rows shorter than S are left-padded as usual.
+        With nothing cached this is exactly left_pad + make_batch_cache.
+        """
+        matches = [self._match(p) for p in prompts]
+        total = max(len(p) for p in prompts)
+        suffix = max(len(p) - n for p, (n, _) in zip(prompts, matches))
+        offset = total - suffix
+
+        starts = [total - len(p) for p in prompts]
+        cache = model.make_batch_cache(starts)
+        rows, used = [], []
+        for i, (p, (_, kv)) in enumerate(zip(prompts, matches)):
+            n = max(len(p) - suffix, 0)
+            if n:
+                for layer, c in enumerate(cache):
+                    c.keys[i, :, starts[i]:offset, :] = kv[layer, 0, :, :n]
+                    c.values[i, :, starts[i]:offset, :] = kv[layer, 1, :, :n]
+            rows.append([pad_token_id] * (suffix - len(p) + n) + p[n:])
+            used.append(n)
+        for c in cache:
+            c.offsets = [offset] * len(prompts)
+
+        self._record([len(p) for p in prompts], used)
+        return mx.array(rows, dtype=mx.int32), cache
+
+    # -------------------------------------------------------------------
+    # Tree operations
+    # -------------------------------------------------------------------
+
+    def store(self, prompt_ids: List[int], cache: List[Cache], row: int = 0):
+        """Insert a prefilled prompt's keys/values (row `row` of `cache`) into the tree."""
+        start = cache[0].starts[row] if isinstance(cache[0], BatchKVCache) else 0
+        tokens = tuple(prompt_ids)
+        with self._lock:
+            self._clock += 1
+            node, pos = self.root, 0
+            while pos < len(tokens):
+                child = node.children.get(tokens[pos])
+                if child is None:
+                    break
+                common = _common_length(child.tokens, tokens[pos:])
+                if common < len(child.tokens):
+                    child = self._split(child, common)
+                child.last_used = self._clock
+                node, pos = child, pos + common
+
+            if pos < len(tokens):
+                kv = mx.stack([
+                    mx.stack([c.keys[row, :, start + pos:start + len(tokens)],
+                              c.values[row, :, start + pos:start + len(tokens)]])
+                    for c in cache
+                ])
+                # Evaluated here rather than async: an array left scheduled on
+                # this thread's stream cannot be read from another thread
+                mx.eval(kv)
+                leaf = _Node(tokens[pos:], kv, node)
+                leaf.last_used = self._clock
+                node.children[tokens[pos]] = leaf
+                self.nbytes += leaf.nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self.root = _Node((), None, None)
+            self.nbytes = 0
+
+    def _match(self, prompt_ids: List[int]) -> Tuple[int, Optional[mx.array]]:
+        """
+        Longest cached prefix of prompt_ids[:-1] (the last token is always
+        recomputed, since its logits are needed): (length, stacked kv).
+        """
+        limit = len(prompt_ids) - 1
+        segments = []
+        with self._lock:
+            self._clock += 1
+            node, pos = self.root, 0
+            while pos < limit:
+                child = node.children.get(prompt_ids[pos])
+                if child is None:
+                    break
+                common = _common_length(child.tokens, prompt_ids[pos:limit])
+                segments.append(child.kv[:, :, :, :common] if common < len(child.tokens) else child.kv)
+                child.last_used = self._clock
+                node, pos = child, pos + common
+                if common < len(child.tokens):
+                    break
+        if not segments:
+            return 0, None
+        kv = segments[0] if len(segments) == 1 else mx.concatenate(segments, axis=3)
+        return pos, kv
+
+    def _split(self, node: _Node, at: int) -> _Node:
+        """Split `node`'s edge after `at` tokens; returns the new upper node."""
+        upper = _Node(node.tokens[:at], node.kv[:, :, :, :at], node.parent)
+        upper.last_used = node.last_used
+        node.parent.children[node.tokens[0]] = upper
+        node.tokens, node.kv, node.parent = node.tokens[at:], node.kv[:, :, :, at:], upper
+        mx.eval(upper.kv, node.kv)  # see store()
+        upper.children[node.tokens[0]] = node
+        return upper
+
+    def _evict(self):
+        """Drop least recently used leaves until within max_bytes."""
+        while self.nbytes > self.max_bytes:
+            leaves = []
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node.children:
+                    stack.extend(node.children.values())
+                elif node is not self.root:
+                    leaves.append(node)
+            if not leaves:
+                return
+            leaves.sort(key=lambda n: n.last_used)
+            for leaf in leaves:
+                if self.nbytes <= self.max_bytes:
+                    break
+                del leaf.parent.children[leaf.tokens[0]]
+                self.nbytes -= leaf.nbytes
+                self.evictions += 1
+
+    # -------------------------------------------------------------------
+    # Stats
+    # -------------------------------------------------------------------
+
+    def _record(self, lengths: List[int], reused: List[int]):
+        with self._lock:
+            self.lookups += len(lengths)
+            self.hits += sum(1 for n in reused if n)
+            self.prompt_tokens += sum(lengths)
+            self.reused_tokens += sum(reused)
+
+    def stats(self) -> dict:
+        with self._lock:
+            nodes, stack = 0, [self.root]
+            while stack:
+                node = stack.pop()
+                nodes += len(node.children)
+                stack.extend(node.children.values())
+            return {
+                "nodes": nodes,
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "prompt_tokens": self.prompt_tokens,
+                "reused_tokens": self.reused_tokens,
+                "reused_fraction": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def _common_length(a: Tuple[int, ...], b) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
@@ -0,0 +1,178 @@
+"""
+Opt-in span profiler for the generation hot path, with Chrome trace export.
+
+Spans are recorded only while profiling is on: process-wide after enable()
+(the --profile flags of scripts/inference.py, scripts/server.py and
+scripts/train.py), or for the calling thread inside record() (a server
+request sent with an X-Rune-Profile header). Otherwise span() returns a
+shared no-op, so instrumented code pays one global check per span.
+
+    with profiling.span("prefill", tokens=L) as span:
+        logits = ...
+        span.eval(logits)
+
+MLX evaluates lazily, so a span only measures its own work if it evaluates
+its result before it ends; span.eval() does that while recording and nothing
+otherwise. A profiled run therefore syncs at every span and loses the
+overlap that sync_every and async dispatch normally give: compare spans with
+each other, not with unprofiled latency.
+
+Traces are Chrome trace event JSON; open them in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import mlx.core as mx
+
+
+class Trace:
+    """Recorded spans, as Chrome trace "complete" events."""
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start_ns: int, end_ns: int, args: dict):
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": start_ns / 1000, "dur": (end_ns - start_ns) / 1000,
+                 "pid": os.getpid(), "tid": thread.ident}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def chrome(self) -> dict:
+        """The trace as a Chrome trace JSON object (thread names included)."""
+        with self._lock:
+            names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                     for tid, name in self._threads.items()]
+            return {"traceEvents": names + list(self.events), "displayTimeUnit": "ms"}
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome(), f)
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """name -> (count, total milliseconds), largest total first."""
+        totals = collections.defaultdict(lambda: [0, 0.0])
+        with self._lock:
+            for event in self.events:
+                totals[event["name"]][0] += 1
+                totals[event["name"]][1] += event["dur"] / 1000
+        return {name: (n, ms) for name, (n, ms) in sorted(totals.items(), key=lambda item: -item[1][1])}
+
+
+class _Span:
+    __slots__ = ("trace", "name", "args", "start")
+
+    def __init__(self, trace: Trace, name: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start, time.perf_counter_ns(), self.args)
+
+    def eval(self, *arrays):
+        mx.eval(*arrays)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def eval(self, *arrays):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_GLOBAL: Optional[Trace] = None  # set by enable()
+_recording_threads = 0  # threads inside record()
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def span(name: str, **args):
+    """Context manager timing its body as `name` while profiling; a no-op otherwise."""
+    if _GLOBAL is None and not _recording_threads:
+        return _NULL_SPAN
+    if getattr(_local, "suspended", False):
+        return _NULL_SPAN
+    trace = getattr(_local, "trace", None) or _GLOBAL
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name, args)
+
+
+def enable() -> Trace:
+    """Record spans from every thread into a new process-wide trace."""
+    global _GLOBAL
+    _GLOBAL = Trace()
+    return _GLOBAL
+
+
+def disable() -> Optional[Trace]:
+    """Stop process-wide recording; returns the trace recorded so far."""
+    global _GLOBAL
+    trace, _GLOBAL = _GLOBAL, None
+    return trace
+
+
+def enabled() -> bool:
+    return _GLOBAL is not None
+
+
+def save(path: str):
+    """Write the process-wide trace to `path`, if profiling is enabled."""
+    if _GLOBAL is not None:
+        _GLOBAL.save(path)
+
+
+def recording() -> bool:
+    """Whether the calling thread is inside record()."""
+    return getattr(_local, "trace", None) is not None
+
+
+@contextlib.contextmanager
+def record():
+    """Record the calling thread's spans into a new Trace (instead of the process-wide one)."""
+    global _recording_threads
+    previous = getattr(_local, "trace", None)
+    trace = _local.trace = Trace()
+    with _lock:
+        _recording_threads += 1
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+        with _lock:
+            _recording_threads -= 1
+
+
+@contextlib.contextmanager
+def suspended():
+    """No spans on this thread inside the block, e.g. while mx.compile traces a function."""
+    previous = getattr(_local, "suspended", False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
@@ -0,0 +1,74 @@
+"""
+Early PASS_TO_CLOUD routing.
+
+Roughly a third of requests are answered with PASS_TO_CLOUD, which otherwise
+costs a full token-by-token decode before the caller can check for it.
+CloudRouter decides right after prefill from the hidden state of the final
+prompt token (<|output|>):
+
+  - with a trained route_head (ModelConfig.route_head, see
+    scripts/train.py --route-head) the probability is the head's sigmoid,
+  - otherwise it is the language model's probability of the first
+    PASS_TO_CLOUD token (no other output starts with it).
+
+Requests at or above `threshold` get the PASS_TO_CLOUD tokens immediately;
+everything else falls back to full decoding, so a low-confidence router can
+only cost accuracy where it is confidently wrong.
+"""
+
+from dataclasses import dataclass
+from typing import List
+
+import mlx.core as mx
+
+from model.model import AppleScriptTransformer
+
+CLOUD_OUTPUT = "PASS_TO_CLOUD"
+
+
+@dataclass
+class RouteStats:
+    """Counters for routing decisions."""
+    decisions: int = 0
+    routed: int = 0        # answered PASS_TO_CLOUD without decoding
+    fallbacks: int = 0     # decoded in full
+
+    @property
+    def routed_rate(self) -> float:
+        return self.routed / self.decisions if self.decisions else 0.0
+
+
+class CloudRouter:
+    """Decides PASS_TO_CLOUD after prefill when confident enough."""
+
+    def __init__(self, cloud_token_ids: List[int], threshold: float = 0.9):
+        self.cloud_token_ids = list(cloud_token_ids)
+        self.threshold = threshold
+        self.stats = RouteStats()
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer, threshold: float = 0.9) -> "CloudRouter":
+        """Use the PASS_TO_CLOUD tokens exactly as they are framed in training (" {output} ")."""
+        return cls(tokenizer.encode(f" {CLOUD_OUTPUT} ").ids, threshold)
+
+    def probability(self, model: AppleScriptTransformer, h: mx.array, logits: mx.array) -> mx.array:
+        """
+        P(PASS_TO_CLOUD) per row, shape (B,), from the last prompt position's
+        normed hidden state h (B, d_model) and its next-token logits (B, vocab).
+        """
+        if model.config.route_head:
+            return mx.sigmoid(model.route_logits(h).astype(mx.float32))
+        probs = mx.softmax(logits.astype(mx.float32), axis=-1)
+        return probs[:, self.cloud_token_ids[0]]
+
+    def decide(self, model: AppleScriptTransformer, h: mx.array, logits: mx.array) -> List[bool]:
+        """Per-row routing decisions (one host sync)."""
+        routed = (self.probability(model, h, logits) >= self.threshold).tolist()
+        self.stats.decisions += len(routed)
+        self.stats.routed += sum(routed)
+        self.stats.fallbacks += len(routed) - sum(routed)
+        return routed
+
+    def routes(self, model: AppleScriptTransformer, h: mx.array, logits: mx.array) -> bool:
+        """Single-row decide()."""
+        return self.decide(model, h, logits)[0]
@@ -0,0 +1,201 @@
+"""
+Token proposers for speculative decoding.
+
+AppleScriptTransformer.generate(proposer=...) asks a proposer for a few likely
+next tokens, then verifies them all in one forward pass of the main model and
+keeps the longest prefix that matches its own greedy choices. A proposer only
+has to be cheap and often right; wrong guesses cost a little wasted compute,
+never a different output.
+"""
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import mlx.core as mx
+
+from model.model import AppleScriptTransformer
+
+
+@dataclass
+class SpeculativeStats:
+    """Counters filled in by a speculative generate() call."""
+    steps: int = 0        # verification forward passes
+    drafted: int = 0      # tokens proposed
+    accepted: int = 0     # proposed tokens that matched the main model
+
+    def record(self, drafted: int, accepted: int):
+        self.steps += 1
+        self.drafted += drafted
+        self.accepted += accepted
+
+    @property
+    def tokens_per_step(self) -> float:
+        """Tokens emitted per main-model forward pass (accepted + 1 per step)."""
+        return (self.accepted + self.steps) / self.steps if self.steps else 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+
+class Proposer:
+    """Interface for draft-token proposers."""
+
+    def reset(self, prompt_ids: List[int]):
+        """Called once per request, before the first propose()."""
+
+    def propose(self, history: List[int], k: int) -> List[int]:
+        """Return up to k tokens likely to follow `history` (prompt + output so far)."""
+        raise NotImplementedError
+
+
+class DraftModelProposer(Proposer):
+    """
+    Proposes tokens by greedy decoding with a much smaller draft model
+    (e.g. 2 layers, d_model 128, trained with scripts/train.py) that shares
+    the main model's tokenizer.
+
+    The draft keeps its own KVCache; tokens it guessed wrong are trimmed and
+    the tokens actually accepted are fed back before drafting again.
+    """
+
+    def __init__(self, draft_model: AppleScriptTransformer):
+        self.model = draft_model
+        self.cache = None
+        self.cached: List[int] = []   # tokens currently held in self.cache
+
+    def reset(self, prompt_ids: List[int]):
+        self.cache = self.model.make_cache(1)
+        self.cached = []
+
+    def propose(self, history: List[int], k: int) -> List[int]:
+        # Roll the draft cache back to the longest prefix it shares with history
+        common = 0
+        for a, b in zip(self.cached, history):
+            if a != b:
+                break
+            common += 1
+        for c in self.cache:
+            c.trim(len(self.cached) - common)
+        self.cached = self.cached[:common]
+
+        pending = history[common:]
+        k = min(k, self.model.config.max_seq_len - common - len(pending))
+        if k <= 0:
+            return []
+
+        logits, self.cache = self.model._prefill(mx.array([pending]), self.cache)
+        token = mx.argmax(logits, axis=-1)
+        drafts = [token]
+        for _ in range(k - 1):
+            logits, self.cache = self.model._decode_step(token[:, None], self.cache)
+            token = mx.argmax(logits, axis=-1)
+            drafts.append(token)
+
+        drafts = mx.concatenate(drafts).tolist()
+        # The last draft token was sampled but never fed to the draft model
+        self.cached = history + drafts[:-1]
+        return drafts
+
+
+class NgramTable:
+    """
+    Most likely next token after each 1..n-gram of output tokens, mined from
+    (input, output) pairs. Every script shares a lot of boilerplate
+    (`tell application "`, `" to activate`, `end tell`), so a frequency table
+    predicts long stretches of output without running any model.
+
+    Only contexts seen at least `min_count` times whose top continuation has
+    at least `min_share` of the occurrences are kept, so lookup() returns
+    None where the table is unsure.
+    """
+
+    def __init__(self, n: int = 6, min_count: int = 2, min_share: float = 0.4):
+        self.n = n
+        self.min_count = min_count
+        self.min_share = min_share
+        self.next: Dict[Tuple[int, ...], int] = {}
+
+    @classmethod
+    def from_pairs(
+        cls,
+        records: Iterable[dict],
+        tokenizer,
+        output_token_id: int,
+        end_token_id: int,
+        **kwargs,
+    ) -> "NgramTable":
+        """Mine a table from the outputs of {"input", "output"} records, framed as in training."""
+        table = cls(**kwargs)
+        outputs = [f" {r.get('output', '')} " for r in records]
+        counts: Dict[Tuple[int, ...], Counter] = defaultdict(Counter)
+        for enc in tokenizer.encode_batch(outputs):
+            seq = [output_token_id] + enc.ids + [end_token_id]
+            for i in range(1, len(seq)):
+                for m in range(1, min(table.n, i) + 1):
+                    counts[tuple(seq[i - m:i])][seq[i]] += 1
+
+        for context, followers in counts.items():
+            token, count = followers.most_common(1)[0]
+            total = sum(followers.values())
+            if count >= table.min_count and count >= table.min_share * total:
+                table.next[context] = token
+        return table
+
+    def __len__(self) -> int:
+        return len(self.next)
+
+    def lookup(self, history: List[int]) -> Optional[int]:
+        """The next token for the longest known suffix of `history`, if any."""
+        for m in range(min(self.n, len(history)), 0, -1):
+            token = self.next.get(tuple(history[-m:]))
+            if token is not None:
+                return token
+        return None
+
+
+class PromptLookupProposer(Proposer):
+    """
+    Draft-free proposer. Drafts from an NgramTable of frequent output n-grams
+    while the table is confident, then fills the rest of the draft by copying
+    the tokens that followed the latest earlier occurrence of the current
+    suffix (longest n-gram first, down to `min_ngram`) in the prompt and
+    output so far.
+
+    Scripts always repeat AppleScript boilerplate and often repeat text from
+    the request (note bodies, file names, search terms), so both sources are
+    right often enough to pay for themselves, at no extra forward passes.
+    """
+
+    def __init__(
+        self,
+        table: Optional[NgramTable] = None,
+        max_ngram: int = 3,
+        min_ngram: int = 1,
+    ):
+        self.table = table
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+
+    def propose(self, history: List[int], k: int) -> List[int]:
+        context = list(history)
+        drafts = []
+        while self.table is not None and len(drafts) < k:
+            token = self.table.lookup(context)
+            if token is None:
+                break
+            drafts.append(token)
+            context.append(token)
+        if len(drafts) < k:
+            drafts += self._copy(context, k - len(drafts))
+        return drafts
+
+    def _copy(self, history: List[int], k: int) -> List[int]:
+        """Continuation of the latest earlier match of history's last n tokens."""
+        for n in range(min(self.max_ngram, len(history) - 1), self.min_ngram - 1, -1):
+            suffix = history[-n:]
+            for start in range(len(history) - n - 1, -1, -1):
+                if history[start:start + n] == suffix:
+                    return history[start + n:start + n + k]
+        return []
@@ -0,0 +1,178 @@
+"""
+Template-slot decoding.
+
+Most on-device outputs are near-fixed templates with one or two slots:
+
+    set volume output volume <N>
+    do shell script "sleep <N>" ...
+    tell application "<S>" to activate
+
+TemplateTable mines these from the training outputs at token level: runs of
+number tokens become a NUM slot and the contents of a simple string literal
+(`"` ... `"` on one line) a STR slot. Templates seen at least `min_count`
+times are stored in a trie.
+
+AppleScriptTransformer.generate(templates=...) then lets the model decide only
+where the trie branches (which template, and slot tokens); wherever the trie
+has a single continuation the tokens are forced. Forced tokens in the middle
+of an output are fed back in one forward pass, and a forced tail up to
+<|end|> is emitted without running the model at all. As soon as the model
+picks a token no template allows, decoding falls back to the normal loop,
+so outputs outside the table are unaffected.
+
+Byte-level BPE never merges across the pre-tokenizer's letter/number/
+punctuation boundaries, so slots always start and end on token boundaries.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+NUM = -1  # slot: one or more number tokens
+STR = -2  # slot: contents of a string literal
+
+_NUMBER = re.compile(r"^Ġ?\d+$")
+
+# A state is a set of (trie node, slot) pairs: slot is NUM/STR while inside
+# a slot whose trie edge leads to `node`, None otherwise
+State = FrozenSet[Tuple[int, Optional[int]]]
+
+
+@dataclass
+class TemplateStats:
+    """Counters filled in by generate(templates=...)."""
+    queries: int = 0
+    completed: int = 0    # outputs that ended inside a template
+    fallbacks: int = 0    # outputs that left the table and were decoded freely
+    forced: int = 0       # tokens emitted from the table instead of sampled
+    model_steps: int = 0  # forward passes after prefill
+
+    @property
+    def completed_rate(self) -> float:
+        return self.completed / self.queries if self.queries else 0.0
+
+
+class TemplateTable:
+    """Trie of output templates (token ids with NUM/STR slots), mined from (input, output) pairs."""
+
+    def __init__(self, tokenizer, end_token_id: int, vocab_size: int, min_count: int = 2):
+        self.end_token_id = end_token_id
+        self.min_count = min_count
+        self.templates: List[Tuple[int, ...]] = []
+        self.counts: List[int] = []
+        self._children: List[Dict[int, int]] = [{}]
+        self._leaf_template: Dict[int, int] = {}
+
+        # Token classes, by byte-level piece ("Ġ" is a leading space, "Ċ" a newline)
+        special = {t.content for t in tokenizer.get_added_tokens_decoder().values()}
+        pieces = {i: p for p, i in tokenizer.get_vocab().items() if p not in special and i < vocab_size}
+        self._number_ids = frozenset(i for i, p in pieces.items() if _NUMBER.match(p))
+        self._string_ids = frozenset(i for i, p in pieces.items() if '"' not in p and "Ċ" not in p)
+        self._open_quote_ids = frozenset(i for i, p in pieces.items() if p.endswith('"') and p.count('"') == 1)
+        self._close_quote_ids = frozenset(i for i, p in pieces.items() if p.startswith('"'))
+        self._slot_ids = {NUM: self._number_ids, STR: self._string_ids}
+
+    @classmethod
+    def from_pairs(
+        cls,
+        records: Iterable[dict],
+        tokenizer,
+        end_token_id: int,
+        vocab_size: int,
+        min_count: int = 2,
+    ) -> "TemplateTable":
+        """Mine templates from the outputs of {"input", "output"} records, framed as in training."""
+        table = cls(tokenizer, end_token_id, vocab_size, min_count)
+        outputs = [f" {r.get('output', '')} " for r in records]
+        counts = Counter(table.template(enc.ids) for enc in tokenizer.encode_batch(outputs))
+        for template, count in counts.most_common():
+            if count >= min_count:
+                table._add(template, count)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def template(self, ids: List[int]) -> Tuple[int, ...]:
+        """Template of an output's token ids (without <|output|>): slots replaced, <|end|> appended."""
+        out, i = [], 0
+        while i < len(ids):
+            t = ids[i]
+            if t in self._number_ids:
+                while i < len(ids) and ids[i] in self._number_ids:
+                    i += 1
+                out.append(NUM)
+                continue
+            out.append(t)
+            i += 1
+            if t in self._open_quote_ids:
+                j = i
+                while j < len(ids) and ids[j] in self._string_ids:
+                    j += 1
+                if j > i and j < len(ids) and ids[j] in self._close_quote_ids:
+                    out.append(STR)
+                    i = j
+        return tuple(out) + (self.end_token_id,)
+
+    def _add(self, template: Tuple[int, ...], count: int):
+        node = 0
+        for t in template:
+            child = self._children[node].get(t)
+            if child is None:
+                child = len(self._children)
+                self._children.append({})
+                self._children[node][t] = child
+            node = child
+        self._leaf_template[node] = len(self.templates)
+        self.templates.append(template)
+        self.counts.append(count)
+
+    @property
+    def initial_state(self) -> State:
+        return frozenset([(0, None)])
+
+    def advance(self, state: State, token: int) -> Optional[State]:
+        """The state after `token`, or None if no template allows it."""
+        nxt = set()
+        for node, slot in state:
+            children = self._children[node]
+            if slot is not None and token in self._slot_ids[slot]:
+                nxt.add((node, slot))
+                continue
+            child = children.get(token)
+            if child is not None:
+                nxt.add((child, None))
+            if slot is None:
+                for s in (NUM, STR):
+                    child = children.get(s)
+                    if child is not None and token in self._slot_ids[s]:
+                        nxt.add((child, s))
+        return frozenset(nxt) or None
+
+    def forced(self, state: State) -> Tuple[List[int], State]:
+        """
+        Tokens every matching template agrees on from `state` (up to the next
+        branch, slot or <|end|>), and the state after them.
+        """
+        run = []
+        while len(state) == 1:
+            node, slot = next(iter(state))
+            children = self._children[node]
+            if slot is not None or len(children) != 1:
+                break
+            token, child = next(iter(children.items()))
+            if token < 0:
+                break
+            run.append(token)
+            state = frozenset([(child, None)])
+            if token == self.end_token_id:
+                break
+        return run, state
+
+    def template_id(self, state: State) -> Optional[int]:
+        """Index into `templates` once <|end|> has been emitted, else None."""
+        for node, _ in state:
+            if node in self._leaf_template:
+                return self._leaf_template[node]
+        return None
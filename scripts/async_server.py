@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Asyncio HTTP server for Rune-lm with streaming responses.
+
+Same endpoints, responses and options as scripts/server.py, plus streaming:
+
+  GET  /health              → {"status": "ok"}
+  GET  /cache               → response and prefix KV cache counters
+  GET  /queue               → queue depth and shed/degraded/expired counts
+  GET  /metrics             → Prometheus metrics (scripts/metrics.py)
+  POST /generate            → {"script": "...", "is_cloud": false, "query": "..."}
+  POST /generate?stream=1   → text/event-stream (also with "stream": true in the body):
+                                data: {"text": " tell application"}
+                                data: {"text": " \"Safari\""}
+                                ...
+                                data: {"script": "...", "is_cloud": false, "query": "...", "done": true}
+
+A request with an "X-Rune-Profile: 1" header gets its Chrome trace under
+"trace" (in the final event when streaming), as in scripts/server.py.
+
+A single event loop accepts connections and parses requests, so a long
+generation never blocks other clients. Admission control, "timeout_ms"
+deadlines, GET /queue and GET /metrics work as in scripts/server.py;
+requests beyond the generation threads plus --max-queue are shed before they
+reach the pool. Generation runs on a thread pool
+(scripts/server.py's generate_stream, through the continuous-batching engine
+unless --no-batching) and feeds text pieces back to the loop with
+call_soon_threadsafe as tokens are decoded. A failed generation ends the
+stream with a {"error": "..."} event.
+
+Connections are persistent HTTP/1.1: responses carry a Content-Length, or
+use chunked transfer encoding for streams, and the connection is reused
+until the client closes it, it idles for --keepalive-timeout seconds or it
+has served --max-keepalive-requests responses.
+
+--unix-socket serves the same HTTP API on a Unix domain socket and
+--binary-socket the length-prefixed protocol of scripts/binary_protocol.py.
+
+Standard library only; model loading and all decoding options are shared
+with scripts/server.py.
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import profiling
+from scripts import server
+from scripts.engine import DeadlineExceeded, QueueFull
+from scripts.binary_protocol import HEADER_BYTES, payload_length
+from scripts.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    params: Dict[str, List[str]]
+    headers: Dict[str, str]
+    body: bytes
+    version: str
+
+    @property
+    def keep_alive(self) -> bool:
+        """Whether the client allows the connection to be reused."""
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """The next request on the connection, or None at end of stream."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "request body too large")
+    body = await reader.readexactly(length) if length > 0 else b""
+
+    url = urlsplit(target)
+    return Request(method, url.path, parse_qs(url.query), headers, body, version)
+
+
+def head(status: int, content_type: str, keep_alive: bool, length: int = None) -> bytes:
+    """Status line and headers; without `length` the body is sent in chunks."""
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    else:
+        lines += ["Transfer-Encoding: chunked", "Cache-Control: no-cache"]
+    if status == 503:
+        lines.append(f"Retry-After: {server.RETRY_AFTER}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def json_response(data: dict, keep_alive: bool, status: int = 200) -> bytes:
+    body = json.dumps(data).encode("utf-8")
+    return head(status, "application/json", keep_alive, len(body)) + body
+
+
+def text_response(text: str, content_type: str, keep_alive: bool) -> bytes:
+    body = text.encode("utf-8")
+    return head(200, content_type, keep_alive, len(body)) + body
+
+
+def sse_chunk(data: Optional[dict]) -> bytes:
+    """One server-sent event as an HTTP chunk; None is the terminating chunk."""
+    if data is None:
+        return b"0\r\n\r\n"
+    event = f"data: {json.dumps(data)}\n\n".encode("utf-8")
+    return b"%x\r\n%s\r\n" % (len(event), event)
+
+
+class AsyncServer:
+    """
+    Routes requests; generation is handed to `executor`, with at most
+    `max_inflight` generations submitted or running at once.
+    """
+
+    def __init__(
+        self,
+        executor: ThreadPoolExecutor,
+        idle_timeout: Optional[float] = 5.0,
+        max_requests: int = 100,
+        max_inflight: Optional[int] = None,
+    ):
+        self.executor = executor
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.max_inflight = max_inflight
+        self.inflight = 0  # only touched on the event loop
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        served = 0
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                served += 1
+                keep_alive = request.keep_alive and served < self.max_requests
+                started = time.perf_counter()
+                try:
+                    status = await self.dispatch(writer, request, keep_alive)
+                except HTTPError as e:
+                    status = e.status
+                    writer.write(json_response({"error": str(e)}, keep_alive, e.status))
+                await writer.drain()
+                server.METRICS.observe_request(request.path, status, time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            # The request could not be parsed, so the connection cannot be reused
+            writer.write(json_response({"error": str(e)}, False, e.status))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            with contextlib.suppress(ConnectionError):
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+
+    async def handle_binary(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer binary-protocol frames until the client disconnects or idles out."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    header = await asyncio.wait_for(reader.readexactly(HEADER_BYTES), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                payload = await reader.readexactly(payload_length(header))
+                writer.write(await loop.run_in_executor(self.executor, server.binary_response, payload))
+                await writer.drain()
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            with contextlib.suppress(ConnectionError):
+                writer.close()
+                await writer.wait_closed()
+
+    async def dispatch(self, writer: asyncio.StreamWriter, request: Request, keep_alive: bool) -> int:
+        """Write the response to `request`; returns its status."""
+        method, path = request.method, request.path
+        if method == "GET" and path == "/health":
+            writer.write(json_response({"status": "ok"}, keep_alive))
+        elif method == "GET" and path == "/cache":
+            writer.write(json_response(server.cache_stats(), keep_alive))
+        elif method == "GET" and path == "/queue":
+            writer.write(json_response(self.queue_stats(), keep_alive))
+        elif method == "GET" and path == "/metrics":
+            text = server.metrics_text(self.queue_stats())
+            writer.write(text_response(text, METRICS_CONTENT_TYPE, keep_alive))
+        elif method == "POST" and path == "/generate":
+            return await self.generate(writer, request, keep_alive)
+        else:
+            writer.write(json_response({"error": "not found"}, keep_alive, 404))
+            return 404
+        return 200
+
+    def queue_stats(self) -> dict:
+        return {**server.queue_stats(), "inflight": self.inflight}
+
+    async def generate(self, writer: asyncio.StreamWriter, request: Request, keep_alive: bool) -> int:
+        try:
+            data = json.loads(request.body) if request.body else {}
+        except json.JSONDecodeError:
+            raise HTTPError(400, "invalid JSON")
+
+        query = data.get("query", "").strip()
+        if not query:
+            raise HTTPError(400, "missing 'query' field")
+        temperature = data.get("temperature", 0.0)
+        stream = request.params.get("stream", ["0"])[-1] in ("1", "true") or data.get("stream") is True
+        profile = server.profile_requested(request.headers.get(server.PROFILE_HEADER.lower()))
+        try:
+            deadline = server.request_deadline(data.get("timeout_ms"))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        if self.max_inflight is not None and self.inflight >= self.max_inflight:
+            status, body = server.overload_response(query, QueueFull("too many requests in flight"))
+            writer.write(json_response(body, keep_alive, status))
+            return status
+
+        if not stream:
+            loop = asyncio.get_running_loop()
+            self.inflight += 1
+            try:
+                generate = server.generate_traced if profile else server.generate
+                result = await loop.run_in_executor(
+                    self.executor, functools.partial(generate, query, temperature, deadline=deadline))
+                script, trace = result if profile else (result, None)
+            except Exception as e:
+                status, body = server.overload_response(query, e) or (500, {"error": str(e)})
+                writer.write(json_response(body, keep_alive, status))
+                return status
+            finally:
+                self.inflight -= 1
+            body = server.response_body(query, script)
+            if trace is not None:
+                body["trace"] = trace
+            writer.write(json_response(body, keep_alive))
+            return 200
+
+        writer.write(head(200, "text/event-stream", keep_alive))
+        text, trace = "", None
+        cancelled = threading.Event()
+        try:
+            async for kind, value in self.stream(query, temperature, deadline, profile, cancelled):
+                if kind == "error":
+                    writer.write(sse_chunk({"error": value}))
+                    break
+                if kind == "trace":
+                    trace = value
+                    continue
+                text += value
+                writer.write(sse_chunk({"text": value}))
+                await writer.drain()
+        except ConnectionError:
+            cancelled.set()  # the client went away; stop its generation
+            raise
+        else:
+            done = {**server.response_body(query, text.strip()), "done": True}
+            if trace is not None:
+                done["trace"] = trace
+            writer.write(sse_chunk(done))
+        writer.write(sse_chunk(None))
+        return 200
+
+    async def stream(self, query: str, temperature: float, deadline: Optional[float] = None,
+                     profile: bool = False, cancelled: Optional[threading.Event] = None):
+        """
+        Run generate_stream on the executor and yield ("text", piece) as pieces
+        arrive, or a final ("error", message). With `profile`, a ("trace",
+        Chrome trace) follows the last piece. Once `cancelled` is set (the
+        client went away) the worker stops at the next piece and closes
+        generate_stream, which cancels the request in the engine.
+        """
+        loop = asyncio.get_running_loop()
+        pieces: asyncio.Queue = asyncio.Queue()
+
+        def finished():
+            self.inflight -= 1
+            pieces.put_nowait(None)
+
+        def produce():
+            output = server.generate_stream(query, temperature, deadline=deadline)
+            try:
+                with profiling.record() if profile else contextlib.nullcontext() as trace:
+                    for piece in output:
+                        if cancelled is not None and cancelled.is_set():
+                            return
+                        loop.call_soon_threadsafe(pieces.put_nowait, ("text", piece))
+                if trace is not None:
+                    loop.call_soon_threadsafe(pieces.put_nowait, ("trace", trace.chrome()))
+            except Exception as e:
+                if isinstance(e, DeadlineExceeded):
+                    server.count_admission("expired")
+                elif isinstance(e, QueueFull):
+                    server.count_admission("shed")
+                loop.call_soon_threadsafe(pieces.put_nowait, ("error", str(e)))
+            finally:
+                output.close()  # cancels the engine request if it is still running
+                loop.call_soon_threadsafe(finished)
+
+        self.inflight += 1
+        loop.run_in_executor(self.executor, produce)
+        while True:
+            item = await pieces.get()
+            if item is None:
+                return
+            yield item
+
+
+async def serve(args):
+    workers = 1 if args.no_batching else args.max_batch_size
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generate")
+    max_inflight = workers + server.MAX_QUEUE if server.MAX_QUEUE is not None else None
+    if args.keepalive_timeout > 0:
+        app = AsyncServer(executor, args.keepalive_timeout, max(1, args.max_keepalive_requests), max_inflight)
+    else:
+        app = AsyncServer(executor, None, 1, max_inflight)
+    listeners = [await asyncio.start_server(app.handle, args.host, args.port)]
+    unix_sockets = [(path, handler) for path, handler in [(args.unix_socket, app.handle),
+                                                           (args.binary_socket, app.handle_binary)] if path]
+    for path, handler in unix_sockets:
+        server.remove_stale_socket(path)
+        listeners.append(await asyncio.start_unix_server(handler, path))
+        os.chmod(path, 0o600)
+    print(f"Async server ready on http://{args.host}:{args.port}")
+    print(f"  GET  /health            → health check")
+    print(f"  GET  /cache             → response cache stats")
+    print(f"  GET  /queue             → queue depth and shed counts")
+    print(f"  GET  /metrics           → Prometheus metrics")
+    print(f"  POST /generate          → {{\"query\": \"...\"}}")
+    print(f"  POST /generate?stream=1 → server-sent events, one per decoded piece")
+    if args.unix_socket:
+        print(f"  HTTP/JSON also on unix:{args.unix_socket}")
+    if args.binary_socket:
+        print(f"  Binary protocol on unix:{args.binary_socket}")
+    try:
+        await asyncio.gather(*(listener.serve_forever() for listener in listeners))
+    finally:
+        for listener in listeners:
+            listener.close()
+        for path, _ in unix_sockets:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = server.build_parser("Rune-lm asyncio HTTP server with streaming")
+    args = parser.parse_args()
+    server.setup(args, parser)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
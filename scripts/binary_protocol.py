@@ -0,0 +1,159 @@
+"""
+Length-prefixed binary protocol for local clients (server.py --binary-socket).
+
+Every message is a frame: a 4-byte big-endian payload length, then the
+payload. A connection carries any number of request/response pairs in turn.
+
+Request payload:
+    flags (u8) | temperature (f32) | timeout_ms (u32, 0 = none) | query (UTF-8)
+    flags & FLAG_TOKEN_IDS: answer with output token ids instead of the script
+
+Response payload:
+    status (u8) | body
+    STATUS_OK       body is the script (UTF-8), or the token ids (u32 each)
+    STATUS_CLOUD    same as STATUS_OK, and the output is PASS_TO_CLOUD
+    STATUS_ERROR    body is an error message (UTF-8)
+    STATUS_BUSY     the server's queue is full; body is a message
+    STATUS_TIMEOUT  timeout_ms passed before the output was finished
+
+An empty request payload is a ping, answered with an empty STATUS_OK
+response without touching the model.
+
+All integers and floats are big-endian. Compared with JSON over HTTP there is
+no header parsing or JSON encoding on either side, and over a Unix domain
+socket no loopback TCP stack.
+"""
+
+import socket
+import struct
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+FLAG_TOKEN_IDS = 1
+
+STATUS_OK = 0
+STATUS_CLOUD = 1
+STATUS_ERROR = 2
+STATUS_BUSY = 3
+STATUS_TIMEOUT = 4
+
+MAX_FRAME_BYTES = 1 << 20
+
+_LENGTH = struct.Struct(">I")
+HEADER_BYTES = _LENGTH.size
+_REQUEST = struct.Struct(">BfI")
+
+
+class ServerBusy(RuntimeError):
+    """STATUS_BUSY response."""
+
+
+class ServerTimeout(TimeoutError):
+    """STATUS_TIMEOUT response."""
+
+
+def frame(payload: bytes) -> bytes:
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def payload_length(header: bytes) -> int:
+    """Payload length from a frame's HEADER_BYTES-byte header."""
+    (length,) = _LENGTH.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"frame of {length} bytes exceeds {MAX_FRAME_BYTES}")
+    return length
+
+
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    """The next frame's payload, or None if the stream ends before one starts."""
+    header = stream.read(HEADER_BYTES)
+    if not header:
+        return None
+    if len(header) < HEADER_BYTES:
+        raise ValueError("truncated frame header")
+    length = payload_length(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise ValueError("truncated frame")
+    return payload
+
+
+def encode_request(query: str, temperature: float = 0.0, token_ids: bool = False,
+                   timeout_ms: int = 0) -> bytes:
+    flags = FLAG_TOKEN_IDS if token_ids else 0
+    return frame(_REQUEST.pack(flags, temperature, timeout_ms) + query.encode("utf-8"))
+
+
+def encode_ping() -> bytes:
+    return frame(b"")
+
+
+def decode_request(payload: bytes) -> Tuple[str, float, bool, int]:
+    """(query, temperature, token_ids, timeout_ms) of a request payload."""
+    if len(payload) < _REQUEST.size:
+        raise ValueError("request too short")
+    flags, temperature, timeout_ms = _REQUEST.unpack_from(payload)
+    query = payload[_REQUEST.size:].decode("utf-8")
+    return query, temperature, bool(flags & FLAG_TOKEN_IDS), timeout_ms
+
+
+def encode_response(script: str, token_ids: Optional[List[int]] = None) -> bytes:
+    """A successful response; the body is `token_ids` when given, else the script."""
+    status = STATUS_CLOUD if script.strip() == "PASS_TO_CLOUD" else STATUS_OK
+    if token_ids is not None:
+        body = struct.pack(f">{len(token_ids)}I", *token_ids)
+    else:
+        body = script.encode("utf-8")
+    return frame(bytes([status]) + body)
+
+
+def encode_error(message: str, status: int = STATUS_ERROR) -> bytes:
+    return frame(bytes([status]) + message.encode("utf-8"))
+
+
+def decode_response(payload: bytes, token_ids: bool = False) -> Tuple[Union[str, List[int]], bool]:
+    """
+    (script or token ids, is_cloud); raises ServerBusy, ServerTimeout or
+    RuntimeError for an error response.
+    """
+    status, body = payload[0], payload[1:]
+    if status == STATUS_BUSY:
+        raise ServerBusy(body.decode("utf-8"))
+    if status == STATUS_TIMEOUT:
+        raise ServerTimeout(body.decode("utf-8"))
+    if status == STATUS_ERROR:
+        raise RuntimeError(body.decode("utf-8"))
+    if token_ids:
+        value = list(struct.unpack(f">{len(body) // 4}I", body))
+    else:
+        value = body.decode("utf-8")
+    return value, status == STATUS_CLOUD
+
+
+class BinaryClient:
+    """Minimal blocking client, e.g. for benchmarks and as a reference for other languages."""
+
+    def __init__(self, path: str, timeout: float = 60.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile("rb")
+
+    def request(self, message: bytes) -> bytes:
+        """Send a framed request; returns the response payload."""
+        self.sock.sendall(message)
+        payload = read_frame(self.stream)
+        if payload is None:
+            raise ConnectionError("server closed the connection")
+        return payload
+
+    def generate(self, query: str, temperature: float = 0.0, token_ids: bool = False,
+                 timeout_ms: int = 0) -> Tuple[Union[str, List[int]], bool]:
+        message = encode_request(query, temperature, token_ids, timeout_ms)
+        return decode_response(self.request(message), token_ids)
+
+    def ping(self):
+        decode_response(self.request(encode_ping()))
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
@@ -0,0 +1,399 @@
+"""
+Continuous-batching generation engine for the Rune-lm server.
+
+A single background thread owns the model. Callers (HTTP handler threads)
+submit tokenized prompts and block on the returned request. Between decode
+steps the engine:
+
+  1. admits newly arrived requests with one batched, left-padded _prefill
+     (with a PrefixCache, only the longest uncached prompt suffix is computed),
+  2. runs `sync_every` batched _decode_steps over every in-flight row,
+     dispatched with mx.async_eval and read back with a single host sync,
+  3. retires rows that produced <|end|>/<|pad|> or hit their token budget
+     (tokens a row sampled after finishing within the chunk are discarded).
+
+Rows sit at different positions in a BatchKVCache, so finished rows leave and
+new arrivals join mid-flight without waiting for the rest of the batch.
+
+With a CloudRouter, rows it is confident will answer PASS_TO_CLOUD are
+finished right after prefill without joining the decode batch.
+
+With a TokenGrammar each row's logits are masked by its grammar state before
+sampling; states advance on the host, so the engine then syncs every step.
+
+Requests submitted with `on_tokens` are streamed: the callback receives each
+row's new tokens after every host sync, on the engine thread.
+
+Admission control: with `max_queue`, submit() raises QueueFull once that many
+requests are waiting for a batch slot. A request with a `deadline` (or one
+that was cancel()ed) is finished with DeadlineExceeded (or RequestCancelled)
+at the next host sync, whether it is still queued or mid-decode, and leaves
+the batch so its slot goes to the next arrival.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mlx.core as mx
+
+from model import profiling
+from model.model import AppleScriptTransformer, StageTimings, left_pad
+from model.grammar import TokenGrammar
+from model.prefix_cache import PrefixCache
+from model.routing import CloudRouter
+
+
+class QueueFull(RuntimeError):
+    """The engine already has `max_queue` requests waiting for a batch slot."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before it finished."""
+
+
+class RequestCancelled(RuntimeError):
+    """The request was cancelled before it finished."""
+
+
+class GenerationRequest:
+    """
+    A prompt submitted to the engine; `result()` blocks until it finishes.
+
+    If `on_tokens` is set it is called on the engine thread as
+    on_tokens(new_ids, done) whenever output tokens were added, and once with
+    done=True when the request finishes (check `error` then).
+
+    `deadline` is a time.monotonic() timestamp after which the engine stops
+    working on the request. If `timings` is given, the engine fills in its
+    queue (submit to admission) and prefill (the batched prefill the request
+    was admitted with).
+    """
+
+    def __init__(
+        self,
+        prompt_ids: List[int],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        on_tokens: Optional[Callable[[List[int], bool], None]] = None,
+        deadline: Optional[float] = None,
+        timings: Optional[StageTimings] = None,
+    ):
+        self.prompt_ids = list(prompt_ids)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.on_tokens = on_tokens
+        self.deadline = deadline
+        self.cancelled = False
+        self.timings = timings
+        self.submitted = time.perf_counter()
+        self.output_ids: List[int] = []
+        self.grammar_state = None
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._streamed = 0
+
+    def flush(self, done: bool = False):
+        """Pass output tokens not yet streamed to `on_tokens`."""
+        if self.on_tokens is None:
+            return
+        new_ids = self.output_ids[self._streamed:]
+        self._streamed = len(self.output_ids)
+        if new_ids or done:
+            self.on_tokens(new_ids, done)
+
+    def cancel(self):
+        """Ask the engine to drop the request at its next host sync."""
+        self.cancelled = True
+
+    def stop_reason(self, now: float) -> Optional[BaseException]:
+        """Why the engine should stop working on the request, or None to carry on."""
+        if self.cancelled:
+            return RequestCancelled("request cancelled")
+        if self.deadline is not None and now >= self.deadline:
+            return DeadlineExceeded("deadline exceeded")
+        return None
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self._done.set()
+        self.flush(done=True)
+
+    def result(self, timeout: Optional[float] = None) -> List[int]:
+        """Wait for the request and return its generated token ids (without <|end|>)."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return self.output_ids
+
+
+class BatchEngine:
+    """Schedules concurrent generation requests into shared batched decode steps."""
+
+    def __init__(
+        self,
+        model: AppleScriptTransformer,
+        max_batch_size: int = 32,
+        sync_every: int = 4,
+        prefix_cache: Optional[PrefixCache] = None,
+        grammar: Optional[TokenGrammar] = None,
+        router: Optional[CloudRouter] = None,
+        max_queue: Optional[int] = None,
+    ):
+        self.model = model
+        self.config = model.config
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.sync_every = 1 if grammar is not None else max(1, sync_every)
+        self.prefix_cache = prefix_cache
+        self.grammar = grammar
+        self.router = router
+        self.stop_ids = {self.config.end_token_id, self.config.pad_token_id}
+
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Admission counters
+        self.rejected = 0
+        self.expired = 0
+        self.cancelled = 0
+
+        # In-flight state, only touched by the engine thread
+        self._active: List[GenerationRequest] = []
+        self._cache = None
+        self._tokens: Optional[mx.array] = None
+
+    # -------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(
+        self,
+        prompt_ids: List[int],
+        max_tokens: int = 256,
+        temperature: float = 0.0,
+        top_p: float = 0.9,
+        on_tokens: Optional[Callable[[List[int], bool], None]] = None,
+        deadline: Optional[float] = None,
+        timings: Optional[StageTimings] = None,
+    ) -> GenerationRequest:
+        """Queue a prompt; raises QueueFull if `max_queue` requests are already waiting."""
+        request = GenerationRequest(prompt_ids, max_tokens, temperature, top_p, on_tokens, deadline, timings)
+        if self.grammar is not None:
+            request.grammar_state = self.grammar.initial_state
+        with self._cond:
+            if self.max_queue is not None and len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._pending)} requests already queued")
+            self._pending.append(request)
+            self._cond.notify()
+        return request
+
+    def stats(self) -> dict:
+        """Queue depth, batch occupancy and admission counters."""
+        with self._cond:
+            return {
+                "queued": len(self._pending),
+                "active": len(self._active),
+                "max_queue": self.max_queue,
+                "max_batch_size": self.max_batch_size,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "cancelled": self.cancelled,
+            }
+
+    def generate(self, prompt_ids: List[int], **kwargs) -> List[int]:
+        """Submit a prompt and block until its output token ids are ready."""
+        return self.submit(prompt_ids, **kwargs).result()
+
+    # -------------------------------------------------------------------
+    # Engine loop
+    # -------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending and not self._active:
+                    self._cond.wait()
+                if not self._running:
+                    break
+                self._drop_stopped_pending()
+                free = self.max_batch_size - len(self._active)
+                arrivals = [self._pending.popleft() for _ in range(min(free, len(self._pending)))]
+
+            try:
+                if arrivals:
+                    with profiling.span("admit", requests=len(arrivals)):
+                        self._admit(arrivals)
+                if self._active:
+                    with profiling.span("batch_step", rows=len(self._active)):
+                        self._step()
+            except Exception as e:
+                for request in self._active + arrivals:
+                    if not request._done.is_set():
+                        request.finish(e)
+                self._active, self._cache, self._tokens = [], None, None
+
+        for request in self._active + list(self._pending):
+            request.finish(RuntimeError("engine stopped"))
+
+    def _stop(self, request: GenerationRequest, now: float) -> bool:
+        """Finish `request` if it was cancelled or is past its deadline."""
+        reason = request.stop_reason(now)
+        if reason is None:
+            return False
+        if isinstance(reason, DeadlineExceeded):
+            self.expired += 1
+        else:
+            self.cancelled += 1
+        request.finish(reason)
+        return True
+
+    def _drop_stopped_pending(self):
+        """Finish queued requests that were cancelled or expired while waiting (holding _cond)."""
+        now = time.monotonic()
+        if any(r.cancelled or r.deadline is not None and now >= r.deadline for r in self._pending):
+            self._pending = collections.deque(r for r in self._pending if not self._stop(r, now))
+
+    def _admit(self, requests: List[GenerationRequest]):
+        """Prefill new arrivals as one left-padded batch and merge them into the active set."""
+        admitted = time.perf_counter()
+        max_len = self.config.max_seq_len
+        for request in requests:
+            if len(request.prompt_ids) >= max_len:
+                request.finish(ValueError(f"prompt longer than max_seq_len={max_len}"))
+        requests = [r for r in requests if not r._done.is_set()]
+        if not requests:
+            return
+
+        prompts = [r.prompt_ids for r in requests]
+        if self.prefix_cache is not None:
+            tokens, cache = self.prefix_cache.fetch_batch(self.model, prompts, self.config.pad_token_id)
+        else:
+            tokens, pads = left_pad(prompts, self.config.pad_token_id)
+            cache = self.model.make_batch_cache(pads)
+        h, cache = self.model._forward_cached(tokens, cache)
+        h = h[:, -1]
+        logits = self.model.lm_head(h)
+        next_tokens = self._sample(logits, requests)
+        if self.prefix_cache is not None:
+            for i, prompt in enumerate(prompts):
+                self.prefix_cache.store(prompt, cache, row=i)
+
+        rows = [[t] for t in next_tokens.tolist()]
+        prefilled = time.perf_counter()
+        for request in requests:
+            if request.timings is not None:
+                request.timings.queue = admitted - request.submitted
+                request.timings.prefill = prefilled - admitted
+                request.timings.prompt_tokens = len(request.prompt_ids)
+        if self.router is not None:
+            for i, routed in enumerate(self.router.decide(self.model, h, logits)):
+                if routed:
+                    requests[i].output_ids = self.router.cloud_token_ids[:requests[i].max_tokens]
+                    rows[i] = [self.config.end_token_id]
+        keep = self._record(requests, rows, cache[0].offsets)
+        if not keep:
+            return
+        requests = [requests[i] for i in keep]
+        cache = [c.filter(keep) for c in cache]
+        next_tokens = next_tokens[mx.array(keep)]
+
+        if self._active:
+            self._cache = [a.extend(b) for a, b in zip(self._cache, cache)]
+            self._tokens = mx.concatenate([self._tokens, next_tokens])
+        else:
+            self._cache, self._tokens = cache, next_tokens
+        self._active.extend(requests)
+
+    def _step(self):
+        """Up to `sync_every` batched decode steps over every in-flight row."""
+        n_steps = min(self.sync_every, self.config.max_seq_len - max(self._cache[0].offsets))
+        tokens = self._tokens
+        steps = []
+        for _ in range(n_steps):
+            logits, self._cache = self.model._decode_step(tokens[:, None], self._cache)
+            tokens = self._sample(logits, self._active)
+            mx.async_eval(tokens)
+            steps.append(tokens)
+
+        rows = mx.stack(steps, axis=-1).tolist()
+        keep = self._record(self._active, rows, self._cache[0].offsets)
+        if len(keep) == len(self._active):
+            self._tokens = tokens
+        elif keep:
+            self._active = [self._active[i] for i in keep]
+            self._cache = [c.filter(keep) for c in self._cache]
+            self._tokens = tokens[mx.array(keep)]
+        else:
+            self._active, self._cache, self._tokens = [], None, None
+
+    def _record(
+        self,
+        requests: List[GenerationRequest],
+        rows: List[List[int]],
+        offsets: List[int],
+    ) -> List[int]:
+        """
+        Append each row's newly sampled tokens, finish completed requests and
+        return the indices of rows still running.
+
+        offsets[i] is row i's cache position after the step(s), i.e. where its
+        last sampled token would be written next.
+        """
+        keep = []
+        now = time.monotonic()
+        for i, (request, row) in enumerate(zip(requests, rows)):
+            if self._stop(request, now):
+                continue
+            for j, token in enumerate(row):
+                if self.grammar is not None:
+                    request.grammar_state = self.grammar.advance(request.grammar_state, token)
+                if token in self.stop_ids:
+                    request.finish()
+                    break
+                request.output_ids.append(token)
+                position = offsets[i] - (len(row) - 1 - j)
+                if len(request.output_ids) >= request.max_tokens or position >= self.config.max_seq_len:
+                    request.finish()
+                    break
+            else:
+                keep.append(i)
+                request.flush()
+        return keep
+
+    def _sample(self, logits: mx.array, requests: List[GenerationRequest]) -> mx.array:
+        """Sample one token per row, grouping rows that share sampling settings."""
+        if self.grammar is not None:
+            logits = logits + mx.stack([self.grammar.mask(r.grammar_state) for r in requests])
+        settings = {(r.temperature, r.top_p) for r in requests}
+        if len(settings) == 1:
+            temperature, top_p = settings.pop()
+            return self.model._sample(logits, temperature=temperature, top_p=top_p)
+        rows = [
+            self.model._sample(logits[i:i + 1], temperature=r.temperature, top_p=r.top_p)
+            for i, r in enumerate(requests)
+        ]
+        return mx.concatenate(rows)
@@ -4,10 +4,12 @@ Takes natural language input, generates AppleScript, optionally executes it.
 """
 
 import argparse
+import glob
 import json
 import subprocess
 import sys
 import os
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -15,14 +17,39 @@ import mlx.core as mx
 import mlx.nn as nn
 from tokenizers import Tokenizer
 
-from model.model import AppleScriptTransformer, ModelConfig, count_parameters
+from model import profiling
+from model.model import ModelConfig, StageTimings, count_parameters, create_model, fuse_projections
+from model.grammar import AppleScriptGrammar, TokenGrammar, tables_path
+from model.routing import CloudRouter
+from model.speculative import DraftModelProposer, NgramTable, PromptLookupProposer
+from model.templates import TemplateTable
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
 
-def load_model(model_dir: str, checkpoint: str = None):
-    """Load the trained model and tokenizer."""
+# Fast-start files written into a model directory by scripts/snapshot.py
+SAFETENSORS_WEIGHTS = "weights.safetensors"
+GRAMMAR_SNAPSHOT = "grammar_states.json"  # + its int tables, grammar_states.bin
+
+
+def weights_path(model_dir: str) -> str:
+    """
+    The model directory's weights file: weights.safetensors when it is at
+    least as new as weights.npz (it loads without unpacking a zip archive),
+    else weights.npz.
+    """
+    npz = os.path.join(model_dir, "weights.npz")
+    safetensors = os.path.join(model_dir, SAFETENSORS_WEIGHTS)
+    if os.path.exists(safetensors) and (
+            not os.path.exists(npz) or os.path.getmtime(safetensors) >= os.path.getmtime(npz)):
+        return safetensors
+    return npz
+
+
+def load_model(model_dir: str, checkpoint: str = None, fused: bool = False):
+    """Load the trained model and tokenizer, optionally fusing q/k/v and w1/w3."""
     tokenizer_path = os.path.join(model_dir, "tokenizer.json")
     config_path = os.path.join(model_dir, "config.json")
-    weights_path = checkpoint or os.path.join(model_dir, "weights.npz")
+    weights_file = checkpoint or weights_path(model_dir)
 
     tokenizer = Tokenizer.from_file(tokenizer_path)
 
@@ -42,14 +69,69 @@ def load_model(model_dir: str, checkpoint: str = None):
             end_token_id=tokenizer.token_to_id("<|end|>"),
         )
 
-    model = AppleScriptTransformer(config)
-    weights = mx.load(weights_path)
+    # create_model applies config.quantization, so quantized checkpoints load as-is
+    model = create_model(config)
+    weights = mx.load(weights_file)
     model.load_weights(list(weights.items()))
     mx.eval(model.parameters())
+    if fused:
+        fuse_projections(model)
 
     return model, tokenizer, config
 
 
+def load_draft_model(draft_dir: str):
+    """Load a draft model (config.json + weights) for speculative decoding."""
+    with open(os.path.join(draft_dir, "config.json"), "r") as f:
+        config = ModelConfig(**json.load(f))
+    model = create_model(config)
+    model.load_weights(weights_path(draft_dir))
+    mx.eval(model.parameters())
+    return model
+
+
+def load_pairs(paths: list = None) -> list:
+    """(input, output) records from jsonl files (default: data/*.jsonl)."""
+    paths = paths or sorted(glob.glob(os.path.join(DATA_DIR, "*.jsonl")))
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+def load_ngram_table(tokenizer, config, paths: list = None) -> NgramTable:
+    """Mine an NgramTable for prompt-lookup decoding from jsonl pairs (default: data/*.jsonl)."""
+    records = load_pairs(paths)
+    return NgramTable.from_pairs(records, tokenizer, config.output_token_id, config.end_token_id)
+
+
+def load_grammar(tokenizer, config, warm_paths: list = None, snapshot: str = None) -> TokenGrammar:
+    """
+    Build the AppleScript/PASS_TO_CLOUD TokenGrammar and precompute the masks
+    for the states the outputs in `warm_paths` (default: data/*.jsonl) visit,
+    or load them from `snapshot` (scripts/snapshot.py) if it exists and
+    matches the tokenizer.
+    """
+    grammar = TokenGrammar(AppleScriptGrammar(), tokenizer, config.end_token_id, config.vocab_size)
+    if snapshot and os.path.exists(snapshot) and os.path.exists(tables_path(snapshot)):
+        try:
+            if grammar.load(snapshot):
+                return grammar
+            print(f"Ignoring {snapshot}: compiled for another tokenizer or grammar", file=sys.stderr)
+        except (ValueError, KeyError, EOFError) as e:
+            print(f"Ignoring {snapshot}: unreadable ({e!r})", file=sys.stderr)
+    outputs = [f" {r.get('output', '')} " for r in load_pairs(warm_paths)]
+    grammar.warm([enc.ids for enc in tokenizer.encode_batch(outputs)])
+    return grammar
+
+
+def load_templates(tokenizer, config, paths: list = None, min_count: int = 2) -> TemplateTable:
+    """Mine a TemplateTable for template-slot decoding from jsonl pairs (default: data/*.jsonl)."""
+    return TemplateTable.from_pairs(load_pairs(paths), tokenizer, config.end_token_id,
+                                    config.vocab_size, min_count=min_count)
+
+
 def generate(
     model,
     tokenizer,
@@ -58,10 +140,32 @@ def generate(
     max_tokens: int = 256,
     temperature: float = 0.7,
     top_p: float = 0.9,
+    compiled: bool = False,
+    sync_every: int = 8,
+    proposer=None,
+    grammar=None,
+    router=None,
+    templates=None,
+    timings: StageTimings = None,
 ):
-    """Generate AppleScript from a natural language prompt."""
+    """
+    Generate AppleScript from a natural language prompt.
+
+    If `proposer` is given (DraftModelProposer, PromptLookupProposer), decoding
+    is speculative (requires temperature 0). If `grammar` is given (see
+    load_grammar), output is constrained to valid scripts or PASS_TO_CLOUD.
+    If `router` (a CloudRouter) is confident after prefill that the answer is
+    PASS_TO_CLOUD, it is returned without decoding. With `templates` (see
+    load_templates) the fixed parts of known output templates are filled in
+    without decoding them token by token. `timings` (a StageTimings) gets
+    the time spent in each stage, as the servers report it on GET /metrics.
+    """
+    start = time.perf_counter()
     input_text = f"<|input|> {prompt} <|output|>"
-    token_ids = tokenizer.encode(input_text).ids
+    with profiling.span("tokenize"):
+        token_ids = tokenizer.encode(input_text).ids
+    if timings is not None:
+        timings.tokenize = time.perf_counter() - start
     prompt_tokens = mx.array([token_ids])
 
     generated = list(token_ids)
@@ -70,11 +174,19 @@ def generate(
         max_tokens=max_tokens,
         temperature=temperature,
         top_p=top_p,
+        compiled=compiled,
+        sync_every=sync_every,
+        proposer=proposer,
+        grammar=grammar,
+        router=router,
+        templates=templates,
+        timings=timings,
     ):
         t = tok.item()
         if t == config.end_token_id or t == config.pad_token_id:
             break
         generated.append(t)
+    decoded = time.perf_counter()
 
     # Decode only the output part
     output_token_id = config.output_token_id
@@ -84,7 +196,12 @@ def generate(
         output_start = len(token_ids)
 
     output_ids = generated[output_start:]
-    output_text = tokenizer.decode(output_ids).strip()
+    with profiling.span("detokenize", tokens=len(output_ids)):
+        output_text = tokenizer.decode(output_ids).strip()
+    if timings is not None:
+        timings.decode = decoded - start - timings.tokenize - timings.prefill
+        timings.detokenize = time.perf_counter() - decoded
+        timings.output_tokens = len(output_ids)
 
     return output_text
 
@@ -108,7 +225,9 @@ def execute_applescript(script: str) -> tuple[bool, str]:
         return False, str(e)
 
 
-def interactive_mode(model, tokenizer, config, auto_execute: bool = False):
+def interactive_mode(model, tokenizer, config, auto_execute: bool = False,
+                     compiled: bool = False, proposer=None, grammar=None, router=None,
+                     templates=None, show_timings: bool = False):
     """Interactive REPL for generating and executing AppleScript."""
     print("Rune-lm — Natural Language → AppleScript")
     print("Type 'quit' to exit, 'help' for commands\n")
@@ -130,11 +249,17 @@ def interactive_mode(model, tokenizer, config, auto_execute: bool = False):
             print("  'help' — show this message")
             continue
 
-        script = generate(model, tokenizer, config, prompt)
+        timings = StageTimings() if show_timings else None
+        script = generate(model, tokenizer, config, prompt, compiled=compiled,
+                          temperature=0.0 if proposer is not None else 0.7,
+                          proposer=proposer, grammar=grammar, router=router,
+                          templates=templates, timings=timings)
 
         print(f"\n--- AppleScript ---")
         print(script)
         print("---")
+        if timings is not None:
+            print(timings.summary())
 
         if auto_execute:
             print("Auto-executing...")
@@ -169,19 +294,86 @@ def main():
     parser.add_argument("--auto", action="store_true", help="Auto-execute without confirmation")
     parser.add_argument("--temperature", type=float, default=0.7)
     parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--fused", action="store_true",
+                        help="Fuse q/k/v and w1/w3 projections at load time")
+    parser.add_argument("--compile", action="store_true",
+                        help="Use the mx.compile'd fixed-shape decode step")
+    parser.add_argument("--draft-model-dir", default=None,
+                        help="Draft model for speculative decoding (implies --temperature 0)")
+    parser.add_argument("--prompt-lookup", action="store_true",
+                        help="Draft-free speculative decoding from prompt and mined output "
+                             "n-grams (implies --temperature 0)")
+    parser.add_argument("--ngram-data", nargs="+", default=None,
+                        help="jsonl pairs to mine n-grams from (default: data/*.jsonl)")
+    parser.add_argument("--constrained", action="store_true",
+                        help="Constrain output to valid AppleScript or PASS_TO_CLOUD")
+    parser.add_argument("--early-route", action="store_true",
+                        help="Answer PASS_TO_CLOUD right after prefill when confident")
+    parser.add_argument("--route-threshold", type=float, default=0.9,
+                        help="Minimum P(PASS_TO_CLOUD) for --early-route")
+    parser.add_argument("--templates", action="store_true",
+                        help="Fill in the fixed parts of output templates mined from "
+                             "--template-data instead of decoding them")
+    parser.add_argument("--template-data", nargs="+", default=None,
+                        help="jsonl pairs to mine templates from (default: data/*.jsonl)")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print the time spent in each generation stage")
+    parser.add_argument("--profile", default=None, metavar="TRACE_JSON",
+                        help="Record per-layer/per-step spans and write them as a Chrome trace")
 
     args = parser.parse_args()
 
     print("Loading model...")
-    model, tokenizer, config = load_model(args.model_dir, args.checkpoint)
+    model, tokenizer, config = load_model(args.model_dir, args.checkpoint, fused=args.fused)
     n = count_parameters(model)
     print(f"Model loaded ({config.n_layers}L, {config.d_model}D, {n/1e6:.1f}M params)\n")
 
+    proposer = None
+    if args.draft_model_dir:
+        draft_model = load_draft_model(args.draft_model_dir)
+        proposer = DraftModelProposer(draft_model)
+        args.temperature = 0.0
+        print(f"Draft model loaded ({draft_model.config.n_layers}L, "
+              f"{draft_model.config.d_model}D)\n")
+    elif args.prompt_lookup:
+        table = load_ngram_table(tokenizer, config, args.ngram_data)
+        proposer = PromptLookupProposer(table)
+        args.temperature = 0.0
+        print(f"Prompt lookup enabled ({len(table)} mined n-grams)\n")
+
+    grammar = None
+    if args.constrained:
+        if proposer is not None:
+            parser.error("--constrained cannot be combined with speculative decoding")
+        grammar = load_grammar(tokenizer, config, snapshot=os.path.join(args.model_dir, GRAMMAR_SNAPSHOT))
+        print(f"Grammar-constrained decoding ({grammar.num_states} states precomputed)\n")
+
+    router = None
+    if args.early_route:
+        router = CloudRouter.from_tokenizer(tokenizer, args.route_threshold)
+        source = "route head" if config.route_head else "first-token probability"
+        print(f"Early PASS_TO_CLOUD routing ({source}, threshold {args.route_threshold})\n")
+
+    templates = None
+    if args.templates:
+        if proposer is not None or grammar is not None:
+            parser.error("--templates cannot be combined with speculative or constrained decoding")
+        templates = load_templates(tokenizer, config, args.template_data)
+        print(f"Template-slot decoding ({len(templates)} templates)\n")
+
+    if args.profile:
+        profiling.enable()
+
     if args.command:
+        timings = StageTimings() if args.timings else None
         script = generate(model, tokenizer, config, args.command,
-                         temperature=args.temperature, top_p=args.top_p)
+                         temperature=args.temperature, top_p=args.top_p,
+                         compiled=args.compile, proposer=proposer, grammar=grammar, router=router,
+                         templates=templates, timings=timings)
         print(f"Input: {args.command}")
         print(f"AppleScript:\n{script}")
+        if timings is not None:
+            print(f"Timings: {timings.summary()}")
 
         if args.execute:
             success, output = execute_applescript(script)
@@ -190,7 +382,16 @@ def main():
             else:
                 print(f"Error: {output}")
     else:
-        interactive_mode(model, tokenizer, config, auto_execute=args.auto)
+        interactive_mode(model, tokenizer, config, auto_execute=args.auto,
+                         compiled=args.compile, proposer=proposer, grammar=grammar, router=router,
+                         templates=templates, show_timings=args.timings)
+
+    if args.profile:
+        trace = profiling.disable()
+        trace.save(args.profile)
+        print(f"\nTrace written to {args.profile} (open in chrome://tracing or ui.perfetto.dev)")
+        for name, (count, ms) in trace.totals().items():
+            print(f"  {name:<12} {count:>6} spans {ms:>9.1f} ms")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+"""
+Prometheus metrics for the Rune-lm servers.
+
+ServerMetrics collects counters and histograms while requests are served and
+renders them in the Prometheus text exposition format (0.0.4) for
+GET /metrics:
+
+  rune_requests_total{path, status}            HTTP responses
+  rune_request_duration_seconds{path}          end-to-end latency (histogram)
+  rune_stage_duration_seconds{stage}           tokenize / queue / prefill /
+                                               decode / detokenize (histogram)
+  rune_decode_tokens_per_second                per-request decode rate (histogram)
+  rune_prompt_tokens_total, rune_generated_tokens_total
+  rune_generations_total{source, is_cloud}     outputs from the model or the
+                                               response cache
+
+Values that already live elsewhere (queue depth, cache and admission
+counters) are passed to render() at scrape time instead of being tracked
+twice. Stage timings come from the generate path (model.model.StageTimings),
+so the CLI reports the same breakdown.
+"""
+
+import bisect
+import collections
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from model.model import StageTimings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOKENS_PER_SEC_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Paths reported as themselves; anything else is "other", to bound label cardinality
+KNOWN_PATHS = {"/health", "/cache", "/queue", "/metrics", "/generate", "/workers"}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name -> (help, value), supplied at scrape time
+Samples = Dict[str, Tuple[str, float]]
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram (not thread-safe; ServerMetrics holds the lock)."""
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, **labels) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            lines.append(f"{name}_bucket{_labels(**labels, le=le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(**labels)} {_number(self.sum)}")
+        lines.append(f"{name}_count{_labels(**labels)} {self.count}")
+        return lines
+
+
+class ServerMetrics:
+    """Thread-safe request and generation metrics for one server process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = collections.Counter()  # (path, status) -> responses
+        self.request_seconds: Dict[str, Histogram] = {}
+        self.stage_seconds = {stage: Histogram(LATENCY_BUCKETS) for stage in StageTimings.STAGES}
+        self.tokens_per_sec = Histogram(TOKENS_PER_SEC_BUCKETS)
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+        self.generations = collections.Counter()  # (source, is_cloud) -> outputs
+
+    def observe_request(self, path: str, status: int, seconds: float):
+        path = path.split("?", 1)[0]
+        if path not in KNOWN_PATHS:
+            path = "other"
+        with self._lock:
+            self.requests[path, status] += 1
+            if path not in self.request_seconds:
+                self.request_seconds[path] = Histogram(LATENCY_BUCKETS)
+            self.request_seconds[path].observe(seconds)
+
+    def observe_generation(self, timings: Optional[StageTimings], is_cloud: bool, cached: bool = False):
+        """One output: from the model with its stage `timings` (if measured here), or from the cache."""
+        with self._lock:
+            self.generations["cache" if cached else "model", is_cloud] += 1
+            if timings is None:
+                return
+            for stage, histogram in self.stage_seconds.items():
+                histogram.observe(getattr(timings, stage))
+            if timings.output_tokens and timings.decode > 0:
+                self.tokens_per_sec.observe(timings.decode_tokens_per_sec)
+            self.prompt_tokens += timings.prompt_tokens
+            self.generated_tokens += timings.output_tokens
+
+    def render(self, gauges: Optional[Samples] = None, counters: Optional[Samples] = None) -> str:
+        """The text exposition, plus scrape-time `gauges` and `counters` (name -> (help, value))."""
+        out = []
+
+        def family(name, kind, help_text):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            family("rune_requests_total", "counter", "HTTP responses by path and status.")
+            for (path, status), n in sorted(self.requests.items()):
+                out.append(f"rune_requests_total{_labels(path=path, status=status)} {n}")
+
+            family("rune_request_duration_seconds", "histogram", "End-to-end request latency.")
+            for path, histogram in sorted(self.request_seconds.items()):
+                out += histogram.samples("rune_request_duration_seconds", path=path)
+
+            family("rune_stage_duration_seconds", "histogram",
+                   "Time per generation stage (tokenize, queue, prefill, decode, detokenize).")
+            for stage, histogram in self.stage_seconds.items():
+                out += histogram.samples("rune_stage_duration_seconds", stage=stage)
+
+            family("rune_decode_tokens_per_second", "histogram", "Per-request decode throughput.")
+            out += self.tokens_per_sec.samples("rune_decode_tokens_per_second")
+
+            family("rune_prompt_tokens_total", "counter", "Prompt tokens prefilled.")
+            out.append(f"rune_prompt_tokens_total {self.prompt_tokens}")
+            family("rune_generated_tokens_total", "counter", "Output tokens generated by the model.")
+            out.append(f"rune_generated_tokens_total {self.generated_tokens}")
+
+            family("rune_generations_total", "counter",
+                   "Outputs by source (model or response cache) and whether they are PASS_TO_CLOUD.")
+            for (source, is_cloud), n in sorted(self.generations.items()):
+                out.append(f"rune_generations_total{_labels(source=source, is_cloud=str(is_cloud).lower())} {n}")
+            total = sum(self.generations.values())
+            cloud = sum(n for (_, is_cloud), n in self.generations.items() if is_cloud)
+            family("rune_is_cloud_ratio", "gauge", "Share of outputs that are PASS_TO_CLOUD since startup.")
+            out.append(f"rune_is_cloud_ratio {_number(cloud / total if total else 0.0)}")
+
+        for kind, samples in (("gauge", gauges), ("counter", counters)):
+            for name, (help_text, value) in (samples or {}).items():
+                family(name, kind, help_text)
+                out.append(f"{name} {_number(value)}")
+        return "\n".join(out) + "\n"
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Quantize a trained Rune-lm checkpoint for inference.
+
+Writes a new model directory with group-wise 8-bit or 4-bit weights for the
+q/k/v/o_proj, w1/w2/w3 and lm_head layers (and optionally the token
+embedding). The quantization settings are stored in config.json, so
+scripts/server.py and scripts/inference.py load the result without any
+extra flags:
+
+    python scripts/quantize.py --model-dir model --out-dir model-q4 --bits 4
+    python scripts/server.py --model-dir model-q4
+
+With --report, compares fp32 / 8-bit / 4-bit on the held-out split that
+scripts/train.py uses (same seed and TRAIN_SPLIT): validation loss, exact
+match against the reference output, agreement with fp32 greedy output,
+parameter memory and decode tokens/s.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mlx.core as mx
+from mlx.utils import tree_flatten
+from tokenizers import Tokenizer
+
+from model.model import ModelConfig, create_model, quantize_model
+from scripts.train import (
+    DATA_DIR, MAX_SEQ_LEN, SEED, TRAIN_SPLIT, load_jsonl, loss_fn, tokenize_pairs,
+)
+
+
+def load_fp_model(model_dir: str):
+    """Load the unquantized checkpoint in `model_dir`."""
+    with open(os.path.join(model_dir, "config.json"), "r") as f:
+        config = ModelConfig(**json.load(f))
+    if config.quantization:
+        print(f"Error: {model_dir} is already quantized ({config.quantization})", file=sys.stderr)
+        sys.exit(1)
+    model = create_model(config)
+    model.load_weights(os.path.join(model_dir, "weights.npz"))
+    mx.eval(model.parameters())
+    tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+    return model, tokenizer, config
+
+
+def parameter_bytes(model) -> int:
+    return sum(v.nbytes for _, v in tree_flatten(model.parameters()))
+
+
+def quantize_checkpoint(args):
+    model, _, config = load_fp_model(args.model_dir)
+    fp_bytes = parameter_bytes(model)
+
+    quantization = quantize_model(
+        model, group_size=args.group_size, bits=args.bits, embeddings=args.quantize_embeddings
+    )
+    mx.eval(model.parameters())
+    config = dataclasses.replace(config, quantization=quantization)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    weights_path = os.path.join(args.out_dir, "weights.npz")
+    model.save_weights(weights_path)
+    with open(os.path.join(args.out_dir, "config.json"), "w") as f:
+        json.dump(dataclasses.asdict(config), f, indent=2)
+    shutil.copy(
+        os.path.join(args.model_dir, "tokenizer.json"),
+        os.path.join(args.out_dir, "tokenizer.json"),
+    )
+
+    q_bytes = parameter_bytes(model)
+    print(f"Quantized to {args.bits}-bit (group_size={args.group_size}, "
+          f"embeddings={'yes' if args.quantize_embeddings else 'no'})")
+    print(f"  parameters: {fp_bytes / 1e6:.1f} MB -> {q_bytes / 1e6:.1f} MB")
+    print(f"  saved to {args.out_dir} ({os.path.getsize(weights_path) / 1e6:.1f} MB on disk)")
+
+
+# ---------------------------------------------------------------------------
+# Accuracy / speed report
+# ---------------------------------------------------------------------------
+
+def held_out_split(tokenizer, config):
+    """Reproduce scripts/train.py's train/val split and return (val records, ids, mask)."""
+    records = load_jsonl(DATA_DIR / "seed_pairs.jsonl") + load_jsonl(DATA_DIR / "expanded_pairs.jsonl")
+    mx.random.seed(SEED)
+    token_ids, loss_mask = tokenize_pairs(
+        records, tokenizer, MAX_SEQ_LEN,
+        config.input_token_id, config.output_token_id, config.end_token_id, config.pad_token_id,
+    )
+    perm = mx.random.permutation(token_ids.shape[0])
+    split = int(token_ids.shape[0] * TRAIN_SPLIT)
+    val_idx = perm[split:]
+    val_records = [records[i] for i in val_idx.tolist()]
+    return val_records, token_ids[val_idx], loss_mask[val_idx]
+
+
+def greedy_outputs(model, tokenizer, records, max_tokens):
+    prompts = [tokenizer.encode(f"<|input|> {r['input']} <|output|>").ids for r in records]
+    outputs = []
+    for start in range(0, len(prompts), 16):
+        outputs += model.generate_batch(prompts[start:start + 16], max_tokens=max_tokens,
+                                        temperature=0.0)
+    return [tokenizer.decode(ids).strip() for ids in outputs]
+
+
+def decode_tokens_per_sec(model, n_tokens=64):
+    prompt = mx.array([[model.config.input_token_id, 100, 200, 300, model.config.output_token_id]])
+    never_end = model.config.vocab_size
+    for tok in model.generate(prompt, max_tokens=4, temperature=0.0, end_token_id=never_end):
+        mx.eval(tok)
+    start = time.perf_counter()
+    for tok in model.generate(prompt, max_tokens=n_tokens, temperature=0.0,
+                              end_token_id=never_end, sync_every=8):
+        mx.eval(tok)
+    return n_tokens / (time.perf_counter() - start)
+
+
+def report(args):
+    fp_model, tokenizer, config = load_fp_model(args.model_dir)
+    records, val_ids, val_mask = held_out_split(tokenizer, config)
+    if args.max_eval:
+        records = records[:args.max_eval]
+        val_ids, val_mask = val_ids[:args.max_eval], val_mask[:args.max_eval]
+    print(f"Held-out split: {len(records)} pairs\n")
+
+    fp_outputs = None
+    print(f"{'precision':>10} | {'val loss':>8} | {'exact':>6} | {'= fp32':>6} | "
+          f"{'params MB':>9} | {'tok/s':>7}")
+    print("-" * 64)
+    for bits in [None] + args.report_bits:
+        model, _, _ = load_fp_model(args.model_dir) if bits else (fp_model, None, None)
+        if bits:
+            quantize_model(model, group_size=args.group_size, bits=bits,
+                           embeddings=args.quantize_embeddings)
+            mx.eval(model.parameters())
+
+        losses = []
+        for start in range(0, val_ids.shape[0], 16):
+            loss = loss_fn(model, val_ids[start:start + 16], val_mask[start:start + 16])
+            losses.append(loss.item())
+        val_loss = sum(losses) / max(len(losses), 1)
+
+        outputs = greedy_outputs(model, tokenizer, records, args.max_tokens)
+        if fp_outputs is None:
+            fp_outputs = outputs
+        exact = sum(o == r["output"].strip() for o, r in zip(outputs, records)) / len(records)
+        agree = sum(o == f for o, f in zip(outputs, fp_outputs)) / len(records)
+
+        name = f"{bits}-bit" if bits else "fp32"
+        print(f"{name:>10} | {val_loss:>8.4f} | {exact:>6.1%} | {agree:>6.1%} | "
+              f"{parameter_bytes(model) / 1e6:>9.1f} | {decode_tokens_per_sec(model):>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize a Rune-lm checkpoint")
+    parser.add_argument("--model-dir", default="model", help="Unquantized model directory")
+    parser.add_argument("--out-dir", default=None, help="Where to write the quantized model")
+    parser.add_argument("--bits", type=int, default=8, choices=[4, 8])
+    parser.add_argument("--group-size", type=int, default=64, choices=[32, 64, 128])
+    parser.add_argument("--quantize-embeddings", action="store_true",
+                        help="Also quantize the token embedding table")
+    parser.add_argument("--report", action="store_true",
+                        help="Compare fp32 and quantized precisions on the held-out split")
+    parser.add_argument("--report-bits", type=int, nargs="+", default=[8, 4])
+    parser.add_argument("--max-eval", type=int, default=None,
+                        help="Limit the number of held-out pairs used by --report")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    args = parser.parse_args()
+
+    if args.out_dir:
+        quantize_checkpoint(args)
+    if args.report:
+        report(args)
+    if not args.out_dir and not args.report:
+        parser.error("nothing to do: pass --out-dir and/or --report")
+
+
+if __name__ == "__main__":
+    main()
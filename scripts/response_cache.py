@@ -0,0 +1,178 @@
+"""
+Response cache for the Rune-lm server.
+
+Voice traffic repeats the same handful of commands ("pause music", "next
+song", "lock my screen"). Greedy generation is deterministic, so the script
+for a query can be reused verbatim. Queries are keyed after normalization
+(case, whitespace, punctuation, leading filler such as "please" or "can
+you", and trailing filler set off by a comma), so "Pause the music, please!"
+and "pause the music" share an entry. A trailing word without the comma is
+kept: in "say hi" or "type ok" it is the command's argument. Scripts that
+quote text from the query (message bodies, note text, file names, keystrokes)
+depend on exactly how it was written, so those entries only match queries
+that contain the same literals, case and punctuation included.
+
+Entries are evicted least-recently-used once `max_entries` is reached and
+expire after `ttl` seconds. With a `path` the cache is loaded at startup and
+written back by save(); a file written for a different model (see
+`fingerprint`) is ignored.
+"""
+
+import collections
+import json
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+# Bump when normalize_query changes, so persisted keys from older versions are dropped
+KEY_VERSION = 3
+
+# Words and phrases that don't change what a command does
+FILLER_PHRASES = [
+    "can you", "could you", "would you", "will you", "can u",
+    "i want you to", "i'd like you to", "i would like you to",
+    "for me", "thank you", "right now",
+    "please", "pls", "plz", "hey", "hi", "ok", "okay", "kindly", "just", "thanks",
+]
+
+_PUNCTUATION = re.compile(r"[^\w\s']|(?<!\w)'|'(?!\w)")
+_FILLER = "(?:" + "|".join(re.escape(p) for p in FILLER_PHRASES) + ")"
+_LEADING_FILLER = re.compile(rf"^(?:{_FILLER}(?: |$))+")
+_TRAILING_FILLER = re.compile(rf",\s*{_FILLER}(?:\s+{_FILLER})*[\s!.?]*$")  # on the raw query
+_LITERAL = re.compile(r'"([^"]*)"')
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query used as the cache key."""
+    text = _TRAILING_FILLER.sub("", query.lower())
+    text = " ".join(_PUNCTUATION.sub(" ", text).split())
+    return _LEADING_FILLER.sub("", text)
+
+
+def _copied_literals(query: str, script: str) -> Optional[list]:
+    """The script's quoted literals found verbatim (case-sensitively) in the query, or None."""
+    query = " ".join(query.split())
+    copied = []
+    for literal in _LITERAL.findall(script):
+        literal = " ".join(literal.split())
+        if literal and literal in query and literal not in copied:
+            copied.append(literal)
+    return copied or None
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache from normalized query to generated script."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        path: Optional[str] = None,
+        fingerprint: str = "",
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.fingerprint = fingerprint
+        # key -> (script, created_at, literals a query must contain verbatim, or None)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, query: str) -> Optional[str]:
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None and entry[2] is not None:
+                text = " ".join(query.split())
+                if not all(literal in text for literal in entry[2]):
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query: str, script: str):
+        key = normalize_query(query)
+        if not key:
+            return
+        literals = _copied_literals(query, script)
+        with self._lock:
+            self._entries[key] = (script, time.time(), literals)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # -------------------------------------------------------------------
+    # Persistence
+    # -------------------------------------------------------------------
+
+    def save(self, path: Optional[str] = None):
+        """Write unexpired entries to `path` (atomically, via a temp file)."""
+        path = path or self.path
+        if not path:
+            return
+        now = time.time()
+        with self._lock:
+            entries = [[k, *entry] for k, entry in self._entries.items() if now - entry[1] <= self.ttl]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "key_version": KEY_VERSION,
+                       "entries": entries}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None):
+        """Load entries saved by save(), oldest first; skip files from another model."""
+        path = path or self.path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring response cache {path}: {e}")
+            return
+        if data.get("fingerprint") != self.fingerprint:
+            print(f"Ignoring response cache {path}: written for a different model")
+            return
+        if data.get("key_version") != KEY_VERSION:
+            print(f"Ignoring response cache {path}: written by an older cache version")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, script, created_at, literals in data.get("entries", []):
+                if now - created_at <= self.ttl:
+                    self._entries[key] = (script, created_at, literals)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
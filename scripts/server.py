@@ -2,28 +2,88 @@
 """
 HTTP server wrapping Rune-lm inference.
 
-Exposes two endpoints:
+Exposes five endpoints:
   GET  /health            → {"status": "ok"}
+  GET  /cache             → response and prefix KV cache counters
+  GET  /queue             → queue depth and shed/degraded/expired counts
+  GET  /metrics           → Prometheus metrics (scripts/metrics.py)
   POST /generate          → {"script": "...", "is_cloud": false}
 
 Designed to be called from Rune's Swift ToolDispatcher as a drop-in
 replacement for llama-server (FunctionGemmaRouter pattern).
 
+Requests are handled on separate threads and fed to a continuous-batching
+engine (scripts/engine.py), so concurrent /generate calls share decode steps
+instead of queueing behind each other. Greedy (temperature 0) requests are
+answered from an LRU/TTL response cache (scripts/response_cache.py) when the
+same normalized query was seen before. Prompt keys/values are shared across
+requests through a prefix KV cache (model/prefix_cache.py), so the common
+`<|input|>` lead-ins are not recomputed.
+
+Connections are persistent (HTTP/1.1 keep-alive), so a client reusing its
+connection skips the TCP handshake per call. Idle connections close after
+--keepalive-timeout seconds and each serves at most --max-keepalive-requests.
+
+Local clients can avoid loopback TCP: --unix-socket serves the same API on a
+Unix domain socket, and --binary-socket a length-prefixed binary protocol
+(scripts/binary_protocol.py) that returns the script or its token ids.
+
+Admission control: at most --max-queue requests wait for the model; beyond
+that /generate answers 503 with Retry-After (or, with --shed-to-cloud, a
+degraded {"is_cloud": true} answer). A request's "timeout_ms" (default
+--default-timeout-ms) is a deadline: once it passes, decoding stops, the
+request leaves the batch and the response is 504.
+
+GET /metrics reports request counts and latencies, and each generation's
+time split into tokenize / queue / prefill / decode / detokenize, in the
+Prometheus text format.
+
+Profiling (model/profiling.py): --profile PATH records spans for every
+request (tokenize, prefill, each layer, each decode step, sampling,
+detokenize) and writes them as a Chrome trace on exit. A single /generate
+sent with "X-Rune-Profile: 1" runs on the single-request path, skips the
+response cache and returns its own trace under "trace".
+
+Startup loads weights.safetensors and the --constrained grammar states from
+the model directory when scripts/snapshot.py has written them, then warms up
+one short generation per prompt-length bucket (--warmup-lengths).
+
 The model stays loaded in memory for fast inference (~50-100ms per query).
 """
 
 import argparse
+import contextlib
+import hashlib
 import json
 import os
+import queue
+import socketserver
+import stat
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Iterator, List, Optional, Tuple
 
 # Add project root to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import mlx.core as mx
 from tokenizers import Tokenizer
-from model.model import AppleScriptTransformer, ModelConfig, count_parameters
+from model import profiling
+from model.model import ModelConfig, StageTimings, count_parameters, create_model, fuse_projections
+from model.prefix_cache import PrefixCache
+from model.routing import CloudRouter
+from model.speculative import DraftModelProposer, PromptLookupProposer
+from scripts.binary_protocol import (
+    STATUS_BUSY, STATUS_TIMEOUT, decode_request, encode_error, encode_response, read_frame,
+)
+from scripts.engine import BatchEngine, DeadlineExceeded, QueueFull
+from scripts.inference import (
+    GRAMMAR_SNAPSHOT, load_draft_model, load_grammar, load_ngram_table, load_templates, weights_path,
+)
+from scripts.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, ServerMetrics
+from scripts.response_cache import ResponseCache
 
 
 # ---------------------------------------------------------------------------
@@ -32,14 +92,40 @@ from model.model import AppleScriptTransformer, ModelConfig, count_parameters
 MODEL = None
 TOKENIZER = None
 CONFIG = None
-
-
-def load_model(model_dir: str):
+COMPILE = False
+SYNC_EVERY = 8
+ENGINE = None
+DRAFT_MODEL = None
+NGRAM_TABLE = None  # set by --prompt-lookup
+RESPONSE_CACHE = None
+PREFIX_CACHE = None
+GRAMMAR = None  # set by --constrained
+ROUTER = None  # set by --early-route
+TEMPLATES = None  # set by --templates
+MODEL_LOCK = threading.Lock()  # serializes direct (non-engine) generation
+
+# Admission control
+MAX_QUEUE = None  # set by --max-queue: requests waiting for the model before shedding
+DEFAULT_TIMEOUT_MS = 0  # set by --default-timeout-ms; 0 means no deadline
+SHED_TO_CLOUD = False  # set by --shed-to-cloud: answer PASS_TO_CLOUD instead of 503
+RETRY_AFTER = 1  # seconds, sent with 503 responses
+ADMISSION_LOCK = threading.Lock()
+DIRECT_WAITING = 0  # requests waiting for MODEL_LOCK
+ADMISSION = {"shed": 0, "degraded": 0, "expired": 0}
+
+METRICS = ServerMetrics()
+
+WARMUP_LENGTHS = (8, 16, 32, 64)  # prompt-length buckets warmed up at startup (seed prompts: 4-25 tokens)
+
+PROFILE_HEADER = "X-Rune-Profile"
+PROFILE_PATH = None  # set by --profile
+
+
+def load_model(model_dir: str, fused: bool = False):
     global MODEL, TOKENIZER, CONFIG
 
     tokenizer_path = os.path.join(model_dir, "tokenizer.json")
     config_path = os.path.join(model_dir, "config.json")
-    weights_path = os.path.join(model_dir, "weights.npz")
 
     TOKENIZER = Tokenizer.from_file(tokenizer_path)
 
@@ -47,41 +133,375 @@ def load_model(model_dir: str):
         config_dict = json.load(f)
     CONFIG = ModelConfig(**config_dict)
 
-    MODEL = AppleScriptTransformer(CONFIG)
-    weights = mx.load(weights_path)
+    # create_model applies config.quantization, so quantized checkpoints load as-is
+    MODEL = create_model(CONFIG)
+    weights = mx.load(weights_path(model_dir))
     MODEL.load_weights(list(weights.items()))
     mx.eval(MODEL.parameters())
+    if fused:
+        fuse_projections(MODEL)
 
     n = count_parameters(MODEL)
     print(f"Model loaded: {CONFIG.n_layers}L, {CONFIG.d_model}D, {n/1e6:.1f}M params")
 
 
-def generate(prompt: str, temperature: float = 0.0, max_tokens: int = 256) -> str:
-    """Generate AppleScript from natural language. Returns the raw output string."""
-    input_text = f"<|input|> {prompt} <|output|>"
-    token_ids = TOKENIZER.encode(input_text).ids
-    prompt_tokens = mx.array([token_ids])
-
-    generated = list(token_ids)
-    for tok in MODEL.generate(
-        prompt_tokens,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=0.9,
-    ):
-        t = tok.item()
-        if t == CONFIG.end_token_id or t == CONFIG.pad_token_id:
-            break
-        generated.append(t)
-
-    output_token_id = CONFIG.output_token_id
+def model_fingerprint(model_dir: str) -> str:
+    """Identifies the loaded weights, so a persisted response cache is not reused across models."""
+    with open(os.path.join(model_dir, "config.json"), "rb") as f:
+        config_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    stat = os.stat(weights_path(model_dir))
+    return f"{config_hash}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def make_proposer():
+    """Proposer for speculative decoding of greedy requests, or None if disabled."""
+    if DRAFT_MODEL is not None:
+        return DraftModelProposer(DRAFT_MODEL)
+    if NGRAM_TABLE is not None:
+        return PromptLookupProposer(NGRAM_TABLE)
+    return None
+
+
+class TextStream:
+    """
+    Turns output token ids into text pieces as they arrive. Text ending in an
+    incomplete UTF-8 sequence is held back until the rest of it is decoded.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids: List[int] = []
+        self.text = ""
+
+    def push(self, ids: List[int]) -> str:
+        """Add tokens; returns the newly decoded text (possibly empty)."""
+        self.ids += ids
+        text = self.tokenizer.decode(self.ids)
+        if text.endswith("\ufffd"):
+            return ""
+        piece, self.text = text[len(self.text):], text
+        return piece
+
+    def finish(self) -> str:
+        """Any text still held back."""
+        text = self.tokenizer.decode(self.ids)
+        piece, self.text = text[len(self.text):], text
+        return piece
+
+
+@contextlib.contextmanager
+def _model_turn(deadline: Optional[float]):
+    """Hold MODEL_LOCK; raises QueueFull if MAX_QUEUE requests already wait, DeadlineExceeded on expiry."""
+    global DIRECT_WAITING
+    with ADMISSION_LOCK:
+        if MAX_QUEUE is not None and DIRECT_WAITING >= MAX_QUEUE:
+            raise QueueFull(f"{DIRECT_WAITING} requests already queued")
+        DIRECT_WAITING += 1
+    try:
+        timeout = -1 if deadline is None else max(0.0, deadline - time.monotonic())
+        with profiling.span("queue"):
+            acquired = MODEL_LOCK.acquire(timeout=timeout)
+    finally:
+        with ADMISSION_LOCK:
+            DIRECT_WAITING -= 1
+    if not acquired:
+        raise DeadlineExceeded("deadline exceeded")
     try:
-        output_start = generated.index(output_token_id) + 1
-    except ValueError:
-        output_start = len(token_ids)
+        yield
+    finally:
+        MODEL_LOCK.release()
+
+
+def _output_tokens(
+    token_ids: List[int],
+    temperature: float,
+    max_tokens: int,
+    deadline: Optional[float] = None,
+    timings: Optional[StageTimings] = None,
+) -> Iterator[List[int]]:
+    """
+    Output token ids for a tokenized prompt, in chunks as they are decoded
+    (without <|end|>). Decoding stops with DeadlineExceeded once `deadline`
+    (a time.monotonic() timestamp) passes. `timings` gets the queue and
+    prefill stages.
+    """
+    # Greedy requests go through speculative decoding when a proposer is configured
+    proposer = make_proposer() if temperature == 0.0 else None
+    speculative = proposer is not None
+    # Template-slot decoding needs the single-request path (batch size 1)
+    templates = None if speculative else TEMPLATES
+    # A profiled request runs alone, so the per-layer spans are its own
+    batched = not speculative and templates is None and not profiling.recording()
+    if ENGINE is not None and batched:
+        chunks = queue.Queue()
+        request = ENGINE.submit(
+            token_ids,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=0.9,
+            on_tokens=lambda ids, done: chunks.put((ids, done)),
+            deadline=deadline,
+            timings=timings,
+        )
+        done = False
+        try:
+            while not done:
+                ids, done = chunks.get()
+                if ids:
+                    yield ids
+        finally:
+            if not done:
+                request.cancel()  # the consumer went away
+        if request.error is not None:
+            raise request.error
+        return
+
+    waiting = time.perf_counter()
+    with _model_turn(deadline):
+        if timings is not None:
+            timings.queue = time.perf_counter() - waiting
+        for tok in MODEL.generate(
+            mx.array([token_ids]),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=0.9,
+            compiled=COMPILE,
+            sync_every=SYNC_EVERY,
+            proposer=proposer,
+            prefix_cache=PREFIX_CACHE,
+            grammar=None if speculative else GRAMMAR,
+            router=ROUTER,
+            templates=templates,
+            timings=timings,
+        ):
+            t = tok.item()
+            if t == CONFIG.end_token_id or t == CONFIG.pad_token_id:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("deadline exceeded")
+            yield [t]
+
+
+def generate_stream(
+    prompt: str,
+    temperature: float = 0.0,
+    max_tokens: int = 256,
+    deadline: Optional[float] = None,
+) -> Iterator[str]:
+    """
+    Generate AppleScript from natural language, yielding the output text in
+    pieces as tokens are decoded. The pieces joined and stripped are
+    generate()'s result. Blocks between pieces, so run it off the event loop
+    and consume it to the end.
+    """
+    # Greedy decoding is deterministic, so repeated queries can skip the model
+    cacheable = RESPONSE_CACHE is not None and temperature == 0.0 and not profiling.recording()
+    if cacheable:
+        script = RESPONSE_CACHE.get(prompt)
+        if script is not None:
+            METRICS.observe_generation(None, script == "PASS_TO_CLOUD", cached=True)
+            yield script
+            return
 
-    output_ids = generated[output_start:]
-    return TOKENIZER.decode(output_ids).strip()
+    timings = StageTimings()
+    start = time.perf_counter()
+    with profiling.span("tokenize"):
+        token_ids = TOKENIZER.encode(f"<|input|> {prompt} <|output|>").ids
+    timings.tokenize = time.perf_counter() - start
+    stream = TextStream(TOKENIZER)
+    for ids in _output_tokens(token_ids, temperature, max_tokens, deadline, timings):
+        decoded = time.perf_counter()
+        with profiling.span("detokenize", tokens=len(ids)):
+            piece = stream.push(ids)
+        timings.detokenize += time.perf_counter() - decoded
+        if piece:
+            yield piece
+    _finish_timings(timings, start, len(stream.ids))
+    decoded = time.perf_counter()
+    piece = stream.finish()
+    timings.detokenize += time.perf_counter() - decoded
+    METRICS.observe_generation(timings, stream.text.strip() == "PASS_TO_CLOUD")
+    if piece:
+        yield piece
+
+    if cacheable:
+        RESPONSE_CACHE.put(prompt, stream.text.strip())
+
+
+def _finish_timings(timings: StageTimings, start: float, output_tokens: int):
+    """Set decode: the time since `start` not spent in the other stages so far."""
+    elapsed = time.perf_counter() - start
+    other = timings.tokenize + timings.queue + timings.prefill + timings.detokenize
+    timings.decode = max(0.0, elapsed - other)
+    timings.output_tokens = output_tokens
+
+
+def generate(prompt: str, temperature: float = 0.0, max_tokens: int = 256,
+             deadline: Optional[float] = None) -> str:
+    """Generate AppleScript from natural language. Returns the raw output string."""
+    return "".join(generate_stream(prompt, temperature, max_tokens, deadline)).strip()
+
+
+def generate_traced(prompt: str, temperature: float = 0.0, max_tokens: int = 256,
+                    deadline: Optional[float] = None) -> Tuple[str, dict]:
+    """generate() with this thread's spans recorded; returns (script, Chrome trace)."""
+    with profiling.record() as trace:
+        script = generate(prompt, temperature, max_tokens, deadline)
+    return script, trace.chrome()
+
+
+def profile_requested(header: Optional[str]) -> bool:
+    """Whether a request's X-Rune-Profile header value asks for a trace."""
+    return (header or "").strip().lower() in ("1", "true", "yes")
+
+
+def generate_ids(prompt: str, temperature: float = 0.0, max_tokens: int = 256,
+                 deadline: Optional[float] = None) -> Tuple[List[int], str]:
+    """
+    Like generate(), but also returns the output token ids (without <|end|>).
+    For a response cache hit they are the cached script re-tokenized.
+    """
+    cacheable = RESPONSE_CACHE is not None and temperature == 0.0
+    if cacheable:
+        script = RESPONSE_CACHE.get(prompt)
+        if script is not None:
+            METRICS.observe_generation(None, script == "PASS_TO_CLOUD", cached=True)
+            return TOKENIZER.encode(f" {script} ").ids, script
+
+    timings = StageTimings()
+    start = time.perf_counter()
+    token_ids = TOKENIZER.encode(f"<|input|> {prompt} <|output|>").ids
+    timings.tokenize = time.perf_counter() - start
+    output_ids = [t for ids in _output_tokens(token_ids, temperature, max_tokens, deadline, timings)
+                  for t in ids]
+    _finish_timings(timings, start, len(output_ids))
+    decoded = time.perf_counter()
+    script = TOKENIZER.decode(output_ids).strip()
+    timings.detokenize = time.perf_counter() - decoded
+    METRICS.observe_generation(timings, script == "PASS_TO_CLOUD")
+    if cacheable:
+        RESPONSE_CACHE.put(prompt, script)
+    return output_ids, script
+
+
+def response_body(query: str, script: str) -> dict:
+    """The /generate JSON response."""
+    return {
+        "script": script,
+        "is_cloud": script.strip() == "PASS_TO_CLOUD",
+        "query": query,
+    }
+
+
+def request_deadline(timeout_ms) -> Optional[float]:
+    """time.monotonic() deadline for a request's `timeout_ms` (None: --default-timeout-ms)."""
+    if timeout_ms is None:
+        timeout_ms = DEFAULT_TIMEOUT_MS
+    if isinstance(timeout_ms, bool) or not isinstance(timeout_ms, (int, float)) or timeout_ms < 0:
+        raise ValueError("'timeout_ms' must be a non-negative number")
+    return time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+
+
+def count_admission(outcome: str):
+    with ADMISSION_LOCK:
+        ADMISSION[outcome] += 1
+
+
+def overload_response(query: str, error: Exception) -> Optional[Tuple[int, dict]]:
+    """
+    (status, JSON body) for a request that was shed or ran out of time, or
+    None if `error` is neither. With --shed-to-cloud a shed request gets a
+    degraded PASS_TO_CLOUD answer instead of 503.
+    """
+    if isinstance(error, QueueFull):
+        if SHED_TO_CLOUD:
+            count_admission("degraded")
+            return 200, {**response_body(query, "PASS_TO_CLOUD"), "degraded": True}
+        count_admission("shed")
+        return 503, {"error": "server busy", "retry_after": RETRY_AFTER}
+    if isinstance(error, DeadlineExceeded):
+        count_admission("expired")
+        return 504, {"error": "deadline exceeded"}
+    return None
+
+
+def binary_overload(message: str, token_ids: bool) -> bytes:
+    """Binary response for a shed request: STATUS_BUSY, or a degraded PASS_TO_CLOUD with --shed-to-cloud."""
+    if SHED_TO_CLOUD:
+        count_admission("degraded")
+        ids = TOKENIZER.encode(" PASS_TO_CLOUD ").ids if token_ids else None
+        return encode_response("PASS_TO_CLOUD", ids)
+    count_admission("shed")
+    return encode_error(message, STATUS_BUSY)
+
+
+def binary_response(payload: bytes) -> bytes:
+    """The binary-protocol response frame for a request payload (scripts/binary_protocol.py)."""
+    if not payload:
+        return encode_response("")  # ping
+    try:
+        query, temperature, token_ids, timeout_ms = decode_request(payload)
+    except ValueError as e:
+        return encode_error(str(e))
+    query = query.strip()
+    if not query:
+        return encode_error("empty query")
+    try:
+        deadline = request_deadline(timeout_ms or None)
+        if token_ids:
+            ids, script = generate_ids(query, temperature, deadline=deadline)
+            return encode_response(script, ids)
+        return encode_response(generate(query, temperature=temperature, deadline=deadline))
+    except QueueFull as e:
+        return binary_overload(str(e), token_ids)
+    except DeadlineExceeded as e:
+        count_admission("expired")
+        return encode_error(str(e), STATUS_TIMEOUT)
+    except Exception as e:
+        return encode_error(str(e))
+
+
+def queue_stats() -> dict:
+    """The /queue JSON response: queue depth and admission counters."""
+    if ENGINE is not None:
+        stats = ENGINE.stats()
+        queued, active = stats["queued"], stats["active"]
+    else:
+        queued, active = DIRECT_WAITING, int(MODEL_LOCK.locked())
+    with ADMISSION_LOCK:
+        return {"queued": queued, "active": active, "max_queue": MAX_QUEUE, **ADMISSION}
+
+
+def metrics_text(queue: Optional[dict] = None) -> str:
+    """The GET /metrics response: METRICS plus queue, admission and cache counters."""
+    queue = queue_stats() if queue is None else queue
+    gauges = {name: (help_text, queue[key]) for key, name, help_text in (
+        ("queued", "rune_queue_depth", "Requests waiting for the model."),
+        ("active", "rune_active_requests", "Requests being decoded."),
+        ("inflight", "rune_inflight_requests", "Requests sent to a worker and not yet answered."),
+    ) if key in queue}
+    counters = {f"rune_admission_{outcome}_total": (f"Requests {outcome} by admission control.", queue[outcome])
+                for outcome in ADMISSION}
+    if RESPONSE_CACHE is not None:
+        stats = RESPONSE_CACHE.stats()
+        gauges["rune_response_cache_entries"] = ("Cached responses.", stats["entries"])
+        for key in ("hits", "misses", "evictions", "expirations"):
+            counters[f"rune_response_cache_{key}_total"] = (f"Response cache {key}.", stats[key])
+    if PREFIX_CACHE is not None:
+        stats = PREFIX_CACHE.stats()
+        gauges["rune_prefix_cache_bytes"] = ("Memory held by cached prompt keys/values.", stats["bytes"])
+        for key in ("lookups", "hits", "prompt_tokens", "reused_tokens", "evictions"):
+            counters[f"rune_prefix_cache_{key}_total"] = (f"Prefix cache {key.replace('_', ' ')}.", stats[key])
+    return METRICS.render(gauges, counters)
+
+
+def cache_stats() -> dict:
+    """The /cache JSON response."""
+    response = {"enabled": False} if RESPONSE_CACHE is None else {
+        "enabled": True, **RESPONSE_CACHE.stats()}
+    prefix = {"enabled": False} if PREFIX_CACHE is None else {
+        "enabled": True, **PREFIX_CACHE.stats()}
+    return {**response, "prefix": prefix}
 
 
 # ---------------------------------------------------------------------------
@@ -89,32 +509,75 @@ def generate(prompt: str, temperature: float = 0.0, max_tokens: int = 256) -> st
 # ---------------------------------------------------------------------------
 
 class OsascriptHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: a connection stays open between requests (every response has
+    # a Content-Length) until the client closes it, it has been idle for
+    # `timeout` seconds or `max_requests` responses have been sent on it
+    protocol_version = "HTTP/1.1"
+    timeout = 5.0
+    max_requests = 100
+    # Headers and body are written separately; without TCP_NODELAY the body
+    # waits for the client's delayed ACK on a reused connection (~40 ms)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+        self.started = time.perf_counter()
+
+    def parse_request(self) -> bool:
+        # Latency is measured from the request line to the end of the response
+        self.started = time.perf_counter()
+        return super().parse_request()
+
     def log_message(self, format, *args):
         # Suppress default access logs; only log errors
         pass
 
     def _send_json(self, data: dict, status: int = 200):
-        body = json.dumps(data).encode("utf-8")
+        self._send(json.dumps(data).encode("utf-8"), "application/json", status)
+
+    def _send(self, body: bytes, content_type: str, status: int = 200):
         self.send_response(status)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", str(RETRY_AFTER))
+        self.requests_served += 1
+        remaining = self.max_requests - self.requests_served
+        if remaining <= 0 or self.close_connection:
+            self.send_header("Connection", "close")
+        else:
+            self.send_header("Keep-Alive", f"timeout={self.timeout:g}, max={remaining}")
         self.end_headers()
         self.wfile.write(body)
+        METRICS.observe_request(self.path, status, time.perf_counter() - self.started)
 
     def do_GET(self):
         if self.path == "/health":
             self._send_json({"status": "ok"})
+        elif self.path == "/cache":
+            self._send_json(cache_stats())
+        elif self.path == "/queue":
+            self._send_json(queue_stats())
+        elif self.path == "/metrics":
+            self._send(metrics_text().encode("utf-8"), METRICS_CONTENT_TYPE)
         else:
             self._send_json({"error": "not found"}, 404)
 
     def do_POST(self):
+        # Always consume the body, so the next request on the connection starts clean
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.close_connection = True
+            self._send_json({"error": "invalid Content-Length"}, 400)
+            return
+        body = self.rfile.read(content_length)
+
         if self.path != "/generate":
             self._send_json({"error": "not found"}, 404)
             return
 
-        content_length = int(self.headers.get("Content-Length", 0))
-        body = self.rfile.read(content_length)
-
         try:
             data = json.loads(body) if body else {}
         except json.JSONDecodeError:
@@ -127,48 +590,297 @@ class OsascriptHandler(BaseHTTPRequestHandler):
             return
 
         temperature = data.get("temperature", 0.0)
+        try:
+            deadline = request_deadline(data.get("timeout_ms"))
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
 
+        profile = profile_requested(self.headers.get(PROFILE_HEADER))
         try:
-            script = generate(query, temperature=temperature)
-            is_cloud = script.strip() == "PASS_TO_CLOUD"
-
-            self._send_json({
-                "script": script,
-                "is_cloud": is_cloud,
-                "query": query,
-            })
+            with profiling.record() if profile else contextlib.nullcontext() as trace:
+                script = self.generate(query, temperature, deadline)
+            body = response_body(query, script)
+            if trace is not None:
+                body["trace"] = trace.chrome()
+            self._send_json(body)
         except Exception as e:
-            self._send_json({"error": str(e)}, 500)
+            status, body = overload_response(query, e) or (500, {"error": str(e)})
+            self._send_json(body, status)
+
+    def generate(self, query: str, temperature: float, deadline: Optional[float] = None) -> str:
+        return generate(query, temperature=temperature, deadline=deadline)
+
+
+class OsascriptServer(ThreadingHTTPServer):
+    # socketserver's default listen backlog of 5 drops connection bursts
+    # (clients retry the SYN after a second)
+    request_queue_size = 128
+
+
+class UnixOsascriptHandler(OsascriptHandler):
+    # TCP_NODELAY does not apply to Unix domain sockets
+    disable_nagle_algorithm = False
+
+
+class BinaryHandler(socketserver.StreamRequestHandler):
+    """Answers binary-protocol frames until the client disconnects or idles for `timeout` seconds."""
+    timeout = 5.0
+
+    def handle(self):
+        while True:
+            try:
+                payload = read_frame(self.rfile)
+            except (ValueError, OSError):
+                return
+            if payload is None:
+                return
+            self.wfile.write(self.respond(payload))
+
+    def respond(self, payload: bytes) -> bytes:
+        return binary_response(payload)
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def remove_stale_socket(path: str):
+    """Remove a socket file left over from a previous run; refuse to touch anything else."""
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise FileExistsError(f"{path} exists and is not a socket")
+        os.unlink(path)
+
+
+def serve_unix(path: str, handler) -> UnixServer:
+    """Listen on a Unix domain socket at `path` (owner-only) on a background thread."""
+    remove_stale_socket(path)
+    server = UnixServer(path, handler)
+    os.chmod(path, 0o600)
+    threading.Thread(target=server.serve_forever, name=f"unix:{path}", daemon=True).start()
+    return server
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def main():
-    parser = argparse.ArgumentParser(description="Rune-lm HTTP server")
+def build_parser(description: str = "Rune-lm HTTP server") -> argparse.ArgumentParser:
+    """Command-line options shared by this server and scripts/async_server.py."""
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument("--model-dir", default="model", help="Path to model directory")
     parser.add_argument("--port", type=int, default=39284, help="Server port")
     parser.add_argument("--host", default="127.0.0.1", help="Server host")
-    args = parser.parse_args()
+    parser.add_argument("--compile", action="store_true",
+                        help="Use the mx.compile'd fixed-shape decode step (with --no-batching)")
+    parser.add_argument("--fused", action="store_true",
+                        help="Fuse q/k/v and w1/w3 projections at load time")
+    parser.add_argument("--max-batch-size", type=int, default=32,
+                        help="Max concurrent requests decoded together")
+    parser.add_argument("--no-batching", action="store_true",
+                        help="Run one generate() per request instead of the batching engine")
+    parser.add_argument("--draft-model-dir", default=None,
+                        help="Draft model for speculative decoding of greedy requests")
+    parser.add_argument("--prompt-lookup", action="store_true",
+                        help="Draft-free speculative decoding of greedy requests from "
+                             "prompt and mined output n-grams")
+    parser.add_argument("--ngram-data", nargs="+", default=None,
+                        help="jsonl pairs to mine n-grams from (default: data/*.jsonl)")
+    parser.add_argument("--constrained", action="store_true",
+                        help="Constrain output to valid AppleScript or PASS_TO_CLOUD "
+                             "(speculative greedy requests are not constrained)")
+    parser.add_argument("--early-route", action="store_true",
+                        help="Answer PASS_TO_CLOUD right after prefill when confident")
+    parser.add_argument("--route-threshold", type=float, default=0.9,
+                        help="Minimum P(PASS_TO_CLOUD) for --early-route")
+    parser.add_argument("--templates", action="store_true",
+                        help="Fill in the fixed parts of mined output templates instead of "
+                             "decoding them (requests bypass the batching engine)")
+    parser.add_argument("--template-data", nargs="+", default=None,
+                        help="jsonl pairs to mine templates from (default: data/*.jsonl)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Max cached responses for greedy requests (0 disables the cache)")
+    parser.add_argument("--cache-ttl", type=float, default=3600.0,
+                        help="Seconds a cached response stays valid")
+    parser.add_argument("--cache-file", default=None,
+                        help="Persist the response cache to this file across restarts")
+    parser.add_argument("--prefix-cache-mb", type=float, default=64,
+                        help="Memory for cached prompt-prefix keys/values (0 disables)")
+    parser.add_argument("--sync-every", type=int, default=SYNC_EVERY,
+                        help="Decode steps dispatched between end-of-sequence checks")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="Requests waiting for the model before new ones are shed "
+                             "(0: unbounded)")
+    parser.add_argument("--shed-to-cloud", action="store_true",
+                        help="Answer shed requests with a degraded PASS_TO_CLOUD instead of 503")
+    parser.add_argument("--default-timeout-ms", type=float, default=0,
+                        help="Deadline for requests without timeout_ms (0: none)")
+    parser.add_argument("--retry-after", type=int, default=1,
+                        help="Retry-After seconds sent with 503 responses")
+    parser.add_argument("--keepalive-timeout", type=float, default=5.0,
+                        help="Seconds an idle HTTP/1.1 connection stays open (0 closes "
+                             "every connection after one response)")
+    parser.add_argument("--max-keepalive-requests", type=int, default=100,
+                        help="Responses served on one connection before it is closed")
+    parser.add_argument("--unix-socket", default=None,
+                        help="Also serve the HTTP/JSON API on this Unix domain socket")
+    parser.add_argument("--warmup-lengths", type=int, nargs="*", default=list(WARMUP_LENGTHS),
+                        help="Prompt lengths (tokens) warmed up before serving; none "
+                             "skips the warmup")
+    parser.add_argument("--profile", default=None, metavar="TRACE_JSON",
+                        help="Record spans for every request and write them as a Chrome "
+                             "trace on exit (slows generation)")
+    parser.add_argument("--binary-socket", default=None,
+                        help="Serve the length-prefixed binary protocol "
+                             "(scripts/binary_protocol.py) on this Unix domain socket")
+    return parser
+
+
+def setup(args: argparse.Namespace, parser: argparse.ArgumentParser):
+    """Load the model and everything the options enable, then warm up."""
+    global METRICS, PROFILE_PATH, COMPILE, SYNC_EVERY, ENGINE, DRAFT_MODEL, NGRAM_TABLE, RESPONSE_CACHE, PREFIX_CACHE, GRAMMAR, ROUTER, TEMPLATES
+
+    COMPILE = args.compile
+    SYNC_EVERY = args.sync_every
+    configure_admission(args)
 
     print(f"Loading model from {args.model_dir}...")
-    load_model(args.model_dir)
-
-    # Warmup
-    print("Warming up...")
-    _ = generate("hello")
-
-    server = HTTPServer((args.host, args.port), OsascriptHandler)
+    load_model(args.model_dir, fused=args.fused)
+    if args.draft_model_dir:
+        DRAFT_MODEL = load_draft_model(args.draft_model_dir)
+        print(f"Draft model loaded: {DRAFT_MODEL.config.n_layers}L, {DRAFT_MODEL.config.d_model}D")
+    elif args.prompt_lookup:
+        NGRAM_TABLE = load_ngram_table(TOKENIZER, CONFIG, args.ngram_data)
+        print(f"Prompt lookup enabled: {len(NGRAM_TABLE)} mined n-grams")
+
+    if args.constrained:
+        GRAMMAR = load_grammar(TOKENIZER, CONFIG, snapshot=os.path.join(args.model_dir, GRAMMAR_SNAPSHOT))
+        print(f"Grammar-constrained decoding: {GRAMMAR.num_states} states precomputed")
+
+    if args.early_route:
+        ROUTER = CloudRouter.from_tokenizer(TOKENIZER, args.route_threshold)
+        source = "route head" if CONFIG.route_head else "first-token probability"
+        print(f"Early PASS_TO_CLOUD routing: {source}, threshold {args.route_threshold}")
+
+    if args.templates:
+        if args.constrained:
+            parser.error("--templates cannot be combined with --constrained")
+        TEMPLATES = load_templates(TOKENIZER, CONFIG, args.template_data)
+        print(f"Template-slot decoding: {len(TEMPLATES)} templates")
+
+    if args.prefix_cache_mb > 0:
+        PREFIX_CACHE = PrefixCache(max_bytes=int(args.prefix_cache_mb * 1024 * 1024))
+
+    if not args.no_batching:
+        ENGINE = BatchEngine(MODEL, max_batch_size=args.max_batch_size,
+                             sync_every=SYNC_EVERY, prefix_cache=PREFIX_CACHE,
+                             grammar=GRAMMAR, router=ROUTER, max_queue=MAX_QUEUE)
+        ENGINE.start()
+
+    warm_up(args.warmup_lengths)
+    METRICS = ServerMetrics()  # leave the warmup out
+    if args.profile:
+        PROFILE_PATH = args.profile
+        profiling.enable()
+        print(f"Profiling: trace written to {PROFILE_PATH} on exit")
+
+    RESPONSE_CACHE = load_response_cache(args)
+
+
+def warm_up(lengths: List[int]):
+    """
+    One short generation per prompt-length bucket (about `length` prompt
+    tokens each), so the first real requests of each size do not pay for
+    first-use allocations; no lengths skips the warmup.
+    """
+    lengths = sorted(n for n in lengths if 0 < n < CONFIG.max_seq_len - SYNC_EVERY)
+    if not lengths:
+        return
+    print(f"Warming up prompt lengths {', '.join(map(str, lengths))}...")
+    for length in lengths:
+        generate(" ".join(["hello"] * length), max_tokens=SYNC_EVERY)
+
+
+def configure_admission(args: argparse.Namespace):
+    global MAX_QUEUE, DEFAULT_TIMEOUT_MS, SHED_TO_CLOUD, RETRY_AFTER
+    MAX_QUEUE = args.max_queue if args.max_queue > 0 else None
+    DEFAULT_TIMEOUT_MS = args.default_timeout_ms
+    SHED_TO_CLOUD = args.shed_to_cloud
+    RETRY_AFTER = args.retry_after
+
+
+def load_response_cache(args: argparse.Namespace):
+    """The response cache the options ask for, or None if disabled."""
+    if args.cache_size <= 0:
+        return None
+    cache = ResponseCache(
+        max_entries=args.cache_size,
+        ttl=args.cache_ttl,
+        path=args.cache_file,
+        fingerprint=model_fingerprint(args.model_dir),
+    )
+    print(f"Response cache: {args.cache_size} entries, ttl {args.cache_ttl:.0f}s"
+          + (f", {cache.stats()['entries']} loaded from {args.cache_file}"
+             if args.cache_file else ""))
+    return cache
+
+
+def shutdown():
+    """Stop the engine, persist the response cache and write the --profile trace."""
+    if ENGINE is not None:
+        ENGINE.stop()
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.save()
+    if PROFILE_PATH:
+        profiling.save(PROFILE_PATH)
+
+
+def serve(args: argparse.Namespace, handler=OsascriptHandler,
+          unix_handler=UnixOsascriptHandler, binary_handler=BinaryHandler):
+    """Serve HTTP, plus the Unix sockets the options ask for, until interrupted."""
+    if args.keepalive_timeout > 0:
+        OsascriptHandler.timeout = args.keepalive_timeout
+        OsascriptHandler.max_requests = max(1, args.max_keepalive_requests)
+    else:
+        OsascriptHandler.timeout = None
+        OsascriptHandler.max_requests = 1
+    BinaryHandler.timeout = OsascriptHandler.timeout
+    server = OsascriptServer((args.host, args.port), handler)
+    unix_servers = []
+    if args.unix_socket:
+        unix_servers.append(serve_unix(args.unix_socket, unix_handler))
+    if args.binary_socket:
+        unix_servers.append(serve_unix(args.binary_socket, binary_handler))
     print(f"Server ready on http://{args.host}:{args.port}")
     print(f"  GET  /health   → health check")
+    print(f"  GET  /cache    → response cache stats")
+    print(f"  GET  /queue    → queue depth and shed counts")
+    print(f"  GET  /metrics  → Prometheus metrics")
     print(f"  POST /generate → {{\"query\": \"...\"}}")
+    if args.unix_socket:
+        print(f"  HTTP/JSON also on unix:{args.unix_socket}")
+    if args.binary_socket:
+        print(f"  Binary protocol on unix:{args.binary_socket}")
 
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down.")
         server.shutdown()
+        for unix_server in unix_servers:
+            unix_server.shutdown()
+            unix_server.server_close()
+            os.unlink(unix_server.server_address)
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    setup(args, parser)
+    serve(args)
+    shutdown()
 
 
 if __name__ == "__main__":
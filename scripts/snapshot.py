@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Write a fast-start snapshot into a Rune-lm model directory.
+
+Files next to weights.npz that scripts/server.py (and the servers built
+on it) and scripts/inference.py pick up automatically:
+
+  weights.safetensors   the same weights uncompressed with a flat header, so
+                        mx.load reads the tensors straight from the file
+                        instead of going through the npz zip archive; used
+                        while it is at least as new as weights.npz
+  grammar_states.json   the --constrained grammar's compiled states (token
+  grammar_states.bin    masks and successors for every state the training
+                        outputs visit), which otherwise take seconds to
+                        rebuild from the tokenizer at every start; ignored
+                        if the tokenizer changes. Data only: json states
+                        and raw int tables, nothing is unpickled
+
+Re-run it after retraining or replacing the tokenizer:
+
+    python scripts/snapshot.py --model-dir model
+    python benchmarks/bench_startup.py --model-dir model   # time to ready / first token
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mlx.core as mx
+from tokenizers import Tokenizer
+
+from model.model import ModelConfig
+from model.grammar import tables_path
+from scripts.inference import GRAMMAR_SNAPSHOT, SAFETENSORS_WEIGHTS, load_grammar
+
+
+def write_weights(model_dir: str) -> str:
+    source = os.path.join(model_dir, "weights.npz")
+    target = os.path.join(model_dir, SAFETENSORS_WEIGHTS)
+    start = time.perf_counter()
+    mx.save_safetensors(target, mx.load(source), metadata={"source": "weights.npz"})
+    print(f"{target}: {os.path.getsize(target) / 1e6:.1f} MB ({time.perf_counter() - start:.1f}s)")
+    return target
+
+
+def write_grammar(model_dir: str, warm_paths: list = None) -> str:
+    tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+    with open(os.path.join(model_dir, "config.json"), "r") as f:
+        config = ModelConfig(**json.load(f))
+    target = os.path.join(model_dir, GRAMMAR_SNAPSHOT)
+    start = time.perf_counter()
+    grammar = load_grammar(tokenizer, config, warm_paths)
+    grammar.save(target)
+    size = os.path.getsize(target) + os.path.getsize(tables_path(target))
+    print(f"{target}: {grammar.num_states} states, {size / 1e6:.1f} MB "
+          f"({time.perf_counter() - start:.1f}s)")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a fast-start snapshot of a model directory")
+    parser.add_argument("--model-dir", default="model", help="Path to model directory")
+    parser.add_argument("--no-grammar", action="store_true",
+                        help="Only convert the weights (no --constrained grammar states)")
+    parser.add_argument("--grammar-data", nargs="+", default=None,
+                        help="jsonl pairs whose outputs' grammar states are compiled "
+                             "(default: data/*.jsonl)")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.model_dir, "weights.npz")):
+        print(f"Error: no weights.npz in {args.model_dir}", file=sys.stderr)
+        sys.exit(1)
+    write_weights(args.model_dir)
+    if not args.no_grammar:
+        write_grammar(args.model_dir, args.grammar_data)
+
+
+if __name__ == "__main__":
+    main()
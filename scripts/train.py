@@ -11,8 +11,24 @@ and trains with cross-entropy loss masked to only supervise the output tokens.
 Config: batch_size=32, lr=3e-4, epochs=20, max_seq_len=512
 Optimizer: AdamW with cosine LR schedule + 5% warmup
 Checkpoints saved every 500 steps, final model to model/weights.npz
+
+Architecture and output locations can be overridden, e.g. to train the small
+draft model used for speculative decoding:
+    python scripts/train.py --n-layers 2 --d-model 128 --n-heads 2 --d-ff 512 \
+        --output-dir model/draft --checkpoint-dir checkpoints/draft
+
+--route-head adds the early PASS_TO_CLOUD classifier (model/routing.py),
+trained jointly with a binary cross-entropy term. To add it to an already
+trained model, train only the head:
+    python scripts/train.py --route-head --route-head-only \
+        --init-weights model/weights.npz --epochs 1 --checkpoint-dir checkpoints/route
+
+--profile trace.json records the first --profile-steps steps (forward+backward,
+optimizer update, and validation if an epoch ends first) as a Chrome trace
+(model/profiling.py). Profiled steps evaluate each phase separately.
 """
 
+import argparse
 import json
 import math
 import os
@@ -30,6 +46,7 @@ from tokenizers import Tokenizer
 # Ensure model/ is importable
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
+from model import profiling
 from model.model import AppleScriptTransformer, ModelConfig, count_parameters
 
 # ===========================================================================
@@ -195,11 +212,74 @@ def loss_fn(model, tokens, mask):
     return loss
 
 
+def route_targets(model, tokens, mask, cloud_ids):
+    """
+    Route-head logits at each sequence's <|output|> position and their labels
+    (1.0 where the output is exactly `cloud_ids`, i.e. PASS_TO_CLOUD <|end|>).
+
+    Returns (lm logits, route logits, labels) so callers can reuse the forward pass.
+    """
+    inputs = tokens[:, :-1]
+    targets = tokens[:, 1:]
+    logits, h = model(inputs, return_hidden=True)
+
+    # The first supervised target follows <|output|>
+    pos = mx.argmax(mask[:, 1:], axis=1)
+    h_out = mx.take_along_axis(h, pos[:, None, None], axis=1)[:, 0]
+    idx = mx.minimum(pos[:, None] + mx.arange(len(cloud_ids))[None, :], targets.shape[1] - 1)
+    output = mx.take_along_axis(targets, idx, axis=1)
+    labels = (output == mx.array(cloud_ids)[None, :]).all(axis=1).astype(mx.float32)
+    return logits, model.route_logits(h_out), labels
+
+
+def route_loss_fn(model, tokens, mask, cloud_ids, route_weight):
+    """loss_fn plus route_weight * BCE of the route head's PASS_TO_CLOUD prediction."""
+    logits, route_logits, labels = route_targets(model, tokens, mask, cloud_ids)
+    targets = tokens[:, 1:]
+    shifted_mask = mask[:, 1:]
+    ce = nn.losses.cross_entropy(logits, targets, reduction="none")
+    lm_loss = (ce * shifted_mask).sum() / mx.maximum(shifted_mask.sum(), mx.array(1.0))
+    route_loss = nn.losses.binary_cross_entropy(route_logits, labels, with_logits=True)
+    return lm_loss + route_weight * route_loss
+
+
 # ===========================================================================
 # Training
 # ===========================================================================
 
+def parse_args():
+    defaults = ModelConfig()
+    parser = argparse.ArgumentParser(description="Train Rune-lm")
+    parser.add_argument("--n-layers", type=int, default=defaults.n_layers)
+    parser.add_argument("--d-model", type=int, default=defaults.d_model)
+    parser.add_argument("--n-heads", type=int, default=defaults.n_heads)
+    parser.add_argument("--d-ff", type=int, default=defaults.d_ff)
+    parser.add_argument("--output-dir", type=Path, default=MODEL_DIR,
+                        help="Where to write weights.npz and config.json")
+    parser.add_argument("--checkpoint-dir", type=Path, default=CHECKPOINT_DIR)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--route-head", action="store_true",
+                        help="Add and train the early PASS_TO_CLOUD routing head")
+    parser.add_argument("--route-weight", type=float, default=0.5,
+                        help="Weight of the routing loss relative to the LM loss")
+    parser.add_argument("--route-head-only", action="store_true",
+                        help="Freeze everything except the routing head (use with --init-weights)")
+    parser.add_argument("--init-weights", type=Path, default=None,
+                        help="Initialize from these weights (route_head may be missing)")
+    parser.add_argument("--profile", type=Path, default=None, metavar="TRACE_JSON",
+                        help="Write a Chrome trace of the first --profile-steps steps")
+    parser.add_argument("--profile-steps", type=int, default=50,
+                        help="Training steps to profile with --profile")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    output_dir = args.output_dir
+    checkpoint_dir = args.checkpoint_dir
+    weights_path = output_dir / "weights.npz"
+
+    epochs = args.epochs
     mx.random.seed(SEED)
 
     # ---- Load tokenizer ----
@@ -253,28 +333,42 @@ def main():
     # ---- Initialize model ----
     config = ModelConfig(
         vocab_size=vocab_size,
+        n_layers=args.n_layers,
+        n_heads=args.n_heads,
+        d_model=args.d_model,
+        d_ff=args.d_ff,
         max_seq_len=MAX_SEQ_LEN,
         pad_token_id=pad_token_id,
         input_token_id=input_token_id,
         output_token_id=output_token_id,
         end_token_id=end_token_id,
+        route_head=args.route_head,
     )
     model = AppleScriptTransformer(config)
+    if args.init_weights:
+        model.load_weights(str(args.init_weights), strict=not args.route_head)
+        print(f"Initialized from {args.init_weights}")
+    if args.route_head_only:
+        if not args.route_head:
+            print("Error: --route-head-only requires --route-head", file=sys.stderr)
+            sys.exit(1)
+        model.freeze()
+        model.route_head.unfreeze()
     mx.eval(model.parameters())
 
     nparams = count_parameters(model)
     print(f"Model parameters: {nparams / 1e6:.2f}M")
 
     # ---- Resume from checkpoint if available ----
-    CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
-    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
 
     start_epoch = 0
     global_step = 0
     best_val_loss = float("inf")
 
     # Find latest checkpoint
-    ckpt_files = sorted(CHECKPOINT_DIR.glob("step_*.npz"))
+    ckpt_files = sorted(checkpoint_dir.glob("step_*.npz"))
     if ckpt_files:
         latest_ckpt = ckpt_files[-1]
         print(f"Resuming from checkpoint: {latest_ckpt}")
@@ -288,7 +382,7 @@ def main():
         print(f"  Resumed at step {global_step}, starting from epoch {start_epoch + 1}")
 
     # ---- Optimizer with warmup + cosine decay ----
-    total_steps = (train_ids.shape[0] // BATCH_SIZE) * EPOCHS
+    total_steps = (train_ids.shape[0] // BATCH_SIZE) * epochs
     warmup_steps = int(total_steps * WARMUP_FRACTION)
     decay_steps = total_steps - warmup_steps
 
@@ -311,35 +405,61 @@ def main():
         print(f"  LR schedule advanced to step {global_step}")
 
     # ---- Training step (eager mode) ----
-    loss_and_grad_fn = nn.value_and_grad(model, loss_fn)
+    if args.route_head:
+        cloud_ids = tokenizer.encode(" PASS_TO_CLOUD ").ids + [end_token_id]
+        print(f"Routing head: weight {args.route_weight}, "
+              f"{'head only' if args.route_head_only else 'joint'}")
+
+        def objective(model, tokens, mask):
+            return route_loss_fn(model, tokens, mask, cloud_ids, args.route_weight)
+    else:
+        objective = loss_fn
+    loss_and_grad_fn = nn.value_and_grad(model, objective)
 
     def step(tokens, mask):
-        loss, grads = loss_and_grad_fn(model, tokens, mask)
-        optimizer.update(model, grads)
+        with profiling.span("forward_backward", batch=tokens.shape[0], tokens=tokens.shape[1]) as span:
+            loss, grads = loss_and_grad_fn(model, tokens, mask)
+            span.eval(loss, grads)
+        with profiling.span("optimizer_update") as span:
+            optimizer.update(model, grads)
+            span.eval(model.parameters(), optimizer.state)
         return loss
 
+    def finish_profile():
+        trace = profiling.disable()
+        if trace is not None:
+            trace.save(str(args.profile))
+            print(f"  >> Trace of {args.profile_steps} steps written to {args.profile}")
+
+    first_step = global_step
+    if args.profile:
+        profiling.enable()
+
     # ---- Training loop ----
     train_losses = []
 
-    print(f"\nStarting training for {EPOCHS} epochs (from epoch {start_epoch + 1})...")
+    print(f"\nStarting training for {epochs} epochs (from epoch {start_epoch + 1})...")
     print(f"  batch_size={BATCH_SIZE}, lr={LEARNING_RATE}, max_seq_len={MAX_SEQ_LEN}")
     print(f"  log_every={LOG_EVERY}, checkpoint_every={CHECKPOINT_EVERY}")
     print()
 
-    for epoch in range(start_epoch, EPOCHS):
+    for epoch in range(start_epoch, epochs):
         epoch_start = time.perf_counter()
         epoch_losses = []
 
         for batch_ids, batch_mask in create_batches(
             train_ids, train_mask, BATCH_SIZE, shuffle=True
         ):
-            loss = step(batch_ids, batch_mask)
-            mx.eval(loss)
+            with profiling.span("step", step=global_step + 1):
+                loss = step(batch_ids, batch_mask)
+                mx.eval(loss)
 
             loss_val = loss.item()
             train_losses.append(loss_val)
             epoch_losses.append(loss_val)
             global_step += 1
+            if global_step == first_step + args.profile_steps:
+                finish_profile()
 
             # ---- Log ----
             if global_step % LOG_EVERY == 0:
@@ -353,7 +473,7 @@ def main():
 
             # ---- Checkpoint ----
             if global_step % CHECKPOINT_EVERY == 0:
-                ckpt_path = CHECKPOINT_DIR / f"step_{global_step:06d}.npz"
+                ckpt_path = checkpoint_dir / f"step_{global_step:06d}.npz"
                 model.save_weights(str(ckpt_path))
                 print(f"  >> Checkpoint saved: {ckpt_path}")
 
@@ -361,39 +481,49 @@ def main():
         epoch_time = time.perf_counter() - epoch_start
         avg_epoch_loss = sum(epoch_losses) / len(epoch_losses) if epoch_losses else 0.0
 
-        # Validation loss
+        # Validation loss (and routing accuracy)
         val_losses = []
+        route_correct = route_total = 0
         for batch_ids, batch_mask in create_batches(
             val_ids, val_mask, BATCH_SIZE, shuffle=False
         ):
-            vl = loss_fn(model, batch_ids, batch_mask)
+            with profiling.span("validation_batch") as span:
+                vl = loss_fn(model, batch_ids, batch_mask)
+                span.eval(vl)
             mx.eval(vl)
             val_losses.append(vl.item())
+            if args.route_head:
+                _, route_logits, labels = route_targets(model, batch_ids, batch_mask, cloud_ids)
+                route_correct += ((route_logits > 0) == (labels > 0.5)).sum().item()
+                route_total += labels.shape[0]
         avg_val_loss = sum(val_losses) / len(val_losses) if val_losses else 0.0
 
         print(
-            f"\nEpoch {epoch + 1}/{EPOCHS} | "
+            f"\nEpoch {epoch + 1}/{epochs} | "
             f"train_loss {avg_epoch_loss:.4f} | "
             f"val_loss {avg_val_loss:.4f} | "
-            f"time {epoch_time:.1f}s"
+            + (f"route_acc {route_correct / max(route_total, 1):.3f} | " if args.route_head else "")
+            + f"time {epoch_time:.1f}s"
         )
 
         # Track best
         if avg_val_loss < best_val_loss:
             best_val_loss = avg_val_loss
-            best_path = CHECKPOINT_DIR / "best.npz"
+            best_path = checkpoint_dir / "best.npz"
             model.save_weights(str(best_path))
             print(f"  >> New best model saved: {best_path} (val_loss={best_val_loss:.4f})")
 
         print()
 
+    finish_profile()  # fewer steps than --profile-steps
+
     # ---- Save final model + config ----
-    model.save_weights(str(WEIGHTS_PATH))
+    model.save_weights(str(weights_path))
     import dataclasses
-    config_path = MODEL_DIR / "config.json"
+    config_path = output_dir / "config.json"
     with open(config_path, "w") as f:
         json.dump(dataclasses.asdict(config), f, indent=2)
-    print(f"Final model saved to {WEIGHTS_PATH}")
+    print(f"Final model saved to {weights_path}")
     print(f"Config saved to {config_path}")
     print(f"Best val_loss: {best_val_loss:.4f}")
     print(f"Total training steps: {global_step}")
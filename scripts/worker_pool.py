@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Multi-process Rune-lm server: one front process, N model worker processes.
+
+A single server process decodes on one core at a time (MLX evaluation holds
+the model, and Python holds the GIL around everything else). This runs
+--workers copies of the model in separate processes behind one front:
+
+  front    serves the same HTTP API as scripts/server.py (plus GET /workers),
+           owns the response cache, and sends each uncached /generate to
+           the worker with the fewest requests in flight; its GET /metrics
+           covers front-side requests (stage timings stay in the workers);
+           --binary-socket requests pass through to the workers, but a worker's
+           BUSY or TIMEOUT answer goes through the front's admission policy
+           (--shed-to-cloud) and counts in its /queue and /metrics
+  workers  load the model with the usual options and answer the binary
+           protocol (scripts/binary_protocol.py) on a private Unix socket
+
+Workers are fresh interpreters rather than forks of a loaded process: MLX
+starts native threads when it first evaluates, and a process forked after
+that deadlocks on its first forward pass. MLX also copies every loaded
+array into its own allocator (from an mmap'd file too), so weight pages
+cannot be shared between workers; each worker costs about one copy of the
+weights in RSS, reported per worker by GET /workers.
+
+With --profile each worker writes its own trace (TRACE.worker<pid>.json)
+when it is stopped; a request's X-Rune-Profile trace covers the front only.
+
+A health thread pings every worker each --health-interval seconds and
+restarts one whose process exited or that missed three pings in a row. A
+request that fails because its worker died is retried once on another.
+
+Usage:
+    python scripts/worker_pool.py --workers 4 [scripts/server.py options]
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tokenizers import Tokenizer
+
+from model import profiling
+from scripts import server
+from scripts.binary_protocol import (
+    STATUS_BUSY, STATUS_ERROR, STATUS_TIMEOUT, BinaryClient, ServerBusy, ServerTimeout,
+    decode_request, decode_response, encode_error, encode_request, frame,
+)
+from scripts.engine import DeadlineExceeded, QueueFull
+
+POOL: Optional["WorkerPool"] = None
+
+MAX_MISSED_PINGS = 3
+
+
+@dataclass
+class Worker:
+    index: int
+    socket_path: str
+    process: Optional[subprocess.Popen] = None
+    started: bool = False  # answered a ping since it was spawned
+    ready: bool = False
+    inflight: int = 0
+    served: int = 0
+    restarts: int = 0
+    missed_pings: int = 0
+    idle: List[BinaryClient] = field(default_factory=list)
+
+    def close_idle(self):
+        for client in self.idle:
+            client.close()
+        self.idle.clear()
+
+    def rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except (OSError, AttributeError):
+            pass
+        return None
+
+
+class WorkerPool:
+    """Worker processes running `command`, with least-loaded dispatch and restarts."""
+
+    def __init__(self, command: List[str], num_workers: int, health_interval: float = 1.0,
+                 request_timeout: float = 120.0):
+        self.command = command
+        self.health_interval = health_interval
+        self.request_timeout = request_timeout
+        self.socket_dir = tempfile.mkdtemp(prefix="rune-workers-")
+        self.workers = [Worker(i, os.path.join(self.socket_dir, f"worker-{i}.sock"))
+                        for i in range(num_workers)]
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self._stopped = threading.Event()
+        self._health_thread = None
+
+    def start(self, timeout: float = 300.0):
+        """Spawn the workers and wait until all of them answer a ping."""
+        for worker in self.workers:
+            self._spawn(worker)
+        deadline = time.monotonic() + timeout
+        while not all(w.ready for w in self.workers):
+            if time.monotonic() > deadline:
+                self.stop()
+                raise TimeoutError(f"workers not ready after {timeout:.0f}s")
+            for worker in self.workers:
+                if worker.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError(f"worker {worker.index} exited with code {worker.process.returncode}")
+                if not worker.ready:
+                    self._check(worker)
+            time.sleep(0.2)
+        self._health_thread = threading.Thread(target=self._health_loop, name="worker-health", daemon=True)
+        self._health_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self.lock:
+            for worker in self.workers:
+                worker.close_idle()
+                if worker.process is not None and worker.process.poll() is None:
+                    worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                try:
+                    worker.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    def _spawn(self, worker: Worker):
+        with self.lock:
+            worker.close_idle()
+            worker.started = worker.ready = False
+            worker.missed_pings = 0
+            worker.process = subprocess.Popen(self.command + ["--worker-socket", worker.socket_path])
+
+    # -- dispatch -----------------------------------------------------------
+
+    def _acquire(self, exclude: Optional[Worker] = None):
+        """The ready worker with the fewest requests in flight, and an idle connection to it if any."""
+        with self.available:
+            while True:
+                ready = [w for w in self.workers if w.ready and w is not exclude]
+                if ready:
+                    break
+                if not self.available.wait(timeout=self.request_timeout):
+                    raise RuntimeError("no worker available")
+            worker = min(ready, key=lambda w: (w.inflight, w.served))
+            worker.inflight += 1
+            client = worker.idle.pop() if worker.idle else None
+        return worker, client
+
+    def _release(self, worker: Worker, client: Optional[BinaryClient], failed: bool = False):
+        with self.lock:
+            worker.inflight -= 1
+            if failed:
+                worker.ready = False
+                if client is not None:
+                    client.close()
+            else:
+                worker.served += 1
+                worker.idle.append(client)
+
+    def request(self, message: bytes) -> bytes:
+        """Send a framed binary-protocol request to a worker; returns the response payload."""
+        failed = None
+        for _ in range(2):
+            worker, client = self._acquire(exclude=failed)
+            try:
+                if client is None:
+                    client = BinaryClient(worker.socket_path, timeout=self.request_timeout)
+                payload = client.request(message)
+            except (OSError, ValueError):
+                # The worker died or hung up; the health thread restarts it
+                self._release(worker, client, failed=True)
+                failed = worker
+                continue
+            self._release(worker, client)
+            return payload
+        raise RuntimeError("worker failed")
+
+    def generate(self, query: str, temperature: float = 0.0, deadline: Optional[float] = None) -> str:
+        """A worker's output; raises QueueFull if it is saturated, DeadlineExceeded on expiry."""
+        timeout_ms = 0
+        if deadline is not None:
+            timeout_ms = max(1, int((deadline - time.monotonic()) * 1000))
+        try:
+            script, _ = decode_response(self.request(encode_request(query, temperature, timeout_ms=timeout_ms)))
+        except ServerBusy as e:
+            raise QueueFull(str(e))
+        except ServerTimeout as e:
+            raise DeadlineExceeded(str(e))
+        return script
+
+    # -- health -------------------------------------------------------------
+
+    def _check(self, worker: Worker) -> bool:
+        """Ping `worker` on a fresh connection; marks it ready when it answers."""
+        try:
+            client = BinaryClient(worker.socket_path, timeout=max(1.0, self.health_interval))
+            try:
+                client.ping()
+            finally:
+                client.close()
+        except (OSError, RuntimeError):
+            return False
+        with self.available:
+            worker.started = worker.ready = True
+            worker.missed_pings = 0
+            self.available.notify_all()
+        return True
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            for worker in self.workers:
+                if self._stopped.is_set():
+                    return
+                code = worker.process.poll()
+                if code is None and not self._check(worker):
+                    if not worker.started:
+                        continue  # still loading the model
+                    worker.missed_pings += 1
+                    if worker.missed_pings < MAX_MISSED_PINGS:
+                        continue
+                    print(f"Worker {worker.index} missed {MAX_MISSED_PINGS} pings; restarting", file=sys.stderr)
+                    worker.process.kill()
+                    worker.process.wait()
+                elif code is None:
+                    continue
+                else:
+                    print(f"Worker {worker.index} exited with code {code}; restarting", file=sys.stderr)
+                self._spawn(worker)
+                worker.restarts += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"inflight": sum(w.inflight for w in self.workers), "workers": [{
+                "index": w.index,
+                "pid": w.process.pid if w.process else None,
+                "ready": w.ready,
+                "inflight": w.inflight,
+                "served": w.served,
+                "restarts": w.restarts,
+                "rss_mb": w.rss_mb(),
+            } for w in self.workers]}
+
+
+def generate(query: str, temperature: float = 0.0, deadline: Optional[float] = None) -> str:
+    """server.generate() for the front: the response cache, then a worker."""
+    cacheable = server.RESPONSE_CACHE is not None and temperature == 0.0
+    if cacheable:
+        script = server.RESPONSE_CACHE.get(query)
+        if script is not None:
+            server.METRICS.observe_generation(None, script == "PASS_TO_CLOUD", cached=True)
+            return script
+    with profiling.span("worker"):
+        script = POOL.generate(query, temperature, deadline)
+    server.METRICS.observe_generation(None, script.strip() == "PASS_TO_CLOUD")
+    if cacheable:
+        server.RESPONSE_CACHE.put(query, script)
+    return script
+
+
+def queue_stats() -> dict:
+    """The front's /queue: requests queue inside the workers, so it reports how many are in flight."""
+    with server.ADMISSION_LOCK:
+        counts = dict(server.ADMISSION)
+    return {"inflight": sum(w.inflight for w in POOL.workers), **counts}
+
+
+class PoolHandler(server.OsascriptHandler):
+    def do_GET(self):
+        if self.path == "/workers":
+            self._send_json(POOL.stats())
+        elif self.path == "/queue":
+            self._send_json(queue_stats())
+        elif self.path == "/metrics":
+            self._send(server.metrics_text(queue_stats()).encode("utf-8"), server.METRICS_CONTENT_TYPE)
+        else:
+            super().do_GET()
+
+    def generate(self, query: str, temperature: float, deadline: Optional[float] = None) -> str:
+        return generate(query, temperature, deadline)
+
+
+class UnixPoolHandler(PoolHandler):
+    disable_nagle_algorithm = False
+
+
+class PoolBinaryHandler(server.BinaryHandler):
+    def respond(self, payload: bytes) -> bytes:
+        # Frames are passed through to a worker unchanged (no response cache);
+        # shed and expired replies go through the front's admission policy
+        try:
+            response = POOL.request(frame(payload))
+        except Exception as e:
+            return encode_error(str(e))
+        status = response[0] if response else STATUS_ERROR
+        if status == STATUS_BUSY:
+            return server.binary_overload(response[1:].decode("utf-8"), decode_request(payload)[2])
+        if status == STATUS_TIMEOUT:
+            server.count_admission("expired")
+        return frame(response)
+
+
+def run_worker(args: argparse.Namespace, parser: argparse.ArgumentParser):
+    """Worker process: load the model and answer the binary protocol on --worker-socket."""
+    args.cache_size = 0  # the front owns the response cache
+    args.shed_to_cloud = False  # and decides how shed requests are answered
+    if args.profile:
+        root, ext = os.path.splitext(args.profile)
+        args.profile = f"{root}.worker{os.getpid()}{ext or '.json'}"
+    server.setup(args, parser)
+    # The front keeps idle connections open for reuse
+    server.BinaryHandler.timeout = None
+    server.remove_stale_socket(args.worker_socket)  # left by a worker that crashed
+    unix_server = server.UnixServer(args.worker_socket, server.BinaryHandler)
+
+    def exit_with_front(front_pid: int):
+        while os.getppid() == front_pid:
+            time.sleep(1.0)
+        os._exit(1)
+
+    def terminate(*_):
+        if server.PROFILE_PATH:
+            profiling.save(server.PROFILE_PATH)
+        os._exit(0)
+
+    threading.Thread(target=exit_with_front, args=(os.getppid(),), daemon=True).start()
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the front stops the workers
+    unix_server.serve_forever()
+
+
+def main():
+    global POOL
+
+    parser = server.build_parser("Rune-lm server with a pool of model worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Model worker processes")
+    parser.add_argument("--health-interval", type=float, default=1.0,
+                        help="Seconds between worker pings")
+    parser.add_argument("--worker-socket", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker_socket:
+        run_worker(args, parser)
+        return
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    POOL = WorkerPool([sys.executable, os.path.abspath(__file__)] + sys.argv[1:],
+                      args.workers, args.health_interval)
+    print(f"Starting {args.workers} workers...")
+    POOL.start()
+    rss = [w.rss_mb() for w in POOL.workers]
+    if all(r is not None for r in rss):
+        print(f"Workers ready: {sum(rss):.0f} MB RSS ({sum(rss) / len(rss):.0f} MB each)")
+    server.RESPONSE_CACHE = server.load_response_cache(args)
+    server.configure_admission(args)
+    if args.shed_to_cloud:
+        # Degraded binary answers with token ids are tokenized here
+        server.TOKENIZER = Tokenizer.from_file(os.path.join(args.model_dir, "tokenizer.json"))
+    print(f"  GET  /workers  → worker processes and load")
+    try:
+        server.serve(args, PoolHandler, UnixPoolHandler, PoolBinaryHandler)
+    finally:
+        POOL.stop()
+        if server.RESPONSE_CACHE is not None:
+            server.RESPONSE_CACHE.save()
+
+
+if __name__ == "__main__":
+    main()